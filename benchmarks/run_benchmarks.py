@@ -0,0 +1,348 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+"""Offline benchmarks of tiling and normalization on synthetic slides.
+
+Every benchmark case runs in a fresh process, so that its peak memory (max RSS of the
+process and of its workers) is measured on its own. Results are written as JSON and
+can be compared with the results of another commit:
+
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --output new.json --compare bench.json
+"""
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Third Party
+import numpy as np
+from histolab.masks import TissueMask
+from PIL import Image
+
+# patho_pix
+from benchmarks.synthetic_slides import write_synthetic_slide
+from patho_pix.io import load_mask, load_wsi
+from patho_pix.normalization import StainNormalizer
+from patho_pix.pipeline import slide_pipeline
+from patho_pix.tiling import tile_wsi, tile_wsi_mask
+from patho_pix.utils import ArtifactDetector, AwesomeTiler, TissueScorer
+
+RESULTS_VERSION = 1
+
+
+# ---------------------------------------------------- #
+#                   Benchmark Cases                    #
+# ---------------------------------------------------- #
+def bench_coordinates(path_img, tile_size):
+    """Grid coordinate generation (tissue mask + grid), in coordinates/s."""
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tile_dir:
+        wsi = load_wsi(path_img, tile_dir)
+        tiler = AwesomeTiler(tile_size=tile_size, check_tissue=True, tissue_percent=10.0)
+        start = time.perf_counter()
+        coordinates = list(tiler._grid_coordinates_generator(wsi, TissueMask()))
+        return time.perf_counter() - start, len(coordinates), "coordinates"
+
+
+def bench_tile_wsi(path_img, tile_size, workers):
+    """Image tiling with ``tile_wsi``, in tiles/s."""
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tile_dir:
+        wsi = load_wsi(path_img, tile_dir)
+        start = time.perf_counter()
+        metadata = tile_wsi(wsi, tile_size=tile_size, workers=workers)
+        return time.perf_counter() - start, len(metadata), "tiles"
+
+
+def bench_tile_wsi_mask(path_img, path_mask, tile_size, workers):
+    """Image and mask tiling with ``tile_wsi_mask``, in tiles/s."""
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tile_dir:
+        wsi = load_wsi(path_img, os.path.join(tile_dir, "image"))
+        mask = load_mask(path_mask, os.path.join(tile_dir, "mask"))
+        start = time.perf_counter()
+        metadata = tile_wsi_mask(wsi, mask, tile_size=tile_size, workers=workers)
+        return time.perf_counter() - start, len(metadata), "tiles"
+
+
+def bench_normalization(path_img, tile_size, n_tiles, method, batch):
+    """Stain normalization of tiles read from the slide tissue, in tiles/s."""
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tile_dir:
+        wsi = load_wsi(path_img, tile_dir)
+        tiler = AwesomeTiler(tile_size=tile_size)
+        coordinates = list(tiler._grid_coordinates_generator(wsi, TissueMask()))[:n_tiles]
+        tiles = np.stack([
+            np.asarray(wsi.extract_tile(coords, tile_size=tile_size, level=0).image.convert("RGB"))
+            for coords in coordinates
+        ])
+    normalizer = StainNormalizer(method=method).fit(Image.fromarray(tiles[0]))
+    pil_tiles = [Image.fromarray(tile) for tile in tiles]
+    start = time.perf_counter()
+    if batch:
+        normalizer.transform_batch(tiles)
+    else:
+        for tile in pil_tiles:
+            normalizer.transform(tile)
+    return time.perf_counter() - start, len(tiles), "tiles"
+
+
+def bench_tissue_check(path_img, tile_size, n_tiles, batch):
+    """Tissue check of tiles read from the slide, per tile with histolab or by one
+    ``TissueScorer`` batch, in tiles/s. The batch case also reports the fraction of
+    tiles on which both checks agree."""
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tile_dir:
+        wsi = load_wsi(path_img, tile_dir)
+        tiler = AwesomeTiler(tile_size=tile_size)
+        coordinates = list(tiler._grid_coordinates_generator(wsi, TissueMask()))[:n_tiles]
+        tiles = [wsi.extract_tile(coords, tile_size=tile_size, level=0) for coords in coordinates]
+        scorer = TissueScorer().fit(wsi.thumbnail)
+    start = time.perf_counter()
+    if batch:
+        enough, _ = scorer.score(np.stack([np.asarray(tile.image) for tile in tiles]), 10.0)
+    else:
+        enough = np.array([tile.has_enough_tissue(10.0) for tile in tiles])
+    seconds = time.perf_counter() - start
+    extra = {}
+    if batch:
+        reference = np.array([tile.has_enough_tissue(10.0) for tile in tiles])
+        extra["agreement"] = round(float(np.mean(enough == reference)), 4)
+    return seconds, len(tiles), "tiles", extra
+
+
+def bench_artifact_check(path_img, tile_size, n_tiles):
+    """Artifact scores (focus, pen ink, darkness) of one ``ArtifactDetector`` batch of
+    tiles read from the slide, in tiles/s."""
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tile_dir:
+        wsi = load_wsi(path_img, tile_dir)
+        tiler = AwesomeTiler(tile_size=tile_size)
+        coordinates = list(tiler._grid_coordinates_generator(wsi, TissueMask()))[:n_tiles]
+        tiles = np.stack([
+            np.asarray(wsi.extract_tile(coords, tile_size=tile_size, level=0).image)
+            for coords in coordinates
+        ])
+    start = time.perf_counter()
+    ArtifactDetector().score(tiles)
+    return time.perf_counter() - start, len(tiles), "tiles"
+
+
+def bench_pipeline(path_img, tile_size, streaming):
+    """Tiling, stain normalization and export of the normalized tiles, in tiles/s:
+    with ``slide_pipeline`` in memory, or by normalizing the saved tiles afterwards
+    (tiles written, read back, normalized and written again)."""
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tile_dir:
+        wsi = load_wsi(path_img, tile_dir)
+        tiler = AwesomeTiler(tile_size=tile_size, tissue_percent=10.0, prefix="patho-fix.")
+        coords = next(iter(tiler._grid_coordinates_generator(wsi, TissueMask())))
+        normalizer = StainNormalizer().fit(wsi.extract_tile(coords, tile_size=tile_size, level=0).image)
+        start = time.perf_counter()
+        if streaming:
+            pipeline, exporter = slide_pipeline(tiler, wsi, normalizer=normalizer)
+            summary = pipeline.run()
+            n_tiles = len(exporter.metadata)
+        else:
+            metadata = tile_wsi(wsi, tile_size=tile_size)
+            for tile_filename in metadata:
+                path_tile = os.path.join(tile_dir, tile_filename)
+                image = np.asarray(Image.open(path_tile).convert("RGB"))
+                Image.fromarray(normalizer.transform_batch(image[np.newaxis])[0]).save(path_tile)
+            n_tiles = len(metadata)
+        seconds = time.perf_counter() - start
+    extra = {}
+    if streaming:
+        extra["stages"] = {
+            name: stage["capacity_per_s"] for name, stage in summary["pipeline"].items()
+        }
+    return seconds, n_tiles, "tiles", extra
+
+
+BENCHMARKS = {
+    "coordinates": bench_coordinates,
+    "tile_wsi": bench_tile_wsi,
+    "tile_wsi_mask": bench_tile_wsi_mask,
+    "normalization": bench_normalization,
+    "tissue_check": bench_tissue_check,
+    "artifact_check": bench_artifact_check,
+    "pipeline": bench_pipeline,
+}
+
+
+def _cases(slides, tile_size, workers, n_tiles):
+    """Return the (benchmark, case id, arguments) of every case to run."""
+    cases = []
+    for slide_id, (path_img, path_mask) in slides.items():
+        cases.append(("coordinates", slide_id, dict(path_img=path_img, tile_size=tile_size)))
+        for n_workers in sorted({1, workers}):
+            cases.append((
+                "tile_wsi", f"{slide_id}-w{n_workers}",
+                dict(path_img=path_img, tile_size=tile_size, workers=n_workers),
+            ))
+            cases.append((
+                "tile_wsi_mask", f"{slide_id}-w{n_workers}",
+                dict(path_img=path_img, path_mask=path_mask, tile_size=tile_size, workers=n_workers),
+            ))
+    # Normalization throughput does not depend on the slide size
+    path_img, _ = next(iter(slides.values()))
+    for method, batch in [("macenko", False), ("macenko", True), ("reinhard", False)]:
+        cases.append((
+            "normalization", f"{method}-{'batch' if batch else 'tile'}",
+            dict(path_img=path_img, tile_size=(256, 256), n_tiles=n_tiles, method=method, batch=batch),
+        ))
+    for batch in [False, True]:
+        cases.append((
+            "tissue_check", "batch" if batch else "tile",
+            dict(path_img=path_img, tile_size=tile_size, n_tiles=n_tiles, batch=batch),
+        ))
+    cases.append((
+        "artifact_check", "batch", dict(path_img=path_img, tile_size=tile_size, n_tiles=n_tiles),
+    ))
+    for streaming in [False, True]:
+        cases.append((
+            "pipeline", "streaming" if streaming else "disk",
+            dict(path_img=path_img, tile_size=tile_size, streaming=streaming),
+        ))
+    return cases
+
+
+# ---------------------------------------------------- #
+#                  Measurement Helpers                 #
+# ---------------------------------------------------- #
+def _peak_rss_mb():
+    """Peak resident memory of this process and of its finished workers, in MiB."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS, in KiB elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def _run_case(benchmark, kwargs):
+    # Benchmarks may return a dictionary of extra measures, e.g. an accuracy
+    seconds, items, unit, *extra = BENCHMARKS[benchmark](**kwargs)
+    return {
+        "seconds": round(seconds, 4),
+        "items": items,
+        "throughput": round(items / seconds, 3) if seconds > 0 else None,
+        "unit": f"{unit}/s",
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        **(extra[0] if extra else {}),
+    }
+
+
+def run_case(benchmark, case_id, kwargs):
+    """Run one benchmark case in a fresh process and return its result record."""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        result = executor.submit(_run_case, benchmark, kwargs).result()
+    arguments = {k: (list(v) if isinstance(v, tuple) else v)
+                 for k, v in kwargs.items() if not k.startswith("path_")}
+    return {"benchmark": benchmark, "case": case_id, "arguments": arguments, **result}
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# ---------------------------------------------------- #
+#                 Comparison of Results                #
+# ---------------------------------------------------- #
+def compare_results(results, baseline, tolerance=0.2):
+    """Print the throughput of ``results`` relative to ``baseline`` and return the
+    (benchmark, case) of the cases slower than ``1 - tolerance`` times the baseline."""
+    baseline_cases = {(r["benchmark"], r["case"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'benchmark':<15} {'case':<28} {'baseline':>10} {'current':>10} {'ratio':>7} {'rss MiB':>8}")
+    for record in results["results"]:
+        key = (record["benchmark"], record["case"])
+        reference = baseline_cases.get(key)
+        if reference is None or not reference["throughput"] or not record["throughput"]:
+            continue
+        ratio = record["throughput"] / reference["throughput"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(key)
+            flag = "  <-- slower"
+        print(f"{key[0]:<15} {key[1]:<28} {reference['throughput']:>10.2f} "
+              f"{record['throughput']:>10.2f} {ratio:>7.2f} {record['peak_rss_mb']:>8.0f}{flag}")
+    return regressions
+
+
+# ---------------------------------------------------- #
+#                         Main                         #
+# ---------------------------------------------------- #
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4096, 8192],
+                        help="Side length in pixels of the synthetic slides")
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.2, 0.6],
+                        help="Tissue fraction of the synthetic slides")
+    parser.add_argument("--tile-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Worker processes of the parallel tiling cases")
+    parser.add_argument("--n-tiles", type=int, default=128,
+                        help="Number of tiles of the normalization cases")
+    parser.add_argument("--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--data-dir", default=os.path.join("output", "benchmarks", "slides"),
+                        help="Directory of the (cached) synthetic slides")
+    parser.add_argument("--output", default=os.path.join("output", "benchmarks", "results.json"))
+    parser.add_argument("--compare", help="Results JSON of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative throughput loss reported as a regression")
+    args = parser.parse_args(argv)
+
+    slides = {
+        f"{size}px-d{density:g}": write_synthetic_slide(args.data_dir, size, density)
+        for size in args.sizes
+        for density in args.densities
+    }
+    records = []
+    for benchmark, case_id, kwargs in _cases(
+        slides, (args.tile_size, args.tile_size), args.workers, args.n_tiles
+    ):
+        if benchmark not in args.benchmarks:
+            continue
+        record = run_case(benchmark, case_id, kwargs)
+        print(f"{benchmark:<15} {case_id:<28} {record['throughput']:>10.2f} {record['unit']:<15} "
+              f"{record['peak_rss_mb']:>8.0f} MiB"
+              + (f"  agreement {record['agreement']:.3f}" if "agreement" in record else ""), flush=True)
+        records.append(record)
+
+    results = {"version": RESULTS_VERSION, "environment": _environment(), "results": records}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as fd:
+        json.dump(results, fd, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        if compare_results(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import os
+
+# Third Party
+import numpy as np
+import tifffile
+from PIL import Image
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+# Level 0 pixels covered by one cell of the coarse tissue layout
+TISSUE_CELL = 32
+TIFF_TILE = 256
+BACKGROUND = 235
+STAIN = np.array([150, 60, 140])
+
+
+# ---------------------------------------------------- #
+#          Synthetic Pyramidal Slide + Mask Pair       #
+# ---------------------------------------------------- #
+def write_synthetic_slide(directory, size=8192, density=0.4, seed=0):
+    """Write a tiled pyramidal H&E-like slide and its label mask as TIFF files.
+
+    The tissue layout is a smoothed random field thresholded so that about ``density``
+    of the slide is tissue. Both files are written tile by tile, level by level
+    (downsample 4 until the level fits in 1024 px), so that slides larger than the
+    memory can be generated. The left half of the tissue is labelled white in the
+    mask, everything else is black. Existing files are reused.
+
+    Returns the paths of the image and the mask TIFF files.
+    """
+    name = f"synthetic-{size}px-d{density:g}-s{seed}"
+    path_img = os.path.join(directory, f"{name}.image.tiff")
+    path_mask = os.path.join(directory, f"{name}.mask.tiff")
+    if os.path.exists(path_img) and os.path.exists(path_mask):
+        return path_img, path_mask
+
+    os.makedirs(directory, exist_ok=True)
+    tissue_layout = _tissue_layout(size, density, np.random.default_rng(seed))
+    for path, render in [(path_img, _render_image), (path_mask, _render_mask)]:
+        with tifffile.TiffWriter(path + ".tmp", bigtiff=True) as tif:
+            downsample = 1
+            while True:
+                level_size = -(-size // downsample)
+                tif.write(
+                    _level_tiles(render, tissue_layout, size, downsample, seed),
+                    shape=(level_size, level_size, 3),
+                    dtype=np.uint8,
+                    tile=(TIFF_TILE, TIFF_TILE),
+                    photometric="rgb",
+                    compression="zlib",
+                    subfiletype=0 if downsample == 1 else 1,
+                )
+                if level_size <= 1024:
+                    break
+                downsample *= 4
+        os.replace(path + ".tmp", path)
+    return path_img, path_mask
+
+
+def _tissue_layout(size, density, rng):
+    """Return the boolean tissue layout of the slide, one value per ``TISSUE_CELL``."""
+    n_cells = -(-size // TISSUE_CELL)
+    noise = rng.random((max(n_cells // 16, 2), max(n_cells // 16, 2))).astype(np.float32)
+    field = np.asarray(
+        Image.fromarray(noise, mode="F").resize((n_cells, n_cells), Image.BICUBIC)
+    )
+    return field >= np.quantile(field, 1 - density)
+
+
+def _level_tiles(render, tissue_layout, size, downsample, seed):
+    """Yield the TIFF tiles of one pyramid level in row-major order."""
+    level_size = -(-size // downsample)
+    for y in range(0, level_size, TIFF_TILE):
+        for x in range(0, level_size, TIFF_TILE):
+            # Level 0 coordinates of the tile pixels
+            ys = (y + np.arange(TIFF_TILE)) * downsample
+            xs = (x + np.arange(TIFF_TILE)) * downsample
+            tissue = tissue_layout[
+                np.minimum(ys // TISSUE_CELL, len(tissue_layout) - 1)[:, None],
+                np.minimum(xs // TISSUE_CELL, len(tissue_layout) - 1)[None, :],
+            ]
+            tissue &= (ys < size)[:, None] & (xs < size)[None, :]
+            rng = np.random.default_rng((seed, downsample, y, x))
+            yield render(tissue, xs, size, rng)
+
+
+def _render_image(tissue, xs, size, rng):
+    tile = np.full(tissue.shape + (3,), BACKGROUND, dtype=np.uint8)
+    stain = rng.integers(0, 60, (int(tissue.sum()), 3)) + STAIN
+    tile[tissue] = stain.astype(np.uint8)
+    return tile
+
+
+def _render_mask(tissue, xs, size, rng):
+    tile = np.zeros(tissue.shape + (3,), dtype=np.uint8)
+    tile[tissue & (xs < size // 2)[None, :]] = 255
+    return tile
@@ -0,0 +1,193 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+from typing import Dict, Iterator, Optional, Tuple
+
+# Third Party
+import numpy as np
+from histolab.masks import BinaryMask, TissueMask
+from histolab.slide import Slide
+from histolab.types import CoordinatePair
+
+# patho_pix
+from patho_pix.normalization import StainNormalizer
+from patho_pix.pipeline import _prefetch
+from patho_pix.utils.artifacts import ArtifactDetector
+from patho_pix.utils.custom_tiler import (AwesomeTiler, _chunk_bounds,
+                                          _slide_spec)
+
+try:
+    # Third Party
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:  # pragma: no cover
+    # Without torch the dataset is a plain iterable, iterated by a single process
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+
+# ---------------------------------------------------- #
+#               Streaming Tile Dataset                 #
+# ---------------------------------------------------- #
+class TileDataset(IterableDataset):
+    """Stream the tiles of a slide (and of its mask) as arrays, without writing them.
+
+    The grid of candidate tiles is computed once, when the dataset is created. Each
+    iteration reads, checks and yields the tiles straight from the slides. In a
+    ``torch.utils.data.DataLoader`` with ``num_workers > 0``, the grid is split into
+    one contiguous shard per worker, and every worker opens its own slide handles.
+
+    Items are ``(image, mask, coords)`` tuples, or ``(image, coords)`` without mask
+    slide: ``image`` is an (H, W, 3) uint8 array, ``mask`` an (H, W) uint8 array of
+    class values ("label" mode) or an (H, W, 3) uint8 array ("rgb" mode), ``coords``
+    the (x_ul, y_ul, x_br, y_br) int64 array of the level 0 tile coordinates.
+
+    Arguments
+    ---------
+    wsi_img : Slide
+        Image slide from which to extract the tiles.
+    wsi_label : Slide, optional
+        Mask slide from which to extract the mask tiles. Default is None.
+    tile_size : Tuple[int, int], optional
+        (width, height) of the extracted tiles. Default is (1024, 1024).
+    level : int, optional
+        Level from which to extract the tiles. Default is 0.
+    check_tissue : bool, optional
+        Whether to skip the tiles without enough tissue. Default is True.
+    tissue_percent : float, optional
+        Minimum percentage of tissue of a tile. Default is 10.0.
+    pixel_overlap : int, optional
+        Number of overlapping pixels between two adjacent tiles. Default is 0.
+    extraction_mask : BinaryMask, optional
+        BinaryMask object defining the tissue to tile. Default ``TissueMask``.
+    mask_mode : str, {"label", "rgb"}
+        "label" yields class values mapped through ``mask_lut``, "rgb" the mask
+        colours. Default is "label".
+    mask_lut : Dict[Tuple[int, int, int], int], optional
+        Colour-to-class lookup table of the "label" mode, see ``AwesomeTiler``.
+    prefilter : bool, optional
+        Whether to skip the tiles clearly without tissue before reading them, see
+        ``AwesomeTiler``. Default is False.
+    artifact_detector : ArtifactDetector, optional
+        Drops the tiles with artifacts (blur, pen ink, folds) before they are
+        normalized, see ``AwesomeTiler``. Default is None.
+    normalizer : StainNormalizer, optional
+        Fitted normalizer applied on the fly to the image tiles, ``chunk_size`` at a
+        time with ``StainNormalizer.transform_batch``. Default is None.
+    chunk_size : int, optional
+        Number of tiles read and normalized together. Default is 16.
+    prefetch : int, optional
+        Number of chunks read ahead by a background thread of every worker. Default
+        is 0, no prefetching.
+    """
+
+    def __init__(
+        self,
+        wsi_img: Slide,
+        wsi_label: Optional[Slide] = None,
+        tile_size: Tuple[int, int] = (1024, 1024),
+        level: int = 0,
+        check_tissue: bool = True,
+        tissue_percent: float = 10.0,
+        pixel_overlap: int = 0,
+        extraction_mask: BinaryMask = TissueMask(),
+        mask_mode: str = "label",
+        mask_lut: Optional[Dict[Tuple[int, int, int], int]] = None,
+        prefilter: bool = False,
+        artifact_detector: Optional[ArtifactDetector] = None,
+        normalizer: Optional[StainNormalizer] = None,
+        chunk_size: int = 16,
+        prefetch: int = 0,
+    ):
+        if mask_mode not in ("label", "rgb"):
+            raise ValueError(f"mask_mode must be 'label' or 'rgb' ({mask_mode})")
+        self.tiler = AwesomeTiler(
+            tile_size=tile_size,
+            level=level,
+            check_tissue=check_tissue,
+            tissue_percent=tissue_percent,
+            pixel_overlap=pixel_overlap,
+            mask_mode=mask_mode,
+            mask_lut=mask_lut,
+            prefilter=prefilter,
+            artifact_detector=artifact_detector,
+        )
+        self.tiler._prepare(wsi_img)
+        self.img_spec = _slide_spec(wsi_img)
+        self.label_spec = _slide_spec(wsi_label) if wsi_label is not None else None
+        self.normalizer = normalizer
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+
+        candidates = list(
+            enumerate(self.tiler._grid_coordinates_generator(wsi_img, extraction_mask))
+        )
+        if prefilter and check_tissue:
+            candidates = self.tiler._prefilter_candidates(wsi_img, candidates)
+        self.coordinates = np.array(
+            [coords for _, coords in candidates], dtype="int64"
+        ).reshape(-1, 4)
+
+    def __len__(self) -> int:
+        """Number of candidate tiles. Tiles without enough tissue are skipped while
+        iterating, so fewer items can be yielded."""
+        return len(self.coordinates)
+
+    def __iter__(self) -> Iterator[tuple]:
+        worker_info = get_worker_info()
+        if worker_info is None:
+            start, stop = 0, len(self.coordinates)
+        else:
+            start, stop = _chunk_bounds(
+                len(self.coordinates), worker_info.num_workers
+            )[worker_info.id]
+        chunks = self._chunks(self.coordinates[start:stop])
+        if self.prefetch > 0:
+            chunks = _prefetch(chunks, self.prefetch)
+        for chunk in chunks:
+            yield from chunk
+
+    # ------- implementation helpers -------
+
+    def _chunks(self, coordinates: np.ndarray) -> Iterator[list]:
+        """Read, check and normalize the tiles at ``coordinates``, ``chunk_size`` at a
+        time, with the slide handles of the calling process."""
+        wsi_img = Slide(*self.img_spec)
+        wsi_label = Slide(*self.label_spec) if self.label_spec is not None else None
+        tiler = self.tiler
+
+        for start in range(0, len(coordinates), self.chunk_size):
+            candidates = list(enumerate(
+                CoordinatePair(*row.tolist())
+                for row in coordinates[start:start + self.chunk_size]
+            ))
+            mask_reader = tiler._mask_reader(wsi_label, candidates)
+            images, masks, tile_coords = [], [], []
+            for _, tile, coords in tiler._indexed_tiles(wsi_img, candidates):
+                images.append(np.asarray(tile.image.convert("RGB")))
+                tile_coords.append(np.array(coords, dtype="int64"))
+                if wsi_label is not None:
+                    masks.append(self._mask_tile(wsi_label, coords, mask_reader))
+            if not images:
+                continue
+            if self.normalizer is not None:
+                images = self.normalizer.transform_batch(
+                    np.stack(images), chunk_size=self.chunk_size
+                )
+            if wsi_label is None:
+                yield list(zip(images, tile_coords))
+            else:
+                yield list(zip(images, masks, tile_coords))
+
+    def _mask_tile(self, wsi_label: Slide, coords, reader=None) -> np.ndarray:
+        if self.tiler.mask_mode == "label":
+            return self.tiler._tile_mask_labels(wsi_label, coords, reader)
+        return np.asarray(
+            self.tiler._tile_mask_extract(wsi_label, coords, reader).image.convert("RGB")
+        )
@@ -8,9 +8,6 @@
 # Standard Library
 import os
 
-# Third Party
-from histolab.slide import Slide
-
 
 # -----------------------------------------------------#
 #                    Image Loader                      #
@@ -19,6 +16,9 @@ def load_wsi(path_slide, path_tile_dir, use_largeimage=False):
     # Create path tile directory
     if not os.path.exists(path_tile_dir):
         os.mkdir(path_tile_dir)
+    # Third Party
+    from histolab.slide import Slide
+
     # Load WSI scan via histolab
     wsi_slide = Slide(
         path=path_slide, processed_path=path_tile_dir, use_largeimage=use_largeimage
@@ -34,6 +34,9 @@ def load_mask(path_slide, path_tile_dir, use_largeimage=False):
     # Create path tile directory
     if not os.path.exists(path_tile_dir):
         os.mkdir(path_tile_dir)
+    # Third Party
+    from histolab.slide import Slide
+
     # Load WSI mask via histolab
     wsi_slide = Slide(
         path=path_slide, processed_path=path_tile_dir, use_largeimage=use_largeimage
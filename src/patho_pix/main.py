@@ -2,3 +2,372 @@
 #  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
 #  Copyright:    Patho-Pix Team - 2024                        #
 # =========================================================== #
+"""Tile a cohort of slides (and masks) with one command.
+
+The slides are read from a directory (``<name>.image.<ext>`` files with an optional
+``<name>.mask.<ext>`` next to them; other slide files are tiled without mask) or
+from a CSV file with a ``slide`` and an optional ``mask`` column. Slides are tiled
+largest first by a pool of processes, within a memory budget. Every finished slide
+(or failure) is appended to a JSON lines run report as soon as it is known.
+
+    patho-pix slides/ --output tiles/ --concurrency 16 --memory-budget 64G
+"""
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import argparse
+import csv
+import importlib.util
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger("patho_pix")
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+SLIDE_EXTENSIONS = (
+    ".tif", ".tiff", ".svs", ".ndpi", ".mrxs", ".scn", ".vms", ".vmu", ".bif",
+    ".jpg", ".jpeg", ".png",
+)
+# Resident memory of a process with the imaging libraries loaded, per slide job and
+# per tile worker of the job
+PROCESS_MEMORY = 512 << 20
+# Tiles held in memory per process (read, tissue check, encode and queued results)
+TILES_IN_FLIGHT = 64
+MEMORY_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+# Every slide is tiled in a new worker process where the pool supports it (Python
+# 3.11+), so that the peak RSS of its record is the peak of this slide. Older pools
+# reuse their workers and report the peak of the worker over all its slides.
+FRESH_WORKERS = sys.version_info >= (3, 11)
+PEAK_RSS_FIELD = "peak_rss_mb" if FRESH_WORKERS else "worker_peak_rss_mb"
+
+
+class SlideJob(NamedTuple):
+    """A slide (and its optional mask) to tile."""
+    name: str
+    slide: str
+    mask: Optional[str]
+    size: int
+
+
+# ---------------------------------------------------- #
+#                    Slide Discovery                   #
+# ---------------------------------------------------- #
+def discover_slides(path: str) -> List[SlideJob]:
+    """Return the slide jobs listed in the CSV file or found in the directory
+    ``path``, largest slide first."""
+    if os.path.isdir(path):
+        pairs = _pairs_from_directory(path)
+    else:
+        pairs = _pairs_from_csv(path)
+
+    jobs = []
+    names = set()
+    for slide, mask in pairs:
+        name = _slide_name(slide)
+        # Unique output directory per slide
+        unique_name, counter = name, 1
+        while unique_name in names:
+            counter += 1
+            unique_name = f"{name}-{counter}"
+        names.add(unique_name)
+        size = os.path.getsize(slide) + (os.path.getsize(mask) if mask else 0)
+        jobs.append(SlideJob(unique_name, slide, mask, size))
+    return sorted(jobs, key=lambda job: job.size, reverse=True)
+
+
+def _slide_name(path: str) -> str:
+    name = os.path.basename(path)
+    for extension in SLIDE_EXTENSIONS:
+        if name.lower().endswith(extension):
+            name = name[: -len(extension)]
+            break
+    return name[: -len(".image")] if name.endswith(".image") else name
+
+
+def _pairs_from_directory(directory: str):
+    files = sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.lower().endswith(SLIDE_EXTENSIONS)
+    )
+    masks = {
+        _slide_name(path.replace(".mask.", ".image.")): path
+        for path in files if ".mask." in os.path.basename(path)
+    }
+    return [
+        (path, masks.get(_slide_name(path)))
+        for path in files if ".mask." not in os.path.basename(path)
+    ]
+
+
+def _pairs_from_csv(path: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as fd:
+        rows = list(csv.DictReader(fd))
+    if rows and "slide" not in rows[0]:
+        raise ValueError(f"{path} has no 'slide' column")
+    return [
+        (
+            os.path.join(directory, row["slide"]),
+            os.path.join(directory, row["mask"]) if row.get("mask") else None,
+        )
+        for row in rows
+    ]
+
+
+# ---------------------------------------------------- #
+#                     Slide Worker                     #
+# ---------------------------------------------------- #
+def estimate_memory(tile_size, tile_workers: int) -> int:
+    """Return the estimated peak memory in bytes of tiling one slide."""
+    processes = 1 + (tile_workers if tile_workers > 1 else 0)
+    return processes * (PROCESS_MEMORY + tiles_memory(tile_size))
+
+
+def tiles_memory(tile_size) -> int:
+    """Return the memory in bytes of the tiles and buffers of one process, the
+    ``memory_budget`` of its extraction when the run has a budget."""
+    # Image and mask tile, RGBA
+    tile_bytes = 2 * 4 * tile_size[0] * tile_size[1]
+    return TILES_IN_FLIGHT * tile_bytes
+
+
+def process_slide(job: SlideJob, options: dict) -> dict:
+    """Tile one slide and return its run report record. Runs in a worker process."""
+    # patho_pix
+    from patho_pix.io import load_mask, load_wsi
+    from patho_pix.tiling import tile_wsi, tile_wsi_mask
+    from patho_pix.utils import ArtifactDetector, TarShardWriter
+
+    start = time.perf_counter()
+    slide_dir = os.path.join(options["output"], job.name)
+    os.makedirs(slide_dir, exist_ok=True)
+    kwargs = dict(
+        tile_size=options["tile_size"],
+        workers=options["tile_workers"],
+        prefilter=options["prefilter"],
+        return_stats=True,
+    )
+    if options.get("memory_budget") is not None:
+        # Keep every process of the slide within the memory it was scheduled with
+        kwargs["memory_budget"] = tiles_memory(options["tile_size"])
+    if options.get("drop_artifacts"):
+        kwargs["artifact_detector"] = ArtifactDetector()
+    if options["manifest"]:
+        kwargs["manifest"] = os.path.join(slide_dir, "manifest.jsonl")
+    writer = None
+    if options["writer"] == "tar":
+        writer = TarShardWriter(os.path.join(slide_dir, "shards"), append=options["manifest"])
+        kwargs["writer"] = writer
+
+    try:
+        wsi = load_wsi(job.slide, os.path.join(slide_dir, "image"))
+        if job.mask is not None:
+            mask = load_mask(job.mask, os.path.join(slide_dir, "mask"))
+            metadata, stats = tile_wsi_mask(wsi, mask, mask_mode=options["mask_mode"], **kwargs)
+        else:
+            metadata, stats = tile_wsi(wsi, **kwargs)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    record = {"tiles": len(metadata)}
+    if options["metadata_format"] != "none":
+        path_metadata = os.path.join(slide_dir, f"metadata.{options['metadata_format']}")
+        metadata.save(path_metadata)
+        record["metadata"] = path_metadata
+    record.update(
+        seconds=round(time.perf_counter() - start, 3),
+        stats=stats,
+    )
+    record[PEAK_RSS_FIELD] = round(_peak_rss_mb(), 1)
+    return record
+
+
+def _run_job(job: SlideJob, options: dict) -> dict:
+    """Call ``process_slide``, turning exceptions into a failure record."""
+    try:
+        return dict(process_slide(job, options), status="ok")
+    except Exception as error:
+        return {
+            "status": "failed",
+            "error": f"{type(error).__name__}: {error}",
+            "traceback": traceback.format_exc(),
+        }
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident memory of this process and of its finished children since the
+    process started, in MiB."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS, in KiB elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+# ---------------------------------------------------- #
+#                   Batch Scheduling                   #
+# ---------------------------------------------------- #
+def run_batch(jobs: List[SlideJob], options: dict, report_path: str,
+              concurrency: int = 1, memory_budget: Optional[int] = None) -> dict:
+    """Tile ``jobs`` with a pool of ``concurrency`` processes and return the summary.
+
+    Jobs are submitted in order (largest slide first) as long as the estimated memory
+    of the running jobs stays within ``memory_budget``; a job is always started when
+    nothing else runs. The record of every job is appended to the JSON lines
+    ``report_path`` as soon as it finishes; slides already reported as "ok" in this
+    file are skipped. A crashed worker process fails its running jobs only.
+    """
+    done = _reported_slides(report_path)
+    pending = [job for job in jobs if job.slide not in done]
+    job_memory = estimate_memory(options["tile_size"], options["tile_workers"])
+    summary = {"slides": len(jobs), "skipped": len(jobs) - len(pending), "ok": 0,
+               "failed": 0, "tiles": 0}
+    start = time.perf_counter()
+
+    with open(report_path, "a") as report:
+        def write(job, record):
+            record = {"slide": job.slide, "mask": job.mask, "name": job.name, **record}
+            report.write(json.dumps(record) + "\n")
+            report.flush()
+            summary[record["status"]] += 1
+            summary["tiles"] += record.get("tiles", 0)
+            logger.info("%s %s (%d tiles)", record["status"], job.name, record.get("tiles", 0))
+
+        executor = _slide_executor(concurrency)
+        running = {}
+        try:
+            while pending or running:
+                # Submit while the pool and the memory budget allow it
+                while pending and len(running) < concurrency and (
+                    not running or memory_budget is None
+                    or (len(running) + 1) * job_memory <= memory_budget
+                ):
+                    job = pending.pop(0)
+                    running[executor.submit(_run_job, job, options)] = job
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    try:
+                        write(job, future.result())
+                    except BrokenProcessPool as error:
+                        write(job, {"status": "failed", "error": f"worker process died: {error}"})
+                if any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                    # Fail the other jobs of the broken pool and start a new one
+                    for future, job in running.items():
+                        write(job, {"status": "failed", "error": "worker process died"})
+                    running = {}
+                    executor.shutdown(wait=False)
+                    executor = _slide_executor(concurrency)
+        finally:
+            executor.shutdown()
+
+        summary["seconds"] = round(time.perf_counter() - start, 3)
+        report.write(json.dumps({"summary": summary}) + "\n")
+    return summary
+
+
+def _slide_executor(concurrency: int) -> ProcessPoolExecutor:
+    """Return the pool of ``concurrency`` processes tiling the slides, with a new
+    process per slide if supported (see ``FRESH_WORKERS``)."""
+    if FRESH_WORKERS:
+        return ProcessPoolExecutor(max_workers=concurrency, max_tasks_per_child=1)
+    return ProcessPoolExecutor(max_workers=concurrency)
+
+
+def _reported_slides(report_path: str) -> set:
+    """Return the slides reported as successfully tiled in ``report_path``."""
+    if not os.path.exists(report_path):
+        return set()
+    done = set()
+    with open(report_path) as fd:
+        for line in fd:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["slide"])
+    return done
+
+
+def parse_memory(value: str) -> int:
+    """Parse a memory size such as ``"64G"``, ``"512M"`` or a number of bytes."""
+    value = value.strip().upper().rstrip("B").rstrip("I")
+    if value and value[-1] in MEMORY_UNITS:
+        return int(float(value[:-1]) * MEMORY_UNITS[value[-1]])
+    return int(value)
+
+
+# ---------------------------------------------------- #
+#                         Main                         #
+# ---------------------------------------------------- #
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="patho-pix", description=__doc__.split("\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("input", help="Directory of slides or CSV file with 'slide' and 'mask' columns")
+    parser.add_argument("--output", "-o", default="patho-pix-output", help="Output directory")
+    parser.add_argument("--tile-size", type=int, nargs=2, default=[1024, 1024], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--concurrency", "-j", type=int, default=os.cpu_count() or 1,
+                        help="Number of slides tiled at the same time")
+    parser.add_argument("--tile-workers", type=int, default=1,
+                        help="Worker processes per slide (see AwesomeTiler.extract)")
+    parser.add_argument("--memory-budget", type=parse_memory,
+                        help="Memory available to the run, e.g. 64G; limits the concurrent slides "
+                             "and the tiles and buffers of each of them")
+    parser.add_argument("--mask-mode", choices=["rgb", "label", "palette"], default="rgb")
+    parser.add_argument("--writer", choices=["directory", "tar"], default="directory",
+                        help="One file per tile or tar shards per slide")
+    parser.add_argument("--metadata-format", choices=["npz", "parquet", "feather", "none"], default="npz",
+                        help="Format of the tile metadata of every slide; parquet and feather require pyarrow")
+    parser.add_argument("--prefilter", action="store_true", help="Skip reading the tiles clearly without tissue")
+    parser.add_argument("--drop-artifacts", action="store_true",
+                        help="Score blur, pen ink and folds and drop the tiles with artifacts")
+    parser.add_argument("--manifest", action="store_true",
+                        help="Keep a manifest per slide to resume interrupted slides")
+    parser.add_argument("--report", help="Run report (JSON lines). Default <output>/run_report.jsonl")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    if args.metadata_format in ("parquet", "feather") and importlib.util.find_spec("pyarrow") is None:
+        # Fail before tiling any slide rather than when saving the metadata of each
+        parser.error(f"--metadata-format {args.metadata_format} requires the pyarrow package")
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    jobs = discover_slides(args.input)
+    os.makedirs(args.output, exist_ok=True)
+    report_path = args.report or os.path.join(args.output, "run_report.jsonl")
+    options = {
+        "output": args.output,
+        "tile_size": tuple(args.tile_size),
+        "tile_workers": args.tile_workers,
+        "mask_mode": args.mask_mode,
+        "writer": args.writer,
+        "metadata_format": args.metadata_format,
+        "prefilter": args.prefilter,
+        "drop_artifacts": args.drop_artifacts,
+        "manifest": args.manifest,
+        "memory_budget": args.memory_budget,
+    }
+    logger.info("Tiling %d slides into %s", len(jobs), args.output)
+    summary = run_batch(jobs, options, report_path, args.concurrency, args.memory_budget)
+    logger.info("Run finished: %s", summary)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
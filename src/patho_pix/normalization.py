@@ -1,42 +1,356 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
 # Standard Library
+import json
 import os
 import tempfile
+from itertools import islice
 
 # Third Party
-import requests
-from histolab.stain_normalizer import (MacenkoStainNormalizer,
-                                       ReinhardStainNormalizer)
+import numpy as np
 from PIL import Image
 
 # D Download link for target image
 img_url = "https://user-images.githubusercontent.com/31658006/212924301-c80f454e-f99a-4479-9852-6ef988c078aa.png"
 
-target_img = None
+# Stain parameters fitted by each normalization method
+STAIN_PARAMETERS = {
+    "macenko": ("stain_matrix", "max_concentrations"),
+    "reinhard": ("lab_means", "lab_stds"),
+}
 
-# Create a temporary directory to store the target image
-tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+_target_img = None
+_default_normalizers = {}
 
-# Download Target image
-response = requests.get(img_url)
-if response.status_code == 200:
-    path_img = os.path.join(tmp_data.name, "target.jpg")
-    with open(path_img, "wb") as fd:
-        fd.write(response.content)
-        target_img = Image.open(path_img)
-        target_img.save("./output/test_out/target_img.tiff")
-else:
-    print("Target Image could not be downloaded, please check if the link is valid.")
+
+def load_default_target():
+    """Download the default target image on first use and return it. The image is
+    kept in memory only, nothing is written outside of a temporary directory."""
+    global _target_img
+    if _target_img is None:
+        # Third Party
+        import requests
+
+        # Create a temporary directory to store the target image
+        tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        # Download Target image
+        response = requests.get(img_url)
+        if response.status_code == 200:
+            path_img = os.path.join(tmp_data.name, "target.jpg")
+            with open(path_img, "wb") as fd:
+                fd.write(response.content)
+            _target_img = Image.open(path_img)
+            _target_img.load()
+        else:
+            print("Target Image could not be downloaded, please check if the link is valid.")
+        tmp_data.cleanup()
+    return _target_img
+
+
+def __getattr__(name):
+    # Keep ``normalization.target_img`` available without downloading at import time
+    if name == "target_img":
+        return load_default_target()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ---------------------------------------------------- #
+#                Fitted Stain Normalizer               #
+# ---------------------------------------------------- #
+class StainNormalizer:
+    """Stain normalizer fitted once to a target image and reusable on any number of tiles.
+
+    The fitted stain parameters (Macenko: stain matrix and 99th percentile stain
+    concentrations, Reinhard: LAB channel means and standard deviations) can be saved
+    to a JSON file and loaded back, e.g. in worker processes or later runs, without
+    refitting or access to the target image.
+
+    Arguments
+    ---------
+    method : str, {"macenko", "reinhard"}
+        Stain normalization method. Default is "macenko".
+    background_intensity : int, optional
+        Background transmitted light intensity used by the Macenko method. Default is
+        240.
+    """
+
+    def __init__(self, method="macenko", background_intensity=240):
+        if method not in STAIN_PARAMETERS:
+            raise ValueError(f"Unknown stain normalization method {method!r}, "
+                             f"use one of {sorted(STAIN_PARAMETERS)}")
+        self.method = method
+        self.background_intensity = background_intensity
+        # Third Party
+        from histolab.stain_normalizer import (MacenkoStainNormalizer,
+                                               ReinhardStainNormalizer)
+
+        self._normalizer = (MacenkoStainNormalizer() if method == "macenko"
+                            else ReinhardStainNormalizer())
+        self._fitted = False
+
+    @classmethod
+    def from_target(cls, target, method="macenko", background_intensity=240):
+        """Create a normalizer fitted to ``target``, a PIL image or an image path."""
+        if not isinstance(target, Image.Image):
+            target = Image.open(target)
+        return cls(method, background_intensity).fit(target)
+
+    @classmethod
+    def load(cls, path):
+        """Create a fitted normalizer from a parameter file written by ``save``."""
+        with open(path) as fd:
+            params = json.load(fd)
+        return cls.from_params(params)
+
+    @classmethod
+    def from_params(cls, params):
+        """Create a fitted normalizer from a dictionary returned by ``get_params``."""
+        normalizer = cls(params["method"], params.get("background_intensity", 240))
+        missing = [key for key in STAIN_PARAMETERS[normalizer.method] if key not in params]
+        if missing:
+            raise ValueError(f"Missing stain parameters {missing} for method {normalizer.method!r}")
+        if normalizer.method == "macenko":
+            normalizer._normalizer.stain_matrix_target = np.asarray(params["stain_matrix"], dtype=float)
+            normalizer._normalizer.max_concentrations_target = np.asarray(params["max_concentrations"],
+                                                                          dtype=float)
+        else:
+            normalizer._normalizer.target_means = np.asarray(params["lab_means"], dtype=float)
+            normalizer._normalizer.target_stds = np.asarray(params["lab_stds"], dtype=float)
+        normalizer._fitted = True
+        return normalizer
+
+    @property
+    def is_fitted(self):
+        return self._fitted
+
+    def fit(self, target_img):
+        """Fit the stain parameters to ``target_img`` and return the normalizer."""
+        if self.method == "macenko":
+            self._normalizer.fit(target_img, background_intensity=self.background_intensity)
+        else:
+            self._normalizer.fit(target_img)
+        self._fitted = True
+        return self
+
+    def transform(self, tile):
+        """Return ``tile`` (a PIL image) normalized to the fitted target staining."""
+        self._check_fitted()
+        if self.method == "macenko":
+            return self._normalizer.transform(tile, background_intensity=self.background_intensity)
+        return self._normalizer.transform(tile)
+
+    __call__ = transform
+
+    def transform_batch(self, tiles, chunk_size=32, backend="numpy"):
+        """Normalize a stack of tiles with vectorized array operations.
+
+        Tiles are processed ``chunk_size`` at a time, which bounds the memory used by
+        the intermediate float arrays. For the Macenko method, the optical density
+        conversion, the per-tile stain matrix estimation, the concentration solve and
+        the reconstruction are computed for a whole chunk at once; the result matches
+        ``transform`` within a few intensity levels. The Reinhard method falls back to
+        ``transform`` tile by tile.
+
+        Parameters
+        ----------
+        tiles : np.ndarray or Iterable
+            Either an (N, H, W, 3) uint8 array, or an iterable of PIL images or
+            (H, W, 3) uint8 arrays. RGBA inputs are reduced to RGB.
+        chunk_size : int, optional
+            Number of tiles normalized together. Default is 32.
+        backend : str, {"numpy", "torch"}
+            Array library used for the concentration solve and the reconstruction,
+            the most expensive steps. "torch" runs on the CPU with torch's thread pool.
+            Default is "numpy".
+
+        Returns
+        -------
+        np.ndarray or Iterator[np.ndarray]
+            Normalized (N, H, W, 3) uint8 array for array input, otherwise an iterator
+            over normalized (H, W, 3) uint8 arrays in input order.
+        """
+        self._check_fitted()
+        if backend not in ("numpy", "torch"):
+            raise ValueError(f"Unknown backend {backend!r}, use 'numpy' or 'torch'")
+        if isinstance(tiles, np.ndarray):
+            if tiles.ndim != 4 or tiles.shape[-1] not in (3, 4):
+                raise ValueError(f"Expected an (N, H, W, 3) array of tiles, got shape {tiles.shape}")
+            normalized = np.empty(tiles.shape[:-1] + (3,), dtype=np.uint8)
+            for start in range(0, len(tiles), chunk_size):
+                normalized[start:start + chunk_size] = self._transform_chunk(
+                    tiles[start:start + chunk_size, ..., :3], backend
+                )
+            return normalized
+        return self._transform_stream(iter(tiles), chunk_size, backend)
+
+    def get_params(self):
+        """Return the fitted stain parameters as a JSON serializable dictionary."""
+        self._check_fitted()
+        params = {"method": self.method, "background_intensity": self.background_intensity}
+        if self.method == "macenko":
+            params["stain_matrix"] = self._normalizer.stain_matrix_target.tolist()
+            params["max_concentrations"] = self._normalizer.max_concentrations_target.tolist()
+        else:
+            params["lab_means"] = np.asarray(self._normalizer.target_means).tolist()
+            params["lab_stds"] = np.asarray(self._normalizer.target_stds).tolist()
+        return params
+
+    def save(self, path):
+        """Write the fitted stain parameters to the JSON file ``path``."""
+        with open(path, "w") as fd:
+            json.dump(self.get_params(), fd, indent=2)
+
+    def _transform_stream(self, tiles, chunk_size, backend):
+        while True:
+            chunk = [np.asarray(tile.convert("RGB") if isinstance(tile, Image.Image) else tile)[..., :3]
+                     for tile in islice(tiles, chunk_size)]
+            if not chunk:
+                return
+            # Tiles of different sizes (e.g. at the slide border) cannot be stacked
+            for shape in dict.fromkeys(tile.shape for tile in chunk):
+                indices = [i for i, tile in enumerate(chunk) if tile.shape == shape]
+                normalized = self._transform_chunk(np.stack([chunk[i] for i in indices]), backend)
+                for i, tile in zip(indices, normalized):
+                    chunk[i] = tile
+            yield from chunk
+
+    def _transform_chunk(self, rgb, backend):
+        if self.method == "macenko":
+            return _macenko_normalize_chunk(
+                rgb,
+                self._normalizer.stain_matrix_target,
+                self._normalizer.max_concentrations_target,
+                self.background_intensity,
+                backend,
+            )
+        return np.stack([np.asarray(self._normalizer.transform(Image.fromarray(tile))) for tile in rgb])
+
+    def _check_fitted(self):
+        if not self._fitted:
+            raise RuntimeError("StainNormalizer is not fitted, call fit() or load() first.")
+
+
+# ---------------------------------------------------- #
+#             Vectorized Macenko Normalization         #
+# ---------------------------------------------------- #
+def _macenko_normalize_chunk(rgb, stain_matrix_target, max_concentrations_target,
+                             background_intensity, backend="numpy", alpha=1, beta=0.15):
+    """Macenko normalization of an (n, H, W, 3) uint8 stack, following histolab's
+    ``TransformerStainMatrixMixin.transform`` for every tile of the stack.
+
+    Tiles without enough stained pixels to estimate a stain matrix are returned
+    unchanged.
+    """
+    n_tiles, height, width, _ = rgb.shape
+    torch = _import_torch() if backend == "torch" else None
+
+    # Optical density, (n, pixels, 3), looked up from the 256 possible uint8 values
+    od_lut = -np.log((np.arange(256, dtype=np.float64) + 1) / background_intensity)
+    od = od_lut[rgb.reshape(n_tiles, -1, 3)]
+    if torch is not None:
+        od_t = torch.from_numpy(od)
+
+    stain_matrices, valid = _macenko_stain_matrices(od, alpha, beta)
+
+    # Concentrations: the complemented stain matrices are invertible, so the least
+    # squares solution of histolab is the exact solve, (n, 3, pixels)
+    if torch is None:
+        concentrations = np.linalg.inv(stain_matrices) @ od.transpose(0, 2, 1)
+    else:
+        concentrations_t = torch.linalg.inv(torch.from_numpy(stain_matrices)) @ od_t.transpose(1, 2)
+        concentrations = concentrations_t.numpy()
+
+    max_concentrations = np.percentile(concentrations, 99, axis=2) / max_concentrations_target
+    max_concentrations[~valid] = 1
+
+    # Reconstruction with the target stain matrix
+    if torch is None:
+        concentrations /= max_concentrations[:, :, np.newaxis]
+        normalized = background_intensity * np.exp(-stain_matrix_target @ concentrations)
+        normalized = np.clip(normalized, None, 255).transpose(0, 2, 1).astype(np.uint8)
+    else:
+        concentrations_t /= torch.from_numpy(max_concentrations)[:, :, None]
+        normalized_t = background_intensity * torch.exp(-torch.from_numpy(stain_matrix_target) @ concentrations_t)
+        normalized = normalized_t.clamp(max=255).transpose(1, 2).to(torch.uint8).numpy()
+
+    normalized = normalized.reshape(n_tiles, height, width, 3)
+    normalized[~valid] = rgb[~valid]
+    return normalized
+
+
+def _macenko_stain_matrices(od, alpha, beta):
+    """Estimate the ordered (hematoxylin, eosin, complement) stain matrix of every tile
+    of an (n, pixels, 3) optical density stack.
+
+    Returns the (n, 3, 3) stain matrices and a boolean array flagging the tiles with
+    enough stained pixels for the estimation.
+    """
+    n_tiles = od.shape[0]
+    # Keep only the pixels with an OD above beta in every channel
+    stained = np.minimum(np.minimum(od[:, :, 0], od[:, :, 1]), od[:, :, 2]) >= beta
+    counts = stained.sum(axis=1)
+    valid = counts > 2
+
+    # Covariance of the stained pixels of each tile and its two principal components
+    od_stained = od * stained[:, :, np.newaxis]
+    sums = od_stained.sum(axis=1)[:, :, np.newaxis]
+    counts_ = np.maximum(counts, 2)[:, np.newaxis, np.newaxis]
+    covariances = (od_stained.transpose(0, 2, 1) @ od_stained - sums @ sums.transpose(0, 2, 1) / counts_) / (
+        counts_ - 1
+    )
+    covariances[~valid] = np.eye(3)
+    principal_components = np.linalg.eigh(covariances)[1][:, :, -2:]
+
+    # Extreme angles of the stained pixels projected onto the principal plane
+    angles = np.zeros((n_tiles, 2))
+    for i in np.flatnonzero(valid):
+        projection = od[i][stained[i]] @ principal_components[i]
+        phi = np.arctan2(projection[:, 1], projection[:, 0])
+        angles[i] = np.percentile(phi, [alpha, 100 - alpha])
+
+    directions = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    stains = principal_components @ directions
+    stains /= np.linalg.norm(stains, axis=1, keepdims=True)
+    complement = np.cross(stains[:, :, 0], stains[:, :, 1])
+    complement /= np.linalg.norm(complement, axis=1, keepdims=True)
+    stain_matrices = np.concatenate([stains, complement[:, :, np.newaxis]], axis=2)
+
+    # Order the columns as histolab does: hematoxylin first, then eosin, complement
+    # Third Party
+    from histolab.stain_normalizer import MacenkoStainNormalizer
+
+    hematoxylin = np.argmax(
+        np.abs(np.asarray(MacenkoStainNormalizer.stain_color_map["hematoxylin"]) @ stain_matrices), axis=1
+    )
+    order = np.stack([hematoxylin, (1 - hematoxylin) % 3, np.full(n_tiles, 2)], axis=1)
+    stain_matrices = np.take_along_axis(stain_matrices, order[:, np.newaxis, :], axis=2)
+    # Degenerate tiles (e.g. a single stain colour) give collinear stain vectors
+    valid &= np.isfinite(stain_matrices).all(axis=(1, 2))
+    stain_matrices[~valid] = np.eye(3)
+    return stain_matrices, valid
+
+
+def _import_torch():
+    try:
+        # Third Party
+        import torch
+    except ImportError:  # pragma: no cover
+        raise ModuleNotFoundError("The torch backend requires the torch package to be installed.")
+    return torch
+
+
+def _default_normalizer(method):
+    # Fit the default target image once per process instead of once per tile
+    if method not in _default_normalizers:
+        _default_normalizers[method] = StainNormalizer(method).fit(load_default_target())
+    return _default_normalizers[method]
 
 
 def normalize_tile_reinhard(tile):
-    normalizer = ReinhardStainNormalizer()
-    normalizer.fit(target_img)
-    normalized_img = normalizer.transform(tile)
-    return normalized_img
+    return _default_normalizer("reinhard").transform(tile)
 
 
 def normalize_tile_macenko(tile):
-    normalizer = MacenkoStainNormalizer()
-    normalizer.fit(target_img)
-    normalized_img = normalizer.transform(tile)
-    return normalized_img
+    return _default_normalizer("macenko").transform(tile)
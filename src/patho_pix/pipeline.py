@@ -0,0 +1,587 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+from __future__ import annotations
+
+# Standard Library
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+from typing import (TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Tuple)
+
+# Third Party
+import numpy as np
+from PIL import Image
+
+# patho_pix
+from patho_pix.utils.artifacts import ARTIFACT_SCORES
+from patho_pix.utils.instrumentation import TilingStats
+
+if TYPE_CHECKING:
+    # Third Party
+    from histolab.masks import BinaryMask
+    from histolab.slide import Slide
+
+    # patho_pix
+    from patho_pix.normalization import StainNormalizer
+    from patho_pix.utils.artifacts import ArtifactDetector
+    from patho_pix.utils.custom_tiler import AwesomeTiler
+    from patho_pix.utils.tissue import TissueScorer
+    from patho_pix.utils.writers import TileWriter
+
+# Number of workers of the stages of slide_pipeline, unless set otherwise
+DEFAULT_WORKERS = {"artifacts": 1, "normalize": 1, "encode": 2}
+
+
+# ---------------------------------------------------- #
+#                   Pipeline Stages                    #
+# ---------------------------------------------------- #
+class Stage:
+    """One step of a ``Pipeline``: a function applied to every item by a pool of
+    threads.
+
+    Without ``batch_size``, ``function(item)`` returns the item for the next stage,
+    or None to drop it. With ``batch_size``, ``function(items)`` gets up to
+    ``batch_size`` consecutive items and returns the list of items for the next
+    stage, None dropping an item. At most ``queue_size`` items (or batches) are
+    submitted and not handed to the next stage yet; the items leave the stage in the
+    order they entered it, whatever the number of workers.
+
+    Arguments
+    ---------
+    name : str
+        Name of the stage in the pipeline statistics.
+    function : Callable
+        Function applied to every item, or to every batch of items.
+    workers : int, optional
+        Number of threads running ``function``. NumPy, OpenCV, Pillow encoders and
+        openslide reads release the GIL, so that the threads of the stages run
+        concurrently. Default is 1.
+    batch_size : int, optional
+        Number of items given at once to ``function``. Default is None, one item.
+    queue_size : int, optional
+        Maximum number of items (or batches) in flight in the stage. Default is
+        twice the number of workers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable,
+        workers: int = 1,
+        batch_size: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be greater than 0 ({workers})")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError(f"batch_size must be greater than 0 ({batch_size})")
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = max(queue_size or 2 * workers, 1)
+
+    def __repr__(self) -> str:
+        return (
+            f"Stage({self.name!r}, workers={self.workers}, batch_size={self.batch_size}, "
+            f"queue_size={self.queue_size})"
+        )
+
+
+class Pipeline:
+    """Streaming chain of stages from a source of items, e.g. tiles read from a slide,
+    to their export, all in memory.
+
+    The source is iterated by a background thread, ``prefetch`` items ahead. Every
+    stage runs its function with its own pool of threads on a bounded queue of items,
+    so that reading, filtering, normalizing, encoding and writing overlap while the
+    memory held by the items in flight stays bounded. Items come out of the pipeline
+    in source order.
+
+    The wall time of every stage, summed over its workers, and the number of items
+    entering and leaving it are kept in ``stats`` (the source is the "read" stage);
+    ``summary`` returns them with the throughput of every stage.
+
+    Arguments
+    ---------
+    source : Iterable
+        Items entering the pipeline, e.g. ``read_tiles``.
+    stages : Iterable[Stage], optional
+        Stages applied to the items, in order. More are added with ``then``.
+    prefetch : int, optional
+        Number of source items read ahead by the background thread. Default is 16.
+    source_name : str, optional
+        Name of the source in the statistics. Default is "read".
+    """
+
+    def __init__(
+        self,
+        source: Iterable,
+        stages: Iterable[Stage] = (),
+        prefetch: int = 16,
+        source_name: str = "read",
+    ):
+        self.source = source
+        self.stages = list(stages)
+        self.prefetch = prefetch
+        self.source_name = source_name
+        self.stats = TilingStats()
+
+    def then(self, stage: Stage) -> "Pipeline":
+        """Add ``stage`` after the last stage and return the pipeline."""
+        if any(stage.name == other.name for other in self.stages) or stage.name == self.source_name:
+            raise ValueError(f"The pipeline already has a stage named {stage.name!r}")
+        self.stages.append(stage)
+        return self
+
+    def __iter__(self) -> Iterator:
+        self.stats = TilingStats()
+        start_time = time.perf_counter()
+        items = self._timed_source()
+        if self.prefetch > 0:
+            items = _prefetch(items, self.prefetch)
+        with ExitStack() as executors:
+            for stage in self.stages:
+                executor = executors.enter_context(ThreadPoolExecutor(
+                    max_workers=stage.workers, thread_name_prefix=f"pipeline-{stage.name}"
+                ))
+                items = self._run_stage(stage, executor, items)
+            yield from items
+        self.stats.add_time("total", time.perf_counter() - start_time)
+
+    def run(self) -> dict:
+        """Run the pipeline until its source is exhausted, dropping the items leaving
+        the last stage, and return the ``summary``."""
+        for _ in self:
+            pass
+        return self.summary()
+
+    def summary(self) -> dict:
+        """Return the statistics of the last run.
+
+        Returns
+        -------
+        dict
+            The stages and counters of the ``TilingStats.summary`` of the run, with a
+            ``"pipeline"`` entry
+            holding for the source and every stage: its ``workers``, the ``items_in``
+            and ``items_out`` counts, ``items_per_s`` (items out per second of the
+            run), ``capacity_per_s`` (items in per second of work of one worker,
+            times the number of workers: the throughput of the stage if it never
+            waited for items) and ``utilization`` (fraction of the run its workers
+            spent working). The stage with the lowest capacity bounds the throughput.
+        """
+        summary = self.stats.summary()
+        # The tile and byte throughput of extractions do not apply to the stages
+        summary.pop("throughput", None)
+        total = self.stats.seconds.get("total", 0.0)
+        stages = [(self.source_name, 1)] + [(stage.name, stage.workers) for stage in self.stages]
+        summary["pipeline"] = {}
+        for name, workers in stages:
+            seconds = self.stats.seconds.get(name, 0.0)
+            items_in = self.stats.counters.get(f"{name}_in", 0)
+            items_out = self.stats.counters.get(f"{name}_out", 0)
+            summary["pipeline"][name] = {
+                "workers": workers,
+                "items_in": items_in,
+                "items_out": items_out,
+                "items_per_s": round(items_out / total, 3) if total > 0 else None,
+                "capacity_per_s": round(items_in * workers / seconds, 3) if seconds > 0 else None,
+                "utilization": round(seconds / (total * workers), 3) if total > 0 else None,
+            }
+        return summary
+
+    # ------- implementation helpers -------
+
+    def _timed_source(self) -> Iterator:
+        """Iterate over the source, timing every item it produces."""
+        items = iter(self.source)
+        while True:
+            with self.stats.time(self.source_name):
+                item = next(items, _DONE)
+            if item is _DONE:
+                return
+            self.stats.count(f"{self.source_name}_in")
+            self.stats.count(f"{self.source_name}_out")
+            yield item
+
+    def _run_stage(
+        self, stage: Stage, executor: ThreadPoolExecutor, items: Iterator
+    ) -> Iterator:
+        """Submit the items to the workers of ``stage`` and yield its outputs in
+        order, with at most ``queue_size`` submissions waiting."""
+        size = stage.batch_size or 1
+        pending: deque = deque()
+        try:
+            while True:
+                batch = list(islice(items, size))
+                if batch:
+                    pending.append(executor.submit(self._call, stage, batch))
+                if pending and (not batch or len(pending) >= stage.queue_size):
+                    yield from pending.popleft().result()
+                elif not batch:
+                    return
+        finally:
+            # Items not handed over because of an error or of a closed pipeline
+            for future in pending:
+                future.cancel()
+
+    def _call(self, stage: Stage, batch: list) -> list:
+        with self.stats.time(stage.name):
+            if stage.batch_size is None:
+                outputs = [stage.function(batch[0])]
+            else:
+                outputs = list(stage.function(batch))
+        outputs = [output for output in outputs if output is not None]
+        self.stats.count(f"{stage.name}_in", len(batch))
+        self.stats.count(f"{stage.name}_out", len(outputs))
+        return outputs
+
+
+_DONE = object()
+
+
+def _prefetch(iterable, size: int) -> Iterator:
+    """Iterate over ``iterable`` in a background thread, keeping up to ``size`` items
+    ready. Exceptions of the thread are raised in the consumer."""
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Gives up once the consumer stopped iterating
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except BaseException as error:  # forwarded to the consumer
+            put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+# ---------------------------------------------------- #
+#                 Tile Pipeline Stages                 #
+# ---------------------------------------------------- #
+class PipelineTile(NamedTuple):
+    """Tile flowing through a tile pipeline. Stages return an updated copy
+    (``tile._replace(...)``)."""
+
+    # Index of the tile in the grid of candidate coordinates
+    candidate: int
+    # Level 0 (x_ul, y_ul, x_br, y_br) coordinates
+    coords: Tuple[int, int, int, int]
+    # (height, width, 4) uint8 RGBA pixels as read, (height, width, 3) once normalized
+    image: np.ndarray
+    tissue_ratio: float
+    # Mask tile in the mask mode of the tiler, its encoder options and class counts
+    mask: Optional[Image.Image] = None
+    mask_options: Optional[dict] = None
+    label_counts: Optional[np.ndarray] = None
+    artifact_scores: Optional[np.ndarray] = None
+    # Encoded tile of every stream and ratio of labelled mask pixels, see encode_tiles
+    encoded: Optional[Dict[str, bytes]] = None
+    label_ratio: Optional[float] = None
+
+
+def read_tiles(
+    tiler: AwesomeTiler,
+    wsi_img: Slide,
+    wsi_label: Optional[Slide] = None,
+    extraction_mask: Optional[BinaryMask] = None,
+) -> Iterator[PipelineTile]:
+    """Read the grid tiles of a slide (and of its mask) as ``AwesomeTiler.extract``
+    does, without encoding nor writing them.
+
+    The tiles are checked by the tiler (tissue, artifacts, label sampling) as in an
+    extraction; a tiler with ``check_tissue=False`` leaves the tissue check to a
+    ``filter_tissue`` stage. The tiler is prepared for the slide by this call, the
+    grid is computed and the tiles are read while iterating. The stage timers and
+    counters of the reads are kept in ``tiler.stats``.
+
+    Parameters
+    ----------
+    tiler : AwesomeTiler
+        Tiler setting the grid, the checks and the mask mode. Linked tiles of a
+        ``MultiScaleTiler`` are not supported.
+    wsi_img : Slide
+        Image slide from which to read the tiles
+    wsi_label : Slide, optional
+        Mask slide from which to read the mask tiles. Default is None.
+    extraction_mask : BinaryMask, optional
+        BinaryMask object defining the tissue to tile. Default ``TissueMask``.
+
+    Returns
+    -------
+    Iterator[PipelineTile]
+        Candidate index, coordinates, RGBA pixels, tissue ratio, mask tile and label
+        counts of every accepted tile, in grid order.
+    """
+    if tiler._linked_names():
+        raise ValueError("Linked tiles of a multi-scale tiler cannot be streamed")
+    if tiler.sampler is not None and wsi_label is None:
+        raise ValueError("Label sampling requires a mask slide (wsi_label)")
+    if extraction_mask is None:
+        # Third Party
+        from histolab.masks import TissueMask
+        extraction_mask = TissueMask()
+    tiler._prepare(wsi_img)
+    tiler.stats = TilingStats()
+    if tiler.sampler is not None:
+        tiler.sampler.reset()
+    return _read_tiles(tiler, wsi_img, wsi_label, extraction_mask)
+
+
+def _read_tiles(
+    tiler: AwesomeTiler,
+    wsi_img: Slide,
+    wsi_label: Optional[Slide],
+    extraction_mask: BinaryMask,
+) -> Iterator[PipelineTile]:
+    # patho_pix
+    from patho_pix.utils.custom_tiler import _artifact_scores
+
+    if tiler.check_tissue and tiler.tissue_scorer is not None:
+        with tiler.stats.time("tissue_fit"):
+            tiler._fit_tissue_scorer(wsi_img)
+    candidates, _ = tiler._candidates(wsi_img, extraction_mask)
+    mask_reader = tiler._mask_reader(wsi_label, candidates)
+    for candidate, tile, coords in tiler._indexed_tiles(wsi_img, candidates):
+        mask_image, mask_options, label_counts = tiler._read_mask_tile(
+            wsi_label, coords, mask_reader
+        )
+        if not tiler._sample(label_counts):
+            continue
+        yield PipelineTile(
+            candidate,
+            tuple(coords),
+            np.asarray(tile.image),
+            tile.tissue_ratio,
+            mask_image,
+            mask_options,
+            label_counts,
+            _artifact_scores(tile),
+        )
+
+
+def filter_tissue(
+    scorer: TissueScorer, tissue_percent: float, workers: int = 1
+) -> Stage:
+    """Stage dropping the tiles without enough tissue with a fitted ``TissueScorer``,
+    ``scorer.batch_size`` tiles at a time. The tissue ratio of the tiles is the one of
+    the scorer."""
+
+    def check(tiles: List[PipelineTile]) -> List[Optional[PipelineTile]]:
+        enough, ratios = scorer.score(np.stack([tile.image for tile in tiles]), tissue_percent)
+        return [
+            tile._replace(tissue_ratio=float(ratio)) if keep else None
+            for tile, keep, ratio in zip(tiles, enough, ratios)
+        ]
+
+    return Stage("tissue", check, workers, batch_size=scorer.batch_size)
+
+
+def filter_artifacts(detector: ArtifactDetector, workers: int = 1) -> Stage:
+    """Stage scoring the artifacts of the tiles, ``detector.batch_size`` tiles at a
+    time, keeping the ``ARTIFACT_SCORES`` of the tiles and dropping the tiles the
+    detector rejects."""
+
+    def check(tiles: List[PipelineTile]) -> List[Optional[PipelineTile]]:
+        scores = detector.score(np.stack([tile.image for tile in tiles]))
+        rejected = detector.rejects(scores)
+        return [
+            None if reject else tile._replace(artifact_scores=tile_scores)
+            for tile, tile_scores, reject in zip(tiles, scores, rejected)
+        ]
+
+    return Stage("artifacts", check, workers, batch_size=detector.batch_size)
+
+
+def normalize_tiles(
+    normalizer: StainNormalizer,
+    workers: int = 1,
+    batch_size: int = 16,
+    backend: str = "numpy",
+) -> Stage:
+    """Stage normalizing the stain of the image tiles, ``batch_size`` tiles at a time
+    with ``StainNormalizer.transform_batch``. Normalized tiles are RGB."""
+
+    def normalize(tiles: List[PipelineTile]) -> List[PipelineTile]:
+        images = normalizer.transform_batch(
+            [tile.image for tile in tiles], chunk_size=len(tiles), backend=backend
+        )
+        return [tile._replace(image=image) for tile, image in zip(tiles, images)]
+
+    return Stage("normalize", normalize, workers, batch_size=batch_size)
+
+
+def encode_tiles(tiler: AwesomeTiler, workers: int = 2) -> Stage:
+    """Stage encoding the image and mask tiles with the codecs of ``tiler``."""
+
+    def encode(tile: PipelineTile) -> PipelineTile:
+        encoded, label_ratio = tiler._encode_tiles(
+            Image.fromarray(tile.image), tile.mask, tile.mask_options
+        )
+        return tile._replace(encoded=encoded, label_ratio=label_ratio)
+
+    return Stage("encode", encode, workers)
+
+
+class TileExporter:
+    """Last stage of a tile pipeline: writes the encoded tiles and records them in
+    ``metadata``, numbered and named as by ``AwesomeTiler.extract``.
+
+    The tiles must reach the exporter in grid order, so its stage has a single
+    worker (see ``stage``). The exporter is created once ``read_tiles`` prepared the
+    tiler for the slide.
+
+    Arguments
+    ---------
+    tiler : AwesomeTiler
+        Tiler of the tiles, setting their filenames.
+    wsi_img : Slide
+        Image slide of the tiles.
+    wsi_label : Slide, optional
+        Mask slide of the tiles. Default is None.
+    writer : TileWriter, optional
+        Destination of the encoded tiles, not closed by the exporter. Default writes
+        every tile as a file in the ``processed_path`` of its slide.
+    artifacts : bool, optional
+        Whether the metadata keeps the ``ARTIFACT_SCORES`` of the tiles. Default is
+        False.
+    """
+
+    def __init__(
+        self,
+        tiler: AwesomeTiler,
+        wsi_img: Slide,
+        wsi_label: Optional[Slide] = None,
+        writer: Optional[TileWriter] = None,
+        artifacts: bool = False,
+    ):
+        # patho_pix
+        from patho_pix.utils.metadata import TileMetadata
+
+        self.tiler = tiler
+        self.writer = writer if writer is not None else tiler._default_writer(wsi_img, wsi_label)
+        self.metadata: TileMetadata = TileMetadata(
+            tiler.prefix,
+            tiler.suffix,
+            tiler.level,
+            tiler.tile_size,
+            wsi_img._path,
+            tiler._n_classes() if wsi_label is not None else 0,
+            (),
+            ARTIFACT_SCORES if artifacts else (),
+        )
+
+    def __call__(self, tile: PipelineTile) -> PipelineTile:
+        self.tiler._write_tiles(
+            self.writer,
+            None,
+            self.metadata,
+            tile.candidate,
+            tile.coords,
+            tile.tissue_ratio,
+            tile.label_ratio,
+            tile.encoded,
+            tile.label_counts,
+            tile.artifact_scores,
+        )
+        return tile
+
+    def stage(self) -> Stage:
+        """Return the single worker stage of the exporter."""
+        return Stage("export", self, workers=1)
+
+
+def slide_pipeline(
+    tiler: AwesomeTiler,
+    wsi_img: Slide,
+    wsi_label: Optional[Slide] = None,
+    extraction_mask: Optional[BinaryMask] = None,
+    artifact_detector: Optional[ArtifactDetector] = None,
+    normalizer: Optional[StainNormalizer] = None,
+    writer: Optional[TileWriter] = None,
+    workers: Optional[Dict[str, int]] = None,
+    prefetch: int = 16,
+) -> Tuple[Pipeline, TileExporter]:
+    """Build the pipeline reading, filtering, normalizing, encoding and writing the
+    tiles of a slide, each tile being encoded and written once.
+
+    Stages: "read" (``read_tiles``, with the tissue check of the tiler), "artifacts"
+    (with ``artifact_detector``), "normalize" (with ``normalizer``), "encode" and
+    "export" (``TileExporter``).
+
+    Parameters
+    ----------
+    tiler : AwesomeTiler
+        Tiler setting the grid, the tissue check, the mask mode, the codecs and the
+        tile filenames.
+    wsi_img : Slide
+        Image slide from which to extract the tiles
+    wsi_label : Slide, optional
+        Mask slide from which to extract the mask tiles. Default is None.
+    extraction_mask : BinaryMask, optional
+        BinaryMask object defining the tissue to tile. Default ``TissueMask``.
+    artifact_detector : ArtifactDetector, optional
+        Detector of the "artifacts" stage. Default is None.
+    normalizer : StainNormalizer, optional
+        Fitted normalizer of the "normalize" stage. Default is None.
+    writer : TileWriter, optional
+        Destination of the encoded tiles, see ``TileExporter``.
+    workers : Dict[str, int], optional
+        Number of workers of the stages by stage name, replacing the ones of
+        ``DEFAULT_WORKERS``. Default is None.
+    prefetch : int, optional
+        Number of tiles read ahead. Default is 16.
+
+    Returns
+    -------
+    Pipeline
+        Pipeline to ``run``.
+    TileExporter
+        Exporter whose ``metadata`` holds the written tiles once the pipeline ran.
+    """
+    workers = {**DEFAULT_WORKERS, **(workers or {})}
+    pipeline = Pipeline(read_tiles(tiler, wsi_img, wsi_label, extraction_mask), prefetch=prefetch)
+    if artifact_detector is not None:
+        pipeline.then(filter_artifacts(artifact_detector, workers["artifacts"]))
+    if normalizer is not None:
+        pipeline.then(normalize_tiles(normalizer, workers["normalize"]))
+    pipeline.then(encode_tiles(tiler, workers["encode"]))
+    exporter = TileExporter(
+        tiler, wsi_img, wsi_label, writer, artifacts=artifact_detector is not None
+    )
+    return pipeline.then(exporter.stage()), exporter
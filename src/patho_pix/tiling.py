@@ -5,34 +5,57 @@
 # ---------------------------------------------------- #
 #                   Library imports                    #
 # ---------------------------------------------------- #
-# Third Party
-from histolab.masks import TissueMask
-from histolab.tiler import GridTiler
-
-# patho_pix
-from patho_pix.utils import AwesomeTiler
+# histolab and the tiler are imported by the functions, so that importing this module
+# stays cheap
 
 
 # ---------------------------------------------------- #
 #     Apply tiling base on Tissue Mask - Only Image    #
 # ---------------------------------------------------- #
-def tile_wsi(wsi, tile_size=(1024, 1024)):
+def tile_wsi(wsi, tile_size=(1024, 1024), workers=1, writer=None, manifest=None,
+             prefilter=False, return_stats=False, memory_budget=None, artifact_detector=None,
+             grid=None, shard_index=0, num_shards=1):
+    # Third Party
+    from histolab.masks import TissueMask
+
+    # patho_pix
+    from patho_pix.utils import AwesomeTiler
+
     # Initialize Tiler
-    wsi_tiler = GridTiler(
+    wsi_tiler = AwesomeTiler(
         tile_size=tile_size,
         check_tissue=True,
         tissue_percent=10.0,
         prefix="patho-fix.",
         suffix=".png",
+        prefilter=prefilter,
+        memory_budget=memory_budget,
+        artifact_detector=artifact_detector,
     )
     # extract tile
-    wsi_tiler.extract(wsi, extraction_mask=TissueMask())
+    metadata = wsi_tiler.extract(
+        wsi, extraction_mask=TissueMask(), workers=workers, writer=writer,
+        manifest=manifest, grid=grid, shard_index=shard_index, num_shards=num_shards,
+    )
+    # Stage timers and counters next to the metadata
+    if return_stats:
+        return metadata, wsi_tiler.stats.summary()
+    return metadata
 
 
 # ---------------------------------------------------- #
 #    Apply tiling base on Tissue Mask - Image + Mask   #
 # ---------------------------------------------------- #
-def tile_wsi_mask(wsi_img, wsi_label, tile_size=(1024, 1024)):
+def tile_wsi_mask(wsi_img, wsi_label, tile_size=(1024, 1024), workers=1,
+                  mask_mode="rgb", mask_lut=None, writer=None, manifest=None,
+                  prefilter=False, return_stats=False, sampler=None, memory_budget=None,
+                  artifact_detector=None, grid=None, shard_index=0, num_shards=1):
+    # Third Party
+    from histolab.masks import TissueMask
+
+    # patho_pix
+    from patho_pix.utils import AwesomeTiler
+
     # Initialize Tiler
     wsi_tiler = AwesomeTiler(
         tile_size=tile_size,
@@ -40,7 +63,53 @@ def tile_wsi_mask(wsi_img, wsi_label, tile_size=(1024, 1024)):
         tissue_percent=10.0,
         prefix="patho-fix.",
         suffix=".png",
+        mask_mode=mask_mode,
+        mask_lut=mask_lut,
+        prefilter=prefilter,
+        sampler=sampler,
+        memory_budget=memory_budget,
+        artifact_detector=artifact_detector,
     )
     # extract tile
-    metadata = wsi_tiler.extract(wsi_img, wsi_label, extraction_mask=TissueMask())
+    metadata = wsi_tiler.extract(
+        wsi_img, wsi_label, extraction_mask=TissueMask(), workers=workers, writer=writer,
+        manifest=manifest, grid=grid, shard_index=shard_index, num_shards=num_shards,
+    )
+    # Stage timers and counters next to the metadata
+    if return_stats:
+        return metadata, wsi_tiler.stats.summary()
     return metadata
+
+
+# ---------------------------------------------------- #
+#       Sharded tiling of one slide over nodes         #
+# ---------------------------------------------------- #
+def tile_grid(wsi, tile_size=(1024, 1024), prefilter=False):
+    # Third Party
+    from histolab.masks import TissueMask
+
+    # patho_pix
+    from patho_pix.utils import AwesomeTiler
+
+    # Candidates of tile_wsi and tile_wsi_mask, computed once and saved with
+    # grid.save for the nodes extracting its shards
+    wsi_tiler = AwesomeTiler(
+        tile_size=tile_size,
+        check_tissue=True,
+        tissue_percent=10.0,
+        prefilter=prefilter,
+    )
+    return wsi_tiler.grid(wsi, extraction_mask=TissueMask())
+
+
+def merge_tile_shards(wsi_img, parts, wsi_label=None, tile_size=(1024, 1024), writers=None):
+    # patho_pix
+    from patho_pix.utils import AwesomeTiler
+
+    # Renumber the tiles of the shards of tile_wsi or tile_wsi_mask as one extraction
+    wsi_tiler = AwesomeTiler(
+        tile_size=tile_size,
+        prefix="patho-fix.",
+        suffix=".png",
+    )
+    return wsi_tiler.merge_shards(wsi_img, parts, wsi_label, writers)
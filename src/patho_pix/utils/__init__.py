@@ -1,7 +1,79 @@
-from .custom_tiler import AwesomeTiler
-from .jpeg_to_tiff import convert_jpeg_to_tiff
+# Standard Library
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .artifacts import ArtifactDetector
+    from .cache import SlideCache
+    from .custom_tiler import AwesomeTiler
+    from .grid import TileGrid
+    from .instrumentation import TilingStats
+    from .jpeg_to_tiff import (convert_jpeg_to_tiff,
+                               convert_many_to_pyramidal_tiff,
+                               convert_to_pyramidal_tiff)
+    from .manifest import TilingManifest
+    from .metadata import TileMetadata
+    from .multiscale import MultiScaleTiler
+    from .sampling import LabelSampler
+    from .superblocks import SuperblockReader
+    from .tissue import TissueScorer
+    from .writers import (DirectoryWriter, TarShardReader, TarShardWriter,
+                          TileCodec, TileWriter)
+
+# Module of every public name. Names are imported on first access, so that importing
+# one utility does not load the dependencies (histolab, OpenCV, SciPy) of the others.
+_EXPORTS = {
+    'ArtifactDetector': '.artifacts',
+    'SlideCache': '.cache',
+    'AwesomeTiler': '.custom_tiler',
+    'TileGrid': '.grid',
+    'TilingStats': '.instrumentation',
+    'convert_jpeg_to_tiff': '.jpeg_to_tiff',
+    'convert_many_to_pyramidal_tiff': '.jpeg_to_tiff',
+    'convert_to_pyramidal_tiff': '.jpeg_to_tiff',
+    'TilingManifest': '.manifest',
+    'TileMetadata': '.metadata',
+    'MultiScaleTiler': '.multiscale',
+    'LabelSampler': '.sampling',
+    'SuperblockReader': '.superblocks',
+    'TissueScorer': '.tissue',
+    'DirectoryWriter': '.writers',
+    'TarShardReader': '.writers',
+    'TarShardWriter': '.writers',
+    'TileCodec': '.writers',
+    'TileWriter': '.writers',
+}
 
 __all__ = [
     'convert_jpeg_to_tiff',
-    'AwesomeTiler'
+    'convert_many_to_pyramidal_tiff',
+    'convert_to_pyramidal_tiff',
+    'ArtifactDetector',
+    'AwesomeTiler',
+    'DirectoryWriter',
+    'LabelSampler',
+    'MultiScaleTiler',
+    'SlideCache',
+    'SuperblockReader',
+    'TarShardReader',
+    'TarShardWriter',
+    'TilingManifest',
+    'TilingStats',
+    'TileCodec',
+    'TileGrid',
+    'TileMetadata',
+    'TileWriter',
+    'TissueScorer',
 ]
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
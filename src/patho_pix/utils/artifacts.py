@@ -0,0 +1,158 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+from typing import Optional, Tuple
+
+# Third Party
+import numpy as np
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+# Scores of every tile, in the order of the columns of ArtifactDetector.score
+ARTIFACT_SCORES = ("focus", "pen_ratio", "dark_ratio")
+
+
+# ---------------------------------------------------- #
+#                  Artifact Detection                  #
+# ---------------------------------------------------- #
+class ArtifactDetector:
+    """Artifact scores of stacks of tiles, and the policy dropping the tiles with
+    artifacts before they are written.
+
+    Every score is computed for a whole stack at once, with OpenCV on the tiles
+    stacked into one tall image:
+
+    - ``focus``: variance of the Laplacian of the grayscale tile, low for blurry
+      (out of focus) tiles. The rows and columns at the tile borders are left out, so
+      that tiles do not see each other.
+    - ``pen_ratio``: fraction of pen ink pixels, saturated pixels whose hue is in
+      ``pen_hue`` (green to blue marker ink, away from the pink and purple of H&E).
+    - ``dark_ratio``: fraction of pixels darker than ``dark_value``, as tissue folds,
+      overlapping tissue, black ink or debris.
+
+    Transparent pixels, outside of the slide, are neither pen nor dark. A tile is
+    dropped if its focus is below ``min_focus``, its pen ratio above
+    ``max_pen_ratio`` or its dark ratio above ``max_dark_ratio``; a limit set to None
+    only records the score.
+
+    Arguments
+    ---------
+    min_focus : float, optional
+        Minimum variance of the Laplacian of the grayscale (0-255) tiles. Default is
+        50.0.
+    max_pen_ratio : float, optional
+        Maximum fraction (0.0 to 1.0) of pen ink pixels. Default is 0.05.
+    max_dark_ratio : float, optional
+        Maximum fraction (0.0 to 1.0) of dark pixels. Default is 0.25.
+    pen_hue : Tuple[int, int], optional
+        [start, stop) range of the OpenCV hue (0-179) of pen ink. Default is (35, 118),
+        i.e. 70 to 236 degrees.
+    pen_saturation : int, optional
+        Minimum saturation (0-255) of pen ink pixels. Default is 80.
+    dark_value : int, optional
+        Value (0-255, maximum of the RGB channels) below which pixels are dark.
+        Default is 90.
+    batch_size : int, optional
+        Number of tiles scored at once by ``AwesomeTiler``. Default is 64.
+    """
+
+    def __init__(
+        self,
+        min_focus: Optional[float] = 50.0,
+        max_pen_ratio: Optional[float] = 0.05,
+        max_dark_ratio: Optional[float] = 0.25,
+        pen_hue: Tuple[int, int] = (35, 118),
+        pen_saturation: int = 80,
+        dark_value: int = 90,
+        batch_size: int = 64,
+    ):
+        for name, ratio in [("max_pen_ratio", max_pen_ratio), ("max_dark_ratio", max_dark_ratio)]:
+            if ratio is not None and not 0.0 <= ratio <= 1.0:
+                raise ValueError(f"{name} must be between 0 and 1 ({ratio})")
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be greater than 0 ({batch_size})")
+        self.min_focus = min_focus
+        self.max_pen_ratio = max_pen_ratio
+        self.max_dark_ratio = max_dark_ratio
+        self.pen_hue = tuple(pen_hue)
+        self.pen_saturation = pen_saturation
+        self.dark_value = dark_value
+        self.batch_size = batch_size
+
+    def score(self, tiles: np.ndarray) -> np.ndarray:
+        """Return the (n, 3) ``ARTIFACT_SCORES`` of a (n, height, width, channels)
+        uint8 RGB or RGBA stack."""
+        # Third Party
+        import cv2
+
+        tiles = np.asarray(tiles)
+        n_tiles, height, width, channels = tiles.shape
+        scores = np.empty((n_tiles, len(ARTIFACT_SCORES)), dtype=np.float64)
+        if n_tiles == 0:
+            return scores
+        # All tiles one below the other, as OpenCV works on 2D images
+        tall = np.ascontiguousarray(tiles).reshape(n_tiles * height, width, channels)
+        rgb = cv2.cvtColor(tall, cv2.COLOR_RGBA2RGB) if channels == 4 else tall
+
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        laplacian = cv2.Laplacian(gray, cv2.CV_16S).reshape(n_tiles, height, width)
+        laplacian = laplacian[:, 1:-1, 1:-1]
+        n_pixels = max(laplacian[0].size, 1)
+        mean = laplacian.sum(axis=(1, 2), dtype=np.float64) / n_pixels
+        squares = np.einsum("nhw,nhw->n", laplacian, laplacian, dtype=np.float64, casting="unsafe")
+        scores[:, 0] = np.maximum(squares / n_pixels - mean ** 2, 0)
+
+        hue, saturation, value = np.moveaxis(
+            cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV).reshape(n_tiles, height, width, 3), -1, 0
+        )
+        pen = (hue >= self.pen_hue[0]) & (hue < self.pen_hue[1]) & (saturation >= self.pen_saturation)
+        dark = value < self.dark_value
+        if channels == 4:
+            opaque = tiles[..., 3] > 0
+            pen &= opaque
+            dark &= opaque
+        scores[:, 1] = pen.mean(axis=(1, 2))
+        scores[:, 2] = dark.mean(axis=(1, 2))
+        return scores
+
+    def rejections(self, scores: np.ndarray) -> np.ndarray:
+        """Return the (n, 3) flags of the limits of ``ARTIFACT_SCORES`` every tile
+        exceeds, all False for the limits set to None."""
+        scores = np.asarray(scores).reshape(-1, len(ARTIFACT_SCORES))
+        flags = np.zeros(scores.shape, dtype=bool)
+        if self.min_focus is not None:
+            flags[:, 0] = scores[:, 0] < self.min_focus
+        if self.max_pen_ratio is not None:
+            flags[:, 1] = scores[:, 1] > self.max_pen_ratio
+        if self.max_dark_ratio is not None:
+            flags[:, 2] = scores[:, 2] > self.max_dark_ratio
+        return flags
+
+    def rejects(self, scores: np.ndarray) -> np.ndarray:
+        """Return whether every tile is dropped, from its ``score``."""
+        return self.rejections(scores).any(axis=1)
+
+    def params(self) -> dict:
+        """Return the settings of the detector, e.g. for a manifest."""
+        return {
+            "min_focus": self.min_focus,
+            "max_pen_ratio": self.max_pen_ratio,
+            "max_dark_ratio": self.max_dark_ratio,
+            "pen_hue": list(self.pen_hue),
+            "pen_saturation": self.pen_saturation,
+            "dark_value": self.dark_value,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"ArtifactDetector(min_focus={self.min_focus}, max_pen_ratio={self.max_pen_ratio}, "
+            f"max_dark_ratio={self.max_dark_ratio}, pen_hue={self.pen_hue}, "
+            f"pen_saturation={self.pen_saturation}, dark_value={self.dark_value}, "
+            f"batch_size={self.batch_size})"
+        )
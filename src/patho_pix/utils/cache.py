@@ -0,0 +1,308 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+from __future__ import annotations
+
+# Standard Library
+import hashlib
+import json
+import logging
+import os
+import types
+from typing import TYPE_CHECKING, Callable, Optional
+
+# Third Party
+import numpy as np
+from PIL import Image
+
+if TYPE_CHECKING:
+    # Third Party
+    from histolab.masks import BinaryMask
+    from histolab.slide import Slide
+
+logger = logging.getLogger("tiler")
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+# Environment variable of the default cache directory, "off" disables the cache
+CACHE_DIR_ENV = "PATHO_PIX_CACHE_DIR"
+DEFAULT_MAX_BYTES = 512 << 20
+# The content hash of a slide reads HASH_SAMPLES blocks of HASH_SAMPLE_SIZE bytes
+# spread over the file, instead of the whole file
+HASH_SAMPLES = 16
+HASH_SAMPLE_SIZE = 64 << 10
+
+
+# ---------------------------------------------------- #
+#                 Persistent Slide Cache               #
+# ---------------------------------------------------- #
+class SlideCache:
+    """On-disk cache of slide thumbnails, binary masks and labelled tissue regions.
+
+    Entries are keyed by the content hash of the slide file (its size, modification
+    time and blocks sampled over the whole file, so that renamed slides and copies
+    keeping the modification time still hit the cache and rewritten ones do not), by
+    the kind of entry and by the parameters it depends on, e.g. the class and filters
+    of the ``BinaryMask``. Thumbnails are stored as PNG, masks and labels as
+    compressed NumPy files. Once the cache exceeds ``max_bytes``, the least recently
+    used entries are deleted. A cache directory which cannot be written (read-only or
+    full) is logged and the values are computed without being cached.
+
+    Arguments
+    ---------
+    directory : str
+        Directory of the cache files, created if missing.
+    max_bytes : int, optional
+        Size of the cache above which entries are evicted. Default is 512 MiB.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._hashes = {}
+
+    @classmethod
+    def default(cls) -> Optional["SlideCache"]:
+        """Return the cache in ``$PATHO_PIX_CACHE_DIR``, by default in
+        ``$XDG_CACHE_HOME/patho-pix`` (``~/.cache/patho-pix``), or None if the
+        variable is set to "off" or to an empty string."""
+        directory = os.environ.get(CACHE_DIR_ENV)
+        if directory is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+                os.path.expanduser("~"), ".cache"
+            )
+            directory = os.path.join(cache_home, "patho-pix")
+        if directory.lower() in ("", "off"):
+            return None
+        return cls(directory)
+
+    # ------- cached values -------
+
+    def thumbnail(self, slide: Slide) -> Image.Image:
+        """Return the thumbnail of ``slide``, read from the cache if possible."""
+        path = self._path("thumbnail", slide, {}, ".png")
+        if os.path.exists(path):
+            _touch(path)
+            with Image.open(path) as cached:
+                return cached.convert("RGB")
+        thumbnail = slide.thumbnail.convert("RGB")
+        self._save(path, lambda fd: thumbnail.save(fd, format="PNG", compress_level=1))
+        return thumbnail
+
+    def binary_mask(self, slide: Slide, extraction_mask: BinaryMask) -> np.ndarray:
+        """Return ``extraction_mask(slide)``, computed from the cached thumbnail."""
+        return self.from_thumbnail(
+            "mask", slide, _mask_params(extraction_mask), extraction_mask
+        ).astype(bool)
+
+    def labelled_regions(self, slide: Slide, extraction_mask: BinaryMask) -> np.ndarray:
+        """Return the connected regions of ``binary_mask`` labelled from 1, in the
+        order of ``histolab.util.regions_from_binary_mask``."""
+        return self.array(
+            "regions", slide, _mask_params(extraction_mask),
+            lambda: label_regions(self.binary_mask(slide, extraction_mask)),
+        )
+
+    def from_thumbnail(
+        self,
+        kind: str,
+        slide: Slide,
+        params: dict,
+        compute: Callable[[Slide], np.ndarray],
+    ) -> np.ndarray:
+        """Return the cached ``kind`` array as ``array``, calling ``compute`` on a miss
+        with ``slide`` whose ``thumbnail`` is the cached thumbnail, so that the
+        thumbnail is not generated again from the slide."""
+
+        def compute_from_thumbnail():
+            return compute(_ThumbnailSlide(slide, self.thumbnail(slide)))
+
+        return self.array(kind, slide, params, compute_from_thumbnail)
+
+    def array(
+        self,
+        kind: str,
+        slide: Slide,
+        params: dict,
+        compute: Callable[[], np.ndarray],
+    ) -> np.ndarray:
+        """Return the cached ``kind`` array of ``slide`` for ``params``, calling and
+        caching ``compute()`` on a miss. The thumbnail size is part of the key.
+        ``params`` must be JSON serializable; values which are not are keyed by their
+        ``repr``."""
+        path = self._path(kind, slide, params, ".npz")
+        if os.path.exists(path):
+            try:
+                with np.load(path) as cached:
+                    array = cached["array"]
+                _touch(path)
+                return array
+            except (OSError, ValueError, KeyError):
+                # Truncated or foreign file: computed again and overwritten
+                pass
+        array = np.asarray(compute())
+        self._save(path, lambda fd: np.savez_compressed(fd, array=array))
+        return array
+
+    # ------- cache maintenance -------
+
+    def size(self) -> int:
+        """Total size in bytes of the cache files."""
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def clear(self) -> None:
+        """Delete every cache entry."""
+        for path in self._entries():
+            os.remove(path)
+
+    def slide_hash(self, slide: Slide) -> str:
+        """Return the content hash of the file of ``slide``."""
+        path = os.path.realpath(slide._path)
+        stat = os.stat(path)
+        memo_key = (path, stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._hashes:
+            self._hashes[memo_key] = _content_hash(path, stat)
+        return self._hashes[memo_key]
+
+    # ------- implementation helpers -------
+
+    def _path(self, kind: str, slide: Slide, params: dict, extension: str) -> str:
+        thumbnail = [list(slide._thumbnail_size), slide._use_largeimage]
+        key = json.dumps(
+            [self.slide_hash(slide), thumbnail, kind, params], sort_keys=True, default=repr
+        )
+        digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, f"{kind}-{digest}{extension}")
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            entry.path
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+
+    def _save(self, path: str, write: Callable) -> None:
+        """Write the entry ``path`` atomically; on a filesystem error, log it and leave
+        the value uncached."""
+        path_tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path_tmp, "wb") as fd:
+                write(fd)
+            os.replace(path_tmp, path)
+        except OSError as error:
+            logger.warning("Slide cache %s not written, continuing uncached: %s", self.directory, error)
+            try:
+                os.remove(path_tmp)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in
+        ``max_bytes``."""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                logger.warning("Slide cache entry %s not evicted: %s", path, error)
+                return
+            total -= size
+
+
+class _ThumbnailSlide:
+    """``slide`` with its ``thumbnail`` replaced by an image already computed, passed
+    to the masks instead of the slide."""
+
+    def __init__(self, slide: Slide, thumbnail: Image.Image):
+        self._slide = slide
+        self.thumbnail = thumbnail
+
+    def __getattr__(self, name: str):
+        return getattr(self._slide, name)
+
+
+def _touch(path: str) -> None:
+    """Mark the entry ``path`` as recently used, if the cache can be written."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def label_regions(binary_mask: np.ndarray) -> np.ndarray:
+    """Label the connected regions of ``binary_mask`` as
+    ``histolab.util.regions_from_binary_mask`` does (8-connectivity, background 0)."""
+    # Third Party
+    from skimage.measure import label
+
+    return label(binary_mask).astype(np.int32)
+
+
+def _mask_params(extraction_mask: BinaryMask) -> dict:
+    return _describe(extraction_mask)
+
+
+def _describe(value):
+    """Describe ``value`` with JSON types: objects by their class and attributes,
+    functions by their qualified name."""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _describe(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType, type)):
+        return f"{value.__module__}.{value.__qualname__}"
+    if hasattr(value, "__dict__"):
+        value_type = type(value)
+        return {
+            "class": f"{value_type.__module__}.{value_type.__qualname__}",
+            **_describe(vars(value)),
+        }
+    return repr(value)
+
+
+def _content_hash(path: str, stat: os.stat_result) -> str:
+    """Hash the size and modification time of the file and ``HASH_SAMPLES`` blocks
+    spread over it. Slides stored as a directory are hashed by the names, sizes and
+    dates of their files."""
+    size = stat.st_size
+    digest = hashlib.blake2b(f"{size}:{stat.st_mtime_ns}".encode(), digest_size=16)
+    if os.path.isdir(path):
+        for root, _, filenames in sorted(os.walk(path)):
+            for filename in sorted(filenames):
+                stat = os.stat(os.path.join(root, filename))
+                digest.update(f"{os.path.relpath(root, path)}/{filename}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+    last_offset = max(size - HASH_SAMPLE_SIZE, 0)
+    offsets = sorted({
+        sample * last_offset // (HASH_SAMPLES - 1) for sample in range(HASH_SAMPLES)
+    })
+    with open(path, "rb") as fd:
+        for offset in offsets:
+            fd.seek(offset)
+            digest.update(fd.read(HASH_SAMPLE_SIZE))
+    return digest.hexdigest()
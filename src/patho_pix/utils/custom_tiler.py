@@ -8,24 +8,57 @@
 # Standard Library
 import logging
 import os
-from typing import Tuple
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 # Third Party
 import numpy as np
 from histolab.exceptions import TileSizeOrCoordinatesError
+from histolab.filters import image_filters as imf
 from histolab.masks import BiggestTissueBoxMask, BinaryMask
 from histolab.slide import Slide
 from histolab.tile import Tile
 from histolab.tiler import Tiler
 from histolab.types import CoordinatePair
-from histolab.util import (rectangle_to_mask, region_coordinates,
-                           regions_from_binary_mask, regions_to_binary_mask,
-                           scale_coordinates)
+from histolab.util import rectangle_to_mask, scale_coordinates
+from PIL import Image
+from scipy import ndimage
+
+# patho_pix
+from patho_pix.utils.artifacts import ARTIFACT_SCORES, ArtifactDetector
+from patho_pix.utils.cache import SlideCache, label_regions
+from patho_pix.utils.grid import TileGrid
+from patho_pix.utils.instrumentation import TilingStats, image_nbytes
+from patho_pix.utils.manifest import TilingManifest, params_hash
+from patho_pix.utils.memory import (BufferLimits, buffer_limits,
+                                    limit_slide_cache, release_slide_caches,
+                                    release_tile_caches)
+from patho_pix.utils.metadata import TileMetadata
+from patho_pix.utils.sampling import LabelSampler, label_histogram
+from patho_pix.utils.superblocks import SUPERBLOCK_BYTES, SuperblockReader
+from patho_pix.utils.tissue import TissueScorer
+from patho_pix.utils.writers import DirectoryWriter, TileCodec, TileWriter
 
 logger = logging.getLogger("tiler")
 
 COORDS_WITHIN_EXTRACTION_MASK_THRESHOLD = 0.8
 
+# Number of coordinate chunks handed to each worker in parallel mode. Several smaller
+# chunks per worker balance the load when tissue is unevenly spread over the slide.
+CHUNKS_PER_WORKER = 4
+
+MASK_MODES = ("rgb", "label", "palette")
+
+# Parameters of the manifest the candidate grid depends on, see AwesomeTiler.grid
+GRID_PARAMS = (
+    "slide", "tile_size", "final_tile_size", "level", "mpp", "pixel_overlap",
+    "check_tissue", "tissue_percent", "prefilter", "extraction_mask",
+)
+
 
 # ---------------------------------------------------- #
 #            Custom GridTiler: AwesomeTiler            #
@@ -53,10 +86,78 @@ class AwesomeTiler(Tiler):
     prefix : str, optional
         Prefix to be added to the tile filename. Default is an empty string.
     suffix : str, optional
-        Suffix to be added to the tile filename. Default is '.png'
+        Suffix to be added to the tile filename. Its extension must match the format
+        of ``image_codec``. Default is '.png'
     mpp : float, optional
         Micron per pixel resolution of extracted tiles. Takes precedence over level.
         Default is None.
+    mask_mode : str, {"rgb", "label", "palette"}
+        How mask tiles are saved. "rgb" saves the mask slide region as read (RGBA).
+        "label" saves a single-channel uint8 image of class values, read straight from
+        the slide region without building a Tile. "palette" saves the same class
+        values as a palette image, coloured with ``mask_lut``. Default is "rgb".
+    mask_lut : Dict[Tuple[int, int, int], int], optional
+        Colour-to-class lookup table used by the "label" and "palette" modes. Mask
+        colours missing from the table are mapped to class 0. If None, the first
+        channel of the mask is used as class value. Default is None.
+    mask_compress_level : int, optional
+        PNG compression level (0-9) of "label" and "palette" mask tiles, unless
+        ``mask_codec`` sets its own. The default 1 favours encoding speed, the output
+        stays lossless.
+    image_codec : TileCodec, optional
+        Format and encoder options of the image tiles, e.g. ``TileCodec("jpeg",
+        quality=90)`` or ``TileCodec("png", compress_level=1)``. Default is the format
+        of ``suffix`` with the default options of Pillow.
+    mask_codec : TileCodec, optional
+        Format and encoder options of the mask tiles, which must be lossless, e.g.
+        ``TileCodec("webp", lossless=True)``. If its extension differs from the one of
+        ``suffix``, the default writer names the mask files with it. Default is
+        ``image_codec`` if it is lossless, PNG otherwise.
+    prefilter : bool, optional
+        Whether to estimate the tissue percentage of every candidate tile from the
+        thumbnail before reading it, and to skip the full resolution read of the tiles
+        clearly below ``tissue_percent``. Only the remaining tiles get the exact tissue
+        check. The number of skipped reads is logged and kept in
+        ``prefilter_stats``. Considered only if ``check_tissue`` equals to True.
+        Default is False.
+    prefilter_margin : float, optional
+        Fraction of ``tissue_percent`` below which the thumbnail estimate rejects a
+        tile. Lower values only skip emptier tiles. Default is 0.5.
+    cache : SlideCache or bool, optional
+        Cache of the thumbnails, tissue masks and regions of the slides. True uses
+        ``SlideCache.default()``, False disables it. Default is True.
+    superblock_bytes : int, optional
+        Maximum size of the RGBA pixels read from the slide at once. Neighbouring
+        tiles of a grid column are read with one region read of up to this size and
+        sliced from it, see ``SuperblockReader``. The tiles are the same as when read
+        one by one. 0 reads every tile on its own, as do extractions with ``mpp``.
+        Default is 32 MiB.
+    sampler : LabelSampler, optional
+        Policy deciding from the label histogram of the mask tile which tiles of an
+        image + mask extraction are written, e.g. per-class quotas or a minimum
+        foreground fraction. Tiles it drops are not encoded. Default is None, every
+        tile with enough tissue is written.
+    memory_budget : int, optional
+        Memory in bytes an extraction may add to its process (and to each of its
+        worker processes). The tiles in flight (``max_pending``, the encoded chunks of
+        a parallel extraction), the superblocks, the openslide tile cache and the
+        metadata rows kept in memory are sized to fit in it (see ``buffer_limits``),
+        metadata rows beyond are spilled to disk, and the thumbnails and tissue masks
+        histolab caches are released once the grid is computed. Default is None, no
+        budget.
+    tissue_scorer : TissueScorer, optional
+        Batched tissue check replacing histolab's ``Tile.has_enough_tissue``: the
+        tiles are read by blocks of ``batch_size`` (at most ``max_pending`` within a
+        memory budget) and the tissue of every block is scored in one vectorized
+        pass, with a fixed threshold or one fitted on the slide thumbnail. The
+        ``tissue_ratio`` of the tiles is the fraction the scorer computes.
+        Considered only if ``check_tissue`` equals to True. Default is None.
+    artifact_detector : ArtifactDetector, optional
+        Artifact scoring of the tiles with enough tissue, by blocks of ``batch_size``
+        tiles (at most ``max_pending`` within a memory budget): focus, pen ink and
+        dark (fold) scores are stored in the metadata (``artifact_scores``), and the
+        tiles the detector rejects are dropped before their mask is read and before
+        they are encoded and written. Default is None, no artifact scoring.
     """
 
     def __init__(
@@ -69,7 +170,32 @@ class AwesomeTiler(Tiler):
         prefix: str = "",
         suffix: str = ".png",
         mpp: float = None,
+        mask_mode: str = "rgb",
+        mask_lut: Optional[Dict[Tuple[int, int, int], int]] = None,
+        mask_compress_level: int = 1,
+        prefilter: bool = False,
+        prefilter_margin: float = 0.5,
+        image_codec: Optional[TileCodec] = None,
+        mask_codec: Optional[TileCodec] = None,
+        cache: Union[SlideCache, bool] = True,
+        superblock_bytes: int = SUPERBLOCK_BYTES,
+        sampler: Optional[LabelSampler] = None,
+        memory_budget: Optional[int] = None,
+        tissue_scorer: Optional[TissueScorer] = None,
+        artifact_detector: Optional[ArtifactDetector] = None,
     ):
+        if mask_mode not in MASK_MODES:
+            raise ValueError(f"mask_mode must be one of {MASK_MODES} ({mask_mode})")
+        if image_codec is None:
+            image_codec = TileCodec.from_suffix(suffix)
+        elif not image_codec.matches(suffix):
+            raise ValueError(
+                f"suffix {suffix!r} does not match the image codec {image_codec!r}"
+            )
+        if mask_codec is None:
+            mask_codec = image_codec if image_codec.lossless else TileCodec("png")
+        elif not mask_codec.lossless:
+            raise ValueError(f"Mask tiles need a lossless codec ({mask_codec!r})")
         self.tile_size = tile_size
         self.final_tile_size = tile_size
         self.level = level if mpp is None else 0
@@ -77,16 +203,44 @@ class AwesomeTiler(Tiler):
         self.check_tissue = check_tissue
         self.tissue_percent = tissue_percent
         self.pixel_overlap = pixel_overlap
+        self.final_pixel_overlap = pixel_overlap
         self.prefix = prefix
         self.suffix = suffix
+        self.mask_mode = mask_mode
+        self.mask_lut = mask_lut
+        self.mask_compress_level = mask_compress_level
+        self.prefilter = prefilter
+        self.prefilter_margin = prefilter_margin
+        self.image_codec = image_codec
+        self.mask_codec = mask_codec
+        self.cache = cache
+        self.superblock_bytes = superblock_bytes
+        self.sampler = sampler
+        self.memory_budget = memory_budget
+        self.tissue_scorer = tissue_scorer
+        self.artifact_detector = artifact_detector
+        self.prefilter_stats = {"candidates": 0, "skipped_reads": 0}
+        self.stats = TilingStats()
+        self._log_every = 1
+        self._limits: Optional[BufferLimits] = None
 
     def extract(
         self,
         wsi_img: Slide,
-        wsi_label: Slide,
+        wsi_label: Optional[Slide] = None,
         extraction_mask: BinaryMask = BiggestTissueBoxMask(),
         log_level: str = "INFO",
-    ) -> None:
+        workers: int = 1,
+        writer: Optional[TileWriter] = None,
+        manifest: Optional[str] = None,
+        log_every: int = 100,
+        profile_hook: Optional[Callable[[str, float], None]] = None,
+        encoders: Optional[int] = None,
+        max_pending: int = 16,
+        grid: Optional[TileGrid] = None,
+        shard_index: int = 0,
+        num_shards: int = 1,
+    ) -> TileMetadata:
         """Extract tiles arranged in a grid and save them to disk, following this
         filename pattern:
         `{prefix}tile_{tiles_counter}_level{level}_{x_ul_wsi}-{y_ul_wsi}-{x_br_wsi}-{y_br_wsi}{suffix}`
@@ -95,13 +249,69 @@ class AwesomeTiler(Tiler):
         ----------
         wsi_img : Slide
             Image slide from which to extract the tiles
-        wsi_label : Slide
-            Mask slide from which to extract the tiles
+        wsi_label : Slide, optional
+            Mask slide from which to extract the tiles. If None, only image tiles are
+            extracted. Default is None.
         extraction_mask : BinaryMask, optional
             BinaryMask object defining how to compute a binary mask from a Slide.
             Default `BiggestTissueBoxMask`.
         log_level : str, {"DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"}
             Threshold level for the log messages. Default "INFO"
+        workers : int, optional
+            Number of worker processes used to read, check and encode the tiles. Each
+            worker opens its own handles on both slides. The returned metadata and the
+            tile numbering do not depend on the number of workers. Default is 1, which
+            extracts the tiles serially in the calling process.
+        writer : TileWriter, optional
+            Destination of the encoded "image" and "mask" tiles, e.g. a
+            ``TarShardWriter``. The writer is not closed by this method. Default
+            writes every tile as a file in the ``processed_path`` of its slide.
+        manifest : str, optional
+            Path of a manifest file recording every written tile as soon as it is
+            written. If the manifest of an interrupted run with the same parameters
+            (tiles, level, overlap, tissue and mask settings, slides) exists, the tiles
+            it records and the writer can verify are kept and only the remaining grid
+            is extracted. A manifest written with other parameters is discarded.
+            Default is None, no manifest.
+        log_every : int, optional
+            Log one saved tile out of ``log_every``, 0 disables the per tile messages.
+            Default is 100.
+        profile_hook : Callable[[str, float], None], optional
+            Called with the stage name and its duration in seconds after every timed
+            stage, see ``TilingStats``. Default is None.
+        encoders : int, optional
+            Number of background threads encoding the tiles of a serial extraction
+            while the next tiles are read. Tiles are still written one after the other
+            in grid order. 0 encodes each tile in the calling thread before reading
+            the next one. Worker processes of a parallel extraction encode their own
+            tiles. Default is None, 2 threads or fewer to leave one CPU to the reads.
+        max_pending : int, optional
+            Maximum number of tiles read but not written yet. Reading waits for the
+            oldest tile to be encoded and written once the limit is reached, which
+            caps the memory held by the encoder queue. Lowered to fit in the
+            ``memory_budget`` of the tiler. Default is 16.
+        grid : TileGrid, optional
+            Candidate grid computed once by ``grid`` and shared by the nodes of a
+            sharded extraction, instead of computing the candidates (and prefiltering
+            them) again. It must have been computed with the parameters of this tiler.
+            Default is None.
+        shard_index : int, optional
+            Shard of ``grid`` extracted by this call, from 0 to ``num_shards`` - 1.
+            Default is 0.
+        num_shards : int, optional
+            Number of shards ``grid`` is split into, see ``TileGrid.shard``. The
+            tiles of a shard are numbered from 0; ``merge_shards`` renumbers the
+            metadata and outputs of all shards as a single extraction. Default is 1.
+
+        Returns
+        -------
+        TileMetadata
+            Columnar metadata of the saved tiles, in extraction order, with the label
+            histogram of every mask tile (``label_counts``). It is also a mapping from
+            tile filename to ``[tissue_ratio, tile_size, (x_ul_wsi, y_ul_wsi)]``;
+            ``to_pandas`` and ``save`` export it. The stage timers and
+            counters of the extraction are kept in ``stats``; ``stats.summary()``
+            returns them as a dictionary, with the tiles/s and disk throughput.
 
         Raises
         ------
@@ -109,39 +319,213 @@ class AwesomeTiler(Tiler):
             If the tile size is larger than the slide size
         LevelError
             If the level is not available for the slide
+        ValueError
+            If the extraction is sharded without ``grid``, or ``grid`` was computed
+            with other parameters.
         """
+        if self.sampler is not None and wsi_label is None:
+            raise ValueError("Label sampling requires a mask slide (wsi_label)")
+        if grid is None and num_shards != 1:
+            raise ValueError("A sharded extraction requires the grid of the slide")
+        if num_shards > 1 and self.sampler is not None and (
+            self.sampler.quotas or self.sampler.max_per_class is not None
+        ):
+            raise ValueError("Label quotas depend on the tiles of all shards, they cannot be sharded")
         level = logging.getLevelName(log_level)
         logger.setLevel(level)
-        self._validate_level(wsi_img)
-        self.tile_size = self._tile_size(wsi_img)
-        self.pixel_overlap = int(self._scale_factor(wsi_img) * self.pixel_overlap)
-        self._validate_tile_size(wsi_img)
+        self._prepare(wsi_img)
+        if self.sampler is not None:
+            self.sampler.reset()
 
-        grid_tiles = self._tiles_generator(wsi_img, extraction_mask)
-        tiles_counter = 0
-        metadata = {}
-        for tiles_counter, (tile, tile_wsi_coords) in enumerate(grid_tiles):
-            # Domi edit: wsi_img tile
-            tile_filename = self._tile_filename(tile_wsi_coords, tiles_counter)
-            full_tile_path = os.path.join(wsi_img.processed_path, tile_filename)
-            tile.save(full_tile_path)
-            logger.info(f"\t Image Tile {tiles_counter} saved: {tile_filename}")
-            # Domi edit: wsi_label tile
-            mask_tile = self._tile_mask_extract(wsi_label, tile_wsi_coords)
-            tile_filename = self._tile_filename(tile_wsi_coords, tiles_counter)
-            full_tile_path = os.path.join(wsi_label.processed_path, tile_filename)
-            mask_tile.save(full_tile_path)
-            logger.info(f"\t Mask Tile {tiles_counter} saved: {tile_filename}")
-            # Domi edit: access metadata
-            metadata[tile_filename] = [
-                tile.tissue_ratio,
-                self.tile_size,
-                tile_wsi_coords[0:2]
-            ]
+        if writer is None:
+            writer = self._default_writer(wsi_img, wsi_label)
+        start_time = time.perf_counter()
+        self.stats = TilingStats(hook=profile_hook)
+        self._log_every = log_every
+
+        metadata = TileMetadata(
+            self.prefix,
+            self.suffix,
+            self.level,
+            self.tile_size,
+            wsi_img._path,
+            self._n_classes() if wsi_label is not None else 0,
+            self._linked_names(),
+            ARTIFACT_SCORES if self.artifact_detector is not None else (),
+        )
+        self._limits = self._buffer_limits(wsi_label, workers, metadata)
+        if self._limits is not None:
+            max_pending = min(max_pending, self._limits.max_pending)
+            metadata.spill_rows = self._limits.spill_rows
+            limit_slide_cache([wsi_img, wsi_label], self._limits.slide_cache_bytes)
+        first_candidate = 0
+        tiling_manifest = None
+        if manifest is not None:
+            manifest_params = self._manifest_params(wsi_img, wsi_label, extraction_mask)
+            if grid is not None:
+                manifest_params["shard"] = [shard_index, num_shards, grid.params_hash]
+            tiling_manifest = TilingManifest(manifest, manifest_params)
+            for entry in tiling_manifest.resume(writer.verify):
+                label_counts = None
+                if "label_counts" in entry:
+                    label_counts = np.zeros(metadata.n_classes, dtype=np.uint32)
+                    for label, count in entry["label_counts"].items():
+                        label_counts[int(label)] = count
+                    if self.sampler is not None:
+                        self.sampler.add(label_counts)
+                artifact_scores = None
+                if "artifacts" in entry:
+                    artifact_scores = [entry["artifacts"][name] for name in metadata.artifacts]
+                metadata.append(
+                    entry["candidate"],
+                    entry["coords"],
+                    entry["tissue_ratio"],
+                    entry.get("label_ratio"),
+                    label_counts,
+                    self._linked_coordinates(CoordinatePair(*entry["coords"])),
+                    artifact_scores,
+                )
+            first_candidate = tiling_manifest.processed + 1
+            logger.info(f"Resuming after {len(metadata)} tiles listed in {manifest}")
+
+        if self.check_tissue and self.tissue_scorer is not None:
+            with self.stats.time("tissue_fit"):
+                self._fit_tissue_scorer(wsi_img)
+
+        if grid is None:
+            candidates, last_candidate = self._candidates(
+                wsi_img, extraction_mask, first_candidate
+            )
+        else:
+            candidates, last_candidate = self._shard_candidates(
+                wsi_img, extraction_mask, grid, shard_index, num_shards, first_candidate
+            )
+        if self.memory_budget is not None:
+            release_slide_caches(extraction_mask)
+        if workers > 1:
+            self._extract_parallel(
+                wsi_img, wsi_label, candidates, workers, writer, tiling_manifest, metadata
+            )
+        else:
+            if encoders is None:
+                encoders = min(2, (os.cpu_count() or 1) - 1)
+            self._extract_serial(
+                wsi_img,
+                wsi_label,
+                candidates,
+                encoders,
+                max_pending,
+                writer,
+                tiling_manifest,
+                metadata,
+            )
 
-        logger.info(f"{tiles_counter} Grid Tiles have been saved.")
+        if tiling_manifest is not None:
+            tiling_manifest.close(processed=last_candidate)
+        self.stats.add_time("total", time.perf_counter() - start_time)
+        summary = self.stats.summary()
+        logger.info("%d Grid Tiles have been saved.", len(metadata))
+        logger.info(
+            "Throughput: %.1f tiles/s, %.1f MiB/s written",
+            summary["throughput"]["tiles_per_s"],
+            summary["throughput"]["written_mb_per_s"],
+        )
+        logger.info("Tiling stages: %s", summary)
         return metadata
 
+    def grid(
+        self, wsi_img: Slide, extraction_mask: BinaryMask = BiggestTissueBoxMask()
+    ) -> TileGrid:
+        """Compute the candidate tiles of ``extract`` once, to split the extraction of
+        one slide into shards extracted on separate nodes.
+
+        The grid holds the candidate coordinates within ``extraction_mask``, without
+        the ones the thumbnail prefilter skips if enabled. ``TileGrid.save`` writes it
+        for the other nodes, which extract their shard with ``extract(...,
+        grid=grid, shard_index=i, num_shards=n)``; ``merge_shards`` then merges the
+        shards.
+
+        Parameters
+        ----------
+        wsi_img : Slide
+            Image slide from which to extract the tiles
+        extraction_mask : BinaryMask, optional
+            BinaryMask object defining how to compute a binary mask from a Slide.
+            Default `BiggestTissueBoxMask`.
+
+        Returns
+        -------
+        TileGrid
+            Index in the grid and level 0 coordinates of the candidate tiles.
+        """
+        self._prepare(wsi_img)
+        candidates, _ = self._candidates(wsi_img, extraction_mask)
+        return TileGrid(
+            np.array([candidate for candidate, _ in candidates], dtype=np.int64),
+            np.array([coords for _, coords in candidates], dtype=np.int64).reshape(-1, 4),
+            self._grid_params(wsi_img, extraction_mask),
+        )
+
+    def merge_shards(
+        self,
+        wsi_img: Slide,
+        parts: List[TileMetadata],
+        wsi_label: Optional[Slide] = None,
+        writers: Optional[List[TileWriter]] = None,
+    ) -> TileMetadata:
+        """Merge the shards of a sharded extraction into the result of a single
+        extraction of the whole grid.
+
+        The metadata of the shards are merged in shard order (see
+        ``TileMetadata.merge``) and every written tile is renamed from its tile
+        counter in its shard to its counter in the merged metadata. As the filenames
+        hold the tile coordinates, renamed tiles never overwrite tiles of another
+        shard, and a merge interrupted midway can be run again.
+
+        Parameters
+        ----------
+        wsi_img : Slide
+            Image slide from which the tiles were extracted
+        parts : List[TileMetadata]
+            Metadata returned by ``extract`` for every shard, in shard order.
+        wsi_label : Slide, optional
+            Mask slide from which the tiles were extracted. Default is None.
+        writers : List[TileWriter], optional
+            Writer of every shard, which renames its tiles, e.g. a
+            ``TarShardWriter`` opened with ``append=True`` on the shard directory,
+            closed by the caller. Default renames the files written by the default
+            writer in the ``processed_path`` of the slides.
+
+        Returns
+        -------
+        TileMetadata
+            Metadata of all the tiles, numbered as by a single extraction.
+
+        Raises
+        ------
+        ValueError
+            If the number of writers does not match the number of shards, or if a
+            writer cannot rename tiles (``TileWriter.can_rename``). Nothing is renamed
+            then.
+        """
+        merged = TileMetadata.merge(parts)
+        if writers is None:
+            writers = [self._default_writer(wsi_img, wsi_label)] * len(parts)
+        if len(writers) != len(parts):
+            raise ValueError(f"{len(writers)} writers for {len(parts)} shards")
+        for writer in writers:
+            if not writer.can_rename:
+                raise ValueError(f"{type(writer).__name__} cannot rename tiles, shards cannot be merged")
+        row = 0
+        for part, writer in zip(parts, writers):
+            for part_row in range(len(part)):
+                filename = part.filename(part_row)
+                merged_filename = merged.filename(row)
+                if filename != merged_filename:
+                    writer.rename(filename, merged_filename)
+                row += 1
+        return merged
+
     @property
     def tile_size(self) -> Tuple[int, int]:
         """(width, height) of the extracted tiles."""
@@ -155,6 +539,582 @@ class AwesomeTiler(Tiler):
 
     # ------- implementation helpers -------
 
+    def _prepare(self, wsi_img: Slide) -> None:
+        """Validate the level and set the tile size and the overlap of ``wsi_img``.
+
+        Raises
+        ------
+        TileSizeError
+            If the tile size is larger than the slide size
+        LevelError
+            If the level is not available for the slide
+        """
+        self._validate_level(wsi_img)
+        # Scaled from the requested values, so that preparing again (e.g. ``grid``
+        # then ``extract``) does not scale them twice
+        self.tile_size = self.final_tile_size
+        self.tile_size = self._tile_size(wsi_img)
+        self.pixel_overlap = int(self._scale_factor(wsi_img) * self.final_pixel_overlap)
+        self._validate_tile_size(wsi_img)
+
+    def _candidates(
+        self, wsi_img: Slide, extraction_mask: BinaryMask, first_candidate: int = 0
+    ) -> Tuple[List[Tuple[int, CoordinatePair]], int]:
+        """Return the candidate coordinates from ``first_candidate`` on with their
+        index in the grid, prefiltered if enabled, and the index of the last one."""
+        with self.stats.time("coordinates"):
+            candidates = list(
+                islice(
+                    enumerate(
+                        self._grid_coordinates_generator(wsi_img, extraction_mask)
+                    ),
+                    first_candidate,
+                    None,
+                )
+            )
+        last_candidate = first_candidate + len(candidates) - 1
+        self.stats.count("candidates", len(candidates))
+        if self.prefilter and self.check_tissue:
+            with self.stats.time("prefilter"):
+                candidates = self._prefilter_candidates(wsi_img, candidates)
+            self.stats.count("prefiltered", self.prefilter_stats["skipped_reads"])
+        return candidates, last_candidate
+
+    def _shard_candidates(
+        self,
+        wsi_img: Slide,
+        extraction_mask: BinaryMask,
+        grid: TileGrid,
+        shard_index: int,
+        num_shards: int,
+        first_candidate: int = 0,
+    ) -> Tuple[List[Tuple[int, CoordinatePair]], int]:
+        """Return the candidates of shard ``shard_index`` of ``grid`` from
+        ``first_candidate`` on and the index of the last candidate of the shard."""
+        if grid.params_hash != params_hash(self._grid_params(wsi_img, extraction_mask)):
+            raise ValueError("The grid was computed with other tiling parameters")
+        shard = grid.shard(shard_index, num_shards)
+        candidates = [
+            (candidate, CoordinatePair(*coords))
+            for candidate, coords in shard
+            if candidate >= first_candidate
+        ]
+        self.stats.count("candidates", len(candidates))
+        last_candidate = max(first_candidate - 1, shard[-1][0] if shard else -1)
+        return candidates, last_candidate
+
+    def _grid_params(self, wsi_img: Slide, extraction_mask: BinaryMask) -> dict:
+        """Return the parameters the candidate grid depends on. The slide is known by
+        its filename, which does not depend on where the nodes mount it."""
+        params = self._manifest_params(wsi_img, None, extraction_mask)
+        params["slide"] = [os.path.basename(wsi_img._path), list(wsi_img.dimensions)]
+        return {name: params[name] for name in GRID_PARAMS}
+
+    def _default_writer(
+        self, wsi_img: Slide, wsi_label: Optional[Slide]
+    ) -> DirectoryWriter:
+        """Return a writer saving each tile in the ``processed_path`` of its slide."""
+        directories = {"image": wsi_img.processed_path}
+        extensions = {}
+        if wsi_label is not None:
+            directories["mask"] = wsi_label.processed_path
+            if not self.mask_codec.matches(self.suffix):
+                extensions["mask"] = self.mask_codec.extension
+        return DirectoryWriter(directories, extensions)
+
+    def _buffer_limits(
+        self, wsi_label: Optional[Slide], workers: int, metadata: TileMetadata
+    ) -> Optional[BufferLimits]:
+        """Return the buffer sizes fitting in ``memory_budget``, None without budget."""
+        if self.memory_budget is None:
+            return None
+        n_streams = (1 if wsi_label is None else 2) * (1 + len(self._linked_names()))
+        width, height = self.final_tile_size
+        return buffer_limits(
+            self.memory_budget,
+            4 * width * height * n_streams,
+            n_streams,
+            metadata.row_bytes(),
+            workers,
+        )
+
+    def _superblock_bytes(self) -> int:
+        """Return the superblock size of each reader, within the memory budget."""
+        if self._limits is None:
+            return self.superblock_bytes
+        return min(self.superblock_bytes, self._limits.superblock_bytes)
+
+    def _read_mask_tile(
+        self,
+        wsi_label: Optional[Slide],
+        tile_wsi_coords: CoordinatePair,
+        reader: Optional[SuperblockReader] = None,
+    ) -> Tuple[Optional[Image.Image], dict, Optional[np.ndarray]]:
+        """Read the mask tile matching an image tile, see ``_mask_tile_image``, and
+        count the pixels of each of its class values.
+
+        Returns None, no options and no counts if ``wsi_label`` is None.
+        """
+        if wsi_label is None:
+            return None, {}, None
+        with self.stats.time("read_mask"):
+            mask_image, save_options = self._mask_tile_image(
+                wsi_label, tile_wsi_coords, reader
+            )
+            label_counts = self._label_counts(mask_image, tile_wsi_coords, reader)
+        self.stats.count("read_bytes", image_nbytes(mask_image))
+        return mask_image, save_options, label_counts
+
+    def _label_counts(
+        self,
+        mask_image: Image.Image,
+        coords: CoordinatePair,
+        reader: Optional[SuperblockReader] = None,
+    ) -> np.ndarray:
+        """Return the number of pixels of every class value of a mask tile, counted
+        over the whole superblock at once if ``reader`` is given."""
+        classes = self._mask_classes if self.mask_mode == "rgb" else None
+        if reader is not None:
+            return reader.label_counts(coords, self._n_classes(), classes)
+        mask = np.asarray(mask_image)
+        return label_histogram(mask if classes is None else classes(mask), self._n_classes())
+
+    def _linked_names(self) -> List[str]:
+        """Names of the scales of the linked tiles, none for a single scale tiler."""
+        return []
+
+    def _linked_coordinates(self, coords: CoordinatePair) -> Optional[np.ndarray]:
+        """Level 0 coordinates of the linked tiles of the tile at ``coords``."""
+        return None
+
+    def _linked_readers(
+        self,
+        wsi_img: Slide,
+        wsi_label: Optional[Slide],
+        candidates: List[Tuple[int, CoordinatePair]],
+    ) -> Optional[list]:
+        """Readers of the linked tiles of the candidate tiles."""
+        return None
+
+    def _read_linked_tiles(
+        self, coords: CoordinatePair, readers: Optional[list]
+    ) -> Dict[str, Tuple[Image.Image, dict]]:
+        """Read the linked tiles of the tile at ``coords``, see ``_encode_tiles``."""
+        return {}
+
+    def _n_classes(self) -> int:
+        """Number of class values of the mask tiles: the largest class of
+        ``mask_lut`` + 1, 256 without table."""
+        if self.mask_lut:
+            return max(self.mask_lut.values()) + 1
+        return 256
+
+    def _sample(self, label_counts: Optional[np.ndarray]) -> bool:
+        """Whether ``sampler`` keeps the tile, always True without sampler."""
+        if self.sampler is None or self.sampler.accept(label_counts):
+            return True
+        self.stats.count("unsampled")
+        return False
+
+    def _encode_tiles(
+        self,
+        image: Image.Image,
+        mask_image: Optional[Image.Image] = None,
+        mask_options: Optional[dict] = None,
+        linked: Optional[Dict[str, Tuple[Image.Image, dict]]] = None,
+    ) -> Tuple[Dict[str, bytes], Optional[float]]:
+        """Encode the image tile and, if given, the matching mask tile and linked
+        tiles. Safe to call from several encoder threads.
+
+        Parameters
+        ----------
+        image : PIL.Image.Image
+            Image tile
+        mask_image : PIL.Image.Image, optional
+            Mask tile, see ``_read_mask_tile``
+        mask_options : dict, optional
+            Default encoder options of the mask tile
+        linked : Dict[str, Tuple[PIL.Image.Image, dict]], optional
+            Image and encoder options of the linked tile of each "image@..." and
+            "mask@..." stream, see ``_read_linked_tiles``
+
+        Returns
+        -------
+        Dict[str, bytes]
+            Encoded "image", "mask" and linked tiles, with ``image_codec`` and
+            ``mask_codec``.
+        float, optional
+            Ratio of labelled (non zero) pixels of the mask tile, None without mask.
+        """
+        with self.stats.time("encode"):
+            encoded_tiles = {"image": self.image_codec.encode(image)}
+            for stream, (linked_image, options) in (linked or {}).items():
+                codec = self.mask_codec if stream.startswith("mask") else self.image_codec
+                encoded_tiles[stream] = codec.encode(linked_image, options)
+        if mask_image is None:
+            return encoded_tiles, None
+
+        with self.stats.time("encode"):
+            encoded_tiles["mask"] = self.mask_codec.encode(mask_image, mask_options)
+        return encoded_tiles, _label_ratio(mask_image)
+
+    def _extract_serial(
+        self,
+        wsi_img: Slide,
+        wsi_label: Optional[Slide],
+        candidates: List[Tuple[int, CoordinatePair]],
+        encoders: int,
+        max_pending: int,
+        writer: TileWriter,
+        tiling_manifest: Optional[TilingManifest],
+        metadata: TileMetadata,
+    ) -> None:
+        """Extract and save the candidate tiles in this process.
+
+        Tiles are read and checked by the calling thread and handed to a pool of
+        ``encoders`` threads. Pending tiles are kept in a queue of at most
+        ``max_pending`` tiles, in grid order: once it is full, the oldest tile is
+        waited for and written before the next one is read. Reads thus overlap with
+        encodes while memory stays bounded, and tile numbering, metadata and manifest
+        are the same as without encoder threads.
+
+        Parameters
+        ----------
+        wsi_img : Slide
+            Image slide from which to extract the tiles
+        wsi_label : Slide, optional
+            Mask slide from which to extract the tiles
+        candidates : List[Tuple[int, CoordinatePair]]
+            Index in the grid and coordinates at level 0 of the candidate tiles
+        encoders : int
+            Number of encoder threads, 0 encodes in the calling thread.
+        max_pending : int
+            Maximum number of tiles read but not written yet.
+        writer : TileWriter
+            Destination of the encoded tiles.
+        tiling_manifest : TilingManifest, optional
+            Manifest recording the written tiles.
+        metadata : TileMetadata
+            Metadata of the saved tiles, updated in place.
+        """
+        tiles = self._indexed_tiles(wsi_img, candidates)
+        mask_reader = self._mask_reader(wsi_label, candidates)
+        linked_readers = self._linked_readers(wsi_img, wsi_label, candidates)
+        if encoders < 1:
+            for candidate, tile, tile_wsi_coords in tiles:
+                # Domi edit: wsi_img and wsi_label tile
+                mask_image, mask_options, label_counts = self._read_mask_tile(
+                    wsi_label, tile_wsi_coords, mask_reader
+                )
+                if not self._sample(label_counts):
+                    continue
+                encoded_tiles, label_ratio = self._encode_tiles(
+                    tile.image,
+                    mask_image,
+                    mask_options,
+                    self._read_linked_tiles(tile_wsi_coords, linked_readers),
+                )
+                self._write_tiles(
+                    writer,
+                    tiling_manifest,
+                    metadata,
+                    candidate,
+                    tile_wsi_coords,
+                    tile.tissue_ratio,
+                    label_ratio,
+                    encoded_tiles,
+                    label_counts,
+                    _artifact_scores(tile),
+                )
+            return
+
+        pending: deque = deque()
+
+        def write_oldest():
+            candidate, tile_wsi_coords, tissue_ratio, label_counts, artifact_scores, future = (
+                pending.popleft()
+            )
+            with self.stats.time("wait_encode"):
+                encoded_tiles, label_ratio = future.result()
+            self._write_tiles(
+                writer,
+                tiling_manifest,
+                metadata,
+                candidate,
+                tile_wsi_coords,
+                tissue_ratio,
+                label_ratio,
+                encoded_tiles,
+                label_counts,
+                artifact_scores,
+            )
+
+        with ThreadPoolExecutor(
+            max_workers=encoders, thread_name_prefix="tile-encoder"
+        ) as executor:
+            try:
+                for candidate, tile, tile_wsi_coords in tiles:
+                    mask_image, mask_options, label_counts = self._read_mask_tile(
+                        wsi_label, tile_wsi_coords, mask_reader
+                    )
+                    if not self._sample(label_counts):
+                        continue
+                    future: Future = executor.submit(
+                        self._encode_tiles,
+                        tile.image,
+                        mask_image,
+                        mask_options,
+                        self._read_linked_tiles(tile_wsi_coords, linked_readers),
+                    )
+                    pending.append(
+                        (
+                            candidate,
+                            tile_wsi_coords,
+                            tile.tissue_ratio,
+                            label_counts,
+                            _artifact_scores(tile),
+                            future,
+                        )
+                    )
+                    if len(pending) >= max(max_pending, 1):
+                        write_oldest()
+                while pending:
+                    write_oldest()
+            finally:
+                # Tiles not written because of an error are dropped
+                for *_, future in pending:
+                    future.cancel()
+
+    def _extract_parallel(
+        self,
+        wsi_img: Slide,
+        wsi_label: Optional[Slide],
+        candidates: List[Tuple[int, CoordinatePair]],
+        workers: int,
+        writer: TileWriter,
+        tiling_manifest: Optional[TilingManifest],
+        metadata: TileMetadata,
+    ) -> None:
+        """Extract and save the candidate tiles with a pool of worker processes.
+
+        The candidate coordinates are split into contiguous chunks. Workers read,
+        check and encode the tiles of their chunk; the encoded tiles are numbered and
+        written by this process following the grid order, so that filenames and
+        metadata are the same as in a serial extraction.
+
+        Parameters
+        ----------
+        wsi_img : Slide
+            Image slide from which to extract the tiles
+        wsi_label : Slide, optional
+            Mask slide from which to extract the tiles
+        candidates : List[Tuple[int, CoordinatePair]]
+            Index in the grid and coordinates at level 0 of the candidate tiles
+        workers : int
+            Number of worker processes.
+        writer : TileWriter
+            Destination of the encoded tiles.
+        tiling_manifest : TilingManifest, optional
+            Manifest recording the written tiles.
+        metadata : TileMetadata
+            Metadata of the saved tiles, updated in place.
+        """
+        n_chunks = workers * CHUNKS_PER_WORKER
+        if self._limits is not None:
+            n_chunks = max(n_chunks, -(-len(candidates) // self._limits.chunk_tiles))
+        n_chunks = min(len(candidates), n_chunks)
+        chunks = [
+            candidates[start:stop]
+            for start, stop in _chunk_bounds(len(candidates), n_chunks)
+        ]
+        extract_chunk = partial(
+            _extract_tiles_chunk,
+            self,
+            _slide_spec(wsi_img),
+            _slide_spec(wsi_label) if wsi_label is not None else None,
+        )
+
+        # Chunks are submitted as the previous ones are written, so that at most one
+        # encoded chunk per worker waits in this process when writing is slower
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Chunks are returned in submission order, i.e. in grid order
+            for chunk_tiles, chunk_stats in _ordered_map(
+                executor, extract_chunk, chunks, workers + 1
+            ):
+                self.stats.merge(chunk_stats)
+                for *tile_record, label_counts, artifact_scores in chunk_tiles:
+                    # Quotas are applied here, in grid order, so that the written
+                    # tiles are the ones of a serial extraction
+                    if self._sample(label_counts):
+                        self._write_tiles(
+                            writer, tiling_manifest, metadata, *tile_record, label_counts,
+                            artifact_scores,
+                        )
+
+    def _write_tiles(
+        self,
+        writer: TileWriter,
+        tiling_manifest: Optional[TilingManifest],
+        metadata: TileMetadata,
+        candidate: int,
+        tile_wsi_coords: CoordinatePair,
+        tissue_ratio: float,
+        label_ratio: Optional[float],
+        encoded_tiles: Dict[str, bytes],
+        label_counts: Optional[np.ndarray] = None,
+        artifact_scores: Optional[np.ndarray] = None,
+    ) -> None:
+        """Write the encoded tiles of the next tile and record it in the metadata and
+        in the manifest.
+
+        Parameters
+        ----------
+        writer : TileWriter
+            Destination of the encoded tiles.
+        tiling_manifest : TilingManifest, optional
+            Manifest recording the written tiles.
+        metadata : TileMetadata
+            Metadata of the saved tiles, updated in place. Its length is the tile
+            counter used in the tile filename.
+        candidate : int
+            Index of the tile in the grid of candidate coordinates
+        tile_wsi_coords : CoordinatePair
+            Coordinates at level 0 of the tile
+        tissue_ratio : float
+            Tissue ratio of the image tile
+        label_ratio : float, optional
+            Ratio of labelled pixels of the mask tile, None without mask
+        encoded_tiles : Dict[str, bytes]
+            Encoded tile of each stream
+        label_counts : np.ndarray, optional
+            Number of pixels of every class value of the mask tile, None without mask
+        artifact_scores : np.ndarray, optional
+            ``ARTIFACT_SCORES`` of the image tile, None without artifact detector
+        """
+        tiles_counter = len(metadata)
+        tile_filename = self._tile_filename(tile_wsi_coords, tiles_counter)
+        with self.stats.time("write"):
+            for stream, data in encoded_tiles.items():
+                writer.write(tile_filename, stream, data)
+            if tiling_manifest is not None:
+                tiling_manifest.record(
+                    candidate,
+                    tile_filename,
+                    tile_wsi_coords,
+                    tissue_ratio,
+                    {stream: len(data) for stream, data in encoded_tiles.items()},
+                    label_ratio,
+                    label_counts,
+                    (
+                        dict(zip(metadata.artifacts, artifact_scores))
+                        if artifact_scores is not None
+                        else None
+                    ),
+                )
+        self.stats.count("tiles")
+        self.stats.count("written_bytes", sum(map(len, encoded_tiles.values())))
+        if self._log_every and tiles_counter % self._log_every == 0:
+            logger.info("\t Tile %d saved: %s", tiles_counter, tile_filename)
+        # Domi edit: access metadata
+        metadata.append(
+            candidate,
+            tile_wsi_coords,
+            tissue_ratio,
+            label_ratio,
+            label_counts,
+            self._linked_coordinates(tile_wsi_coords),
+            artifact_scores,
+        )
+
+    def _manifest_params(
+        self,
+        wsi_img: Slide,
+        wsi_label: Optional[Slide],
+        extraction_mask: BinaryMask,
+    ) -> dict:
+        """Return the parameters the extracted tiles depend on, stored in the manifest."""
+        return {
+            "slide": [wsi_img._path, list(wsi_img.dimensions)],
+            "label": (
+                [wsi_label._path, list(wsi_label.dimensions)]
+                if wsi_label is not None
+                else None
+            ),
+            "tile_size": list(self.tile_size),
+            "final_tile_size": list(self.final_tile_size),
+            "level": self.level,
+            "mpp": self.mpp,
+            "pixel_overlap": self.pixel_overlap,
+            "check_tissue": self.check_tissue,
+            "tissue_percent": self.tissue_percent,
+            "prefix": self.prefix,
+            "suffix": self.suffix,
+            "mask_mode": self.mask_mode,
+            "mask_lut": sorted(
+                [list(colour), class_value]
+                for colour, class_value in (self.mask_lut or {}).items()
+            ),
+            "mask_compress_level": self.mask_compress_level,
+            "codecs": [repr(self.image_codec), repr(self.mask_codec)],
+            "prefilter": [self.prefilter, self.prefilter_margin],
+            "sampler": self.sampler.params() if self.sampler is not None else None,
+            "tissue_scorer": (
+                self.tissue_scorer.params() if self.tissue_scorer is not None else None
+            ),
+            "artifact_detector": (
+                self.artifact_detector.params()
+                if self.artifact_detector is not None
+                else None
+            ),
+            "extraction_mask": _binary_mask_params(extraction_mask),
+        }
+
+    def _prefilter_candidates(
+        self, slide: Slide, candidates: List[Tuple[int, CoordinatePair]]
+    ) -> List[Tuple[int, CoordinatePair]]:
+        """Drop the candidate tiles whose tissue estimated on the thumbnail is clearly
+        below ``tissue_percent``.
+
+        The tissue of the thumbnail is segmented once (grayscale + Otsu threshold, the
+        core of the tile tissue mask); the tissue fraction of every tile footprint is
+        then read from its integral image. Tiles estimated below
+        ``prefilter_margin * tissue_percent`` are rejected without reading them.
+
+        Parameters
+        ----------
+        slide : Slide
+            Slide from which the tiles are extracted
+        candidates : List[Tuple[int, CoordinatePair]]
+            Index in the grid and coordinates at level 0 of the candidate tiles
+
+        Returns
+        -------
+        List[Tuple[int, CoordinatePair]]
+            Candidates which still need the exact tissue check.
+        """
+        if not candidates:
+            return candidates
+        thumbnail_tissue = _thumbnail_tissue_mask(slide, self._slide_cache())
+        tiles_thumb_coords = _scale_coordinates_array(
+            np.array([coords for _, coords in candidates], dtype="int64"),
+            reference_size=slide.dimensions,
+            target_size=thumbnail_tissue.shape[::-1],
+        )
+        tissue_fraction = _integral_mask_fraction(
+            tiles_thumb_coords, _integral_image(thumbnail_tissue)
+        )
+        keep = tissue_fraction * 100 >= self.prefilter_margin * self.tissue_percent
+
+        self.prefilter_stats = {
+            "candidates": len(candidates),
+            "skipped_reads": int(np.count_nonzero(~keep)),
+        }
+        logger.info(
+            f"Tissue prefilter skipped {self.prefilter_stats['skipped_reads']} of "
+            f"{len(candidates)} full resolution tile reads"
+        )
+        return [candidate for candidate, kept in zip(candidates, keep) if kept]
+
     @staticmethod
     def _are_coordinates_within_extraction_mask(
         tile_thumb_coords: CoordinatePair,
@@ -193,6 +1153,37 @@ class AwesomeTiler(Tiler):
             > COORDS_WITHIN_EXTRACTION_MASK_THRESHOLD
         )
 
+    @staticmethod
+    def _are_coordinates_within_integral_mask(
+        tiles_thumb_coords: np.ndarray,
+        integral_mask_region: np.ndarray,
+    ) -> np.ndarray:
+        """Vectorized ``_are_coordinates_within_extraction_mask`` for many tiles.
+
+        The tissue area inside every tile rectangle is read in O(1) from the integral
+        image (summed-area table) of the region mask. Rectangles include their border
+        pixels and are clipped to the mask, as the ones drawn by ``rectangle_to_mask``.
+
+        Parameters
+        ----------
+        tiles_thumb_coords : np.ndarray
+            (n_tiles, 4) array of tile coordinates (x_ul, y_ul, x_br, y_br) at
+            thumbnail dimension.
+        integral_mask_region : np.ndarray
+            Integral image of the binary mask of the tissue region considered, as
+            returned by ``_integral_image``.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array, True for the tiles with more than 80% of their area inside
+            the tissue region.
+        """
+        return (
+            _integral_mask_fraction(tiles_thumb_coords, integral_mask_region)
+            > COORDS_WITHIN_EXTRACTION_MASK_THRESHOLD
+        )
+
     def _grid_coordinates_from_bbox_coordinates(
         self,
         bbox_coordinates_lvl: CoordinatePair,
@@ -226,37 +1217,39 @@ class AwesomeTiler(Tiler):
         n_tiles_row = self._n_tiles_row(bbox_coordinates_lvl)
         n_tiles_column = self._n_tiles_column(bbox_coordinates_lvl)
 
-        for i in range(n_tiles_row):
-            for j in range(n_tiles_column):
-                x_ul_lvl = (
-                    bbox_coordinates_lvl.x_ul + tile_w_lvl * i - self.pixel_overlap * i
-                )
-                y_ul_lvl = (
-                    bbox_coordinates_lvl.y_ul + tile_h_lvl * j - self.pixel_overlap * j
-                )
-
-                x_ul_lvl = np.clip(x_ul_lvl, bbox_coordinates_lvl.x_ul, None)
-                y_ul_lvl = np.clip(y_ul_lvl, bbox_coordinates_lvl.y_ul, None)
-
-                x_br_lvl = x_ul_lvl + tile_w_lvl
-                y_br_lvl = y_ul_lvl + tile_h_lvl
-
-                tile_lvl_coords = CoordinatePair(x_ul_lvl, y_ul_lvl, x_br_lvl, y_br_lvl)
-                tile_thumb_coords = scale_coordinates(
-                    reference_coords=tile_lvl_coords,
-                    reference_size=slide.level_dimensions(level=self.level),
-                    target_size=binary_mask_region.shape[::-1],
-                )
+        # Whole i/j grid at once, in the same (row-major over i) order as a nested loop
+        i, j = np.meshgrid(
+            np.arange(n_tiles_row), np.arange(n_tiles_column), indexing="ij"
+        )
+        i = i.ravel()
+        j = j.ravel()
+        x_ul_lvl = np.maximum(
+            bbox_coordinates_lvl.x_ul + tile_w_lvl * i - self.pixel_overlap * i,
+            bbox_coordinates_lvl.x_ul,
+        )
+        y_ul_lvl = np.maximum(
+            bbox_coordinates_lvl.y_ul + tile_h_lvl * j - self.pixel_overlap * j,
+            bbox_coordinates_lvl.y_ul,
+        )
+        tiles_lvl_coords = np.stack(
+            [x_ul_lvl, y_ul_lvl, x_ul_lvl + tile_w_lvl, y_ul_lvl + tile_h_lvl], axis=1
+        ).astype("int64")
 
-                if self._are_coordinates_within_extraction_mask(
-                    tile_thumb_coords, binary_mask_region
-                ):
-                    tile_wsi_coords = scale_coordinates(
-                        reference_coords=tile_lvl_coords,
-                        reference_size=slide.level_dimensions(level=self.level),
-                        target_size=slide.level_dimensions(level=0),
-                    )
-                    yield tile_wsi_coords
+        tiles_thumb_coords = _scale_coordinates_array(
+            tiles_lvl_coords,
+            reference_size=slide.level_dimensions(level=self.level),
+            target_size=binary_mask_region.shape[::-1],
+        )
+        within_mask = self._are_coordinates_within_integral_mask(
+            tiles_thumb_coords, _integral_image(binary_mask_region)
+        )
+        tiles_wsi_coords = _scale_coordinates_array(
+            tiles_lvl_coords[within_mask],
+            reference_size=slide.level_dimensions(level=self.level),
+            target_size=slide.level_dimensions(level=0),
+        )
+        for tile_wsi_coords in tiles_wsi_coords:
+            yield CoordinatePair(*tile_wsi_coords)
 
     def _grid_coordinates_generator(
         self, slide: Slide, extraction_mask: BinaryMask = BiggestTissueBoxMask()
@@ -277,23 +1270,37 @@ class AwesomeTiler(Tiler):
         Iterator[CoordinatePair]
             Iterator of tiles' CoordinatePair
         """
-        binary_mask = extraction_mask(slide)
-
-        regions = regions_from_binary_mask(binary_mask)
-        for region in regions:
-            bbox_coordinates_thumb = region_coordinates(region)  # coords of the bbox
+        # Tissue regions labelled from 1, in the order of regions_from_binary_mask
+        regions = self._labelled_regions(slide, extraction_mask)
+        for label, (rows, columns) in enumerate(ndimage.find_objects(regions), start=1):
+            bbox_coordinates_thumb = CoordinatePair(
+                columns.start, rows.start, columns.stop, rows.stop
+            )
             bbox_coordinates_lvl = scale_coordinates(
                 bbox_coordinates_thumb,
-                binary_mask.shape[::-1],
+                regions.shape[::-1],
                 slide.level_dimensions(self.level),
             )
 
-            binary_mask_region = regions_to_binary_mask([region], binary_mask.shape)
+            binary_mask_region = regions == label
 
             yield from self._grid_coordinates_from_bbox_coordinates(
                 bbox_coordinates_lvl, slide, binary_mask_region
             )
 
+    def _labelled_regions(self, slide: Slide, extraction_mask: BinaryMask) -> np.ndarray:
+        """Return the connected regions of ``extraction_mask(slide)`` labelled from 1,
+        from the slide cache if enabled."""
+        cache = self._slide_cache()
+        if cache is None:
+            return label_regions(extraction_mask(slide))
+        return cache.labelled_regions(slide, extraction_mask)
+
+    def _slide_cache(self) -> Optional[SlideCache]:
+        if self.cache is True:
+            return SlideCache.default()
+        return self.cache or None
+
     def _n_tiles_column(self, bbox_coordinates: CoordinatePair) -> int:
         """Return the number of tiles which can be extracted in a column.
 
@@ -351,26 +1358,597 @@ class AwesomeTiler(Tiler):
         grid_coordinates_generator = self._grid_coordinates_generator(
             slide, extraction_mask
         )
-        for coords in grid_coordinates_generator:
+        yield from self._tiles_from_coordinates(slide, grid_coordinates_generator)
+
+    def _tiles_from_coordinates(
+        self, slide: Slide, coordinates: Iterable[CoordinatePair]
+    ) -> Tuple[Tile, CoordinatePair]:
+        """Read the tiles at ``coordinates`` and keep those with enough tissue.
+
+        Parameters
+        ----------
+        slide : Slide
+            Slide from which to extract the tiles
+        coordinates : Iterable[CoordinatePair]
+            Coordinates at level 0 of the candidate tiles
+
+        Yields
+        -------
+        Tile
+            Extracted tile
+        CoordinatePair
+            Coordinates of the slide at level 0 from which the tile has been extracted
+        """
+        for _, tile, coords in self._indexed_tiles(slide, enumerate(coordinates)):
+            yield tile, coords
+
+    def _indexed_tiles(
+        self, slide: Slide, candidates: Iterable[Tuple[int, CoordinatePair]]
+    ) -> Tuple[int, Tile, CoordinatePair]:
+        """Read the candidate tiles and keep those with enough tissue.
+
+        Parameters
+        ----------
+        slide : Slide
+            Slide from which to extract the tiles
+        candidates : Iterable[Tuple[int, CoordinatePair]]
+            Index in the grid and coordinates at level 0 of the candidate tiles
+
+        Yields
+        -------
+        int
+            Index of the tile in the grid
+        Tile
+            Extracted tile
+        CoordinatePair
+            Coordinates of the slide at level 0 from which the tile has been extracted
+        """
+        stats = self.stats
+        candidates = list(candidates)
+        reader = self._superblock_reader(slide, candidates)
+        if (
+            self.check_tissue and self.tissue_scorer is not None
+        ) or self.artifact_detector is not None:
+            yield from self._scored_tiles(slide, candidates, reader)
+            return
+        for candidate, coords in candidates:
             try:
-                tile = slide.extract_tile(
-                    coords,
-                    tile_size=self.final_tile_size,
-                    mpp=self.mpp,
-                    level=self.level if self.mpp is None else None,
-                )
+                with stats.time("read"):
+                    tile = self._read_tile(slide, coords, reader)
             except TileSizeOrCoordinatesError:
+                stats.count("invalid")
+                continue
+            stats.count("read_bytes", image_nbytes(tile.image))
+
+            if self.check_tissue:
+                with stats.time("tissue_check"):
+                    enough_tissue = tile.has_enough_tissue(self.tissue_percent)
+                if not enough_tissue:
+                    stats.count("rejected")
+                    release_tile_caches()
+                    continue
+            yield candidate, tile, coords
+            # The tile is released once the caller is done with it
+            release_tile_caches()
+
+    def _scored_tiles(
+        self,
+        slide: Slide,
+        candidates: List[Tuple[int, CoordinatePair]],
+        reader: Optional[SuperblockReader],
+    ) -> Tuple[int, Tile, CoordinatePair]:
+        """Read the candidate tiles by blocks and keep those with enough tissue, as
+        ``_indexed_tiles``. The tissue of every block is checked by the
+        ``tissue_scorer`` if set, tile by tile otherwise, then the
+        ``artifact_detector`` scores the remaining tiles and drops those with
+        artifacts."""
+        stats = self.stats
+        batch_size = min(
+            scorer.batch_size
+            for scorer in (self.tissue_scorer, self.artifact_detector)
+            if scorer is not None
+        )
+        if self._limits is not None:
+            batch_size = min(batch_size, self._limits.max_pending)
+        for start in range(0, len(candidates), batch_size):
+            block = []
+            for candidate, coords in candidates[start:start + batch_size]:
+                try:
+                    with stats.time("read"):
+                        tile = self._read_tile(slide, coords, reader)
+                except TileSizeOrCoordinatesError:
+                    stats.count("invalid")
+                    continue
+                stats.count("read_bytes", image_nbytes(tile.image))
+                block.append((candidate, tile, coords))
+            if not block:
                 continue
+            images = np.stack([np.asarray(tile.image) for _, tile, _ in block])
+            enough, ratios = self._block_tissue(block, images)
+            release_tile_caches()
+            stats.count("rejected", int(np.count_nonzero(~enough)))
+
+            artifact_scores = np.full((len(block), len(ARTIFACT_SCORES)), np.nan)
+            if self.artifact_detector is not None and enough.any():
+                with stats.time("artifact_check"):
+                    artifact_scores[enough] = self.artifact_detector.score(images[enough])
+                    rejections = self.artifact_detector.rejections(artifact_scores[enough])
+                for name, n_rejected in zip(ARTIFACT_SCORES, rejections.sum(axis=0)):
+                    stats.count(f"artifact_{name}", n_rejected)
+                stats.count("artifacts", int(np.count_nonzero(rejections.any(axis=1))))
+                enough[np.flatnonzero(enough)[rejections.any(axis=1)]] = False
+            del images
+
+            for (candidate, tile, coords), enough_tissue, ratio, scores in zip(
+                block, enough, ratios, artifact_scores
+            ):
+                if enough_tissue:
+                    yield candidate, _ScoredTile(
+                        tile.image,
+                        coords,
+                        self.level,
+                        float(ratio),
+                        scores if self.artifact_detector is not None else None,
+                    ), coords
+                    release_tile_caches()
 
-            if not self.check_tissue or tile.has_enough_tissue(self.tissue_percent):
-                yield tile, coords
+    def _block_tissue(
+        self, block: List[Tuple[int, Tile, CoordinatePair]], images: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return whether every tile of a block has enough tissue (all True without
+        tissue check) and its tissue ratio."""
+        if self.check_tissue and self.tissue_scorer is not None:
+            with self.stats.time("tissue_check"):
+                return self.tissue_scorer.score(images, self.tissue_percent)
+        enough = np.ones(len(block), dtype=bool)
+        ratios = np.zeros(len(block))
+        for position, (_, tile, _) in enumerate(block):
+            if self.check_tissue:
+                with self.stats.time("tissue_check"):
+                    enough[position] = tile.has_enough_tissue(self.tissue_percent)
+            if enough[position]:
+                ratios[position] = tile.tissue_ratio
+        return enough, ratios
+
+    def _fit_tissue_scorer(self, slide: Slide) -> None:
+        """Fit the threshold of the ``tissue_scorer`` to the thumbnail of ``slide``."""
+        cache = self._slide_cache()
+        thumbnail = cache.thumbnail(slide) if cache is not None else slide.thumbnail
+        self.tissue_scorer.fit(thumbnail)
+
+    def _read_tile(
+        self,
+        slide: Slide,
+        coords: CoordinatePair,
+        reader: Optional[SuperblockReader] = None,
+    ) -> Tile:
+        """Read the tile at ``coords``, sliced from its superblock if ``reader`` is
+        given, as ``Slide.extract_tile`` otherwise.
+
+        Raises
+        ------
+        TileSizeOrCoordinatesError
+            If the tile is not inside the slide
+        """
+        if reader is None:
+            self.stats.count("slide_reads")
+            return slide.extract_tile(
+                coords,
+                tile_size=self.final_tile_size,
+                mpp=self.mpp,
+                level=self.level if self.mpp is None else None,
+            )
+        self._check_coords(slide, coords)
+        n_reads = reader.n_reads
+        image = reader.read_image(coords)
+        self.stats.count("slide_reads", reader.n_reads - n_reads)
+        return Tile(image, coords, self.level)
+
+    def _superblock_reader(
+        self,
+        slide: Slide,
+        candidates: List[Tuple[int, CoordinatePair]],
+        transform: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    ) -> Optional[SuperblockReader]:
+        """Return the superblock reader of the candidate tiles of ``slide``, or None
+        if tiles are read one by one (``mpp`` set or ``superblock_bytes`` of 0)."""
+        if self.mpp is not None or self._superblock_bytes() <= 0:
+            return None
+        level = self.level if self.level >= 0 else slide._remap_level(self.level)
+        return SuperblockReader(
+            slide,
+            level,
+            self.final_tile_size,
+            [coords for _, coords in candidates],
+            self._superblock_bytes(),
+            transform,
+        )
+
+    def _mask_reader(
+        self,
+        wsi_label: Optional[Slide],
+        candidates: List[Tuple[int, CoordinatePair]],
+    ) -> Optional[SuperblockReader]:
+        """Return the superblock reader of the mask tiles matching the candidate
+        tiles. In "label" and "palette" modes, colours are mapped to classes once per
+        superblock."""
+        if wsi_label is None:
+            return None
+        transform = None if self.mask_mode == "rgb" else self._mask_classes
+        return self._superblock_reader(wsi_label, candidates, transform)
+
+    @staticmethod
+    def _check_coords(slide: Slide, coords: CoordinatePair) -> None:
+        if not slide._has_valid_coords(coords):
+            raise TileSizeOrCoordinatesError(
+                f"Extraction Coordinates {coords} not valid for slide with "
+                f"dimensions {slide.dimensions}"
+            )
 
     # Domi Function - hacking with no docs
-    def _tile_mask_extract(self, slide: Slide, coords):
-        tile = slide.extract_tile(
-            coords,
-            tile_size=self.final_tile_size,
-            mpp=self.mpp,
-            level=self.level if self.mpp is None else None,
+    def _tile_mask_extract(
+        self, slide: Slide, coords, reader: Optional[SuperblockReader] = None
+    ):
+        return self._read_tile(slide, coords, reader)
+
+    def _tile_mask_labels(
+        self,
+        slide: Slide,
+        coords: CoordinatePair,
+        reader: Optional[SuperblockReader] = None,
+    ) -> np.ndarray:
+        """Return the mask tile at ``coords`` as a (height, width) uint8 class array.
+
+        At a given level the region is read directly from the slide handle and
+        converted to an array, skipping the ``Tile`` object and any RGB image copy.
+
+        Parameters
+        ----------
+        slide : Slide
+            Mask slide from which to extract the tile
+        coords : CoordinatePair
+            Coordinates at level 0 of the tile
+        reader : SuperblockReader, optional
+            Superblock reader of ``slide`` built by ``_mask_reader``, which maps the
+            colours to classes. Default is None, the tile is read on its own.
+
+        Returns
+        -------
+        np.ndarray
+            Class value of every pixel of the tile, mapped through ``mask_lut``.
+        """
+        if reader is not None:
+            self._check_coords(slide, coords)
+            return reader.read_array(coords)
+        if self.mpp is None:
+            self._check_coords(slide, coords)
+            level = self.level if self.level >= 0 else slide._remap_level(self.level)
+            region = slide._wsi.read_region(
+                (coords.x_ul, coords.y_ul), level, self.final_tile_size
+            )
+        else:
+            region = self._tile_mask_extract(slide, coords).image
+        return self._mask_classes(np.asarray(region))
+
+    def _mask_classes(self, mask: np.ndarray) -> np.ndarray:
+        """Map a mask region array to its (height, width) uint8 class array."""
+        if mask.ndim == 2:
+            mask = mask[..., np.newaxis]
+        if self.mask_lut is None:
+            return np.ascontiguousarray(mask[..., 0], dtype=np.uint8)
+        return _colours_to_classes(mask[..., :3], self.mask_lut)
+
+    def _mask_tile_image(
+        self,
+        slide: Slide,
+        coords: CoordinatePair,
+        reader: Optional[SuperblockReader] = None,
+    ) -> Tuple[Image.Image, dict]:
+        """Extract the mask tile at ``coords`` as an image following ``mask_mode``.
+
+        Parameters
+        ----------
+        slide : Slide
+            Mask slide from which to extract the tile
+        coords : CoordinatePair
+            Coordinates at level 0 of the tile
+        reader : SuperblockReader, optional
+            Superblock reader of ``slide`` built by ``_mask_reader``. Default is None.
+
+        Returns
+        -------
+        PIL.Image.Image
+            Mask tile image
+        dict
+            Options to pass to ``PIL.Image.Image.save`` when encoding the mask tile
+        """
+        if self.mask_mode == "rgb":
+            return self._tile_mask_extract(slide, coords, reader).image, {}
+        return self._mask_image_from_classes(self._tile_mask_labels(slide, coords, reader))
+
+    def _mask_image_from_classes(self, classes: np.ndarray) -> Tuple[Image.Image, dict]:
+        """Return the "label" or "palette" mask tile image of a class array and its
+        encoder options."""
+        mask_image = Image.fromarray(classes)
+        if self.mask_mode == "palette":
+            # Turns the "L" image into a "P" image keeping the class values as indices
+            mask_image.putpalette(_mask_palette(self.mask_lut))
+        save_options = (
+            {"compress_level": self.mask_compress_level}
+            if self.mask_codec.codec == "png"
+            else {}
+        )
+        return mask_image, save_options
+
+
+# ---------------------------------------------------- #
+#                  Coordinate helpers                  #
+# ---------------------------------------------------- #
+def _integral_image(binary_mask: np.ndarray) -> np.ndarray:
+    """Return the summed-area table of ``binary_mask``, padded with a leading zero row
+    and column, so that ``integral[y, x]`` is the number of True pixels in
+    ``binary_mask[:y, :x]``.
+    """
+    integral = np.zeros(
+        (binary_mask.shape[0] + 1, binary_mask.shape[1] + 1), dtype="int64"
+    )
+    np.cumsum(binary_mask, axis=0, dtype="int64", out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    return integral
+
+
+def _integral_mask_fraction(
+    tiles_thumb_coords: np.ndarray, integral_mask: np.ndarray
+) -> np.ndarray:
+    """Return the fraction of True mask pixels inside every tile rectangle.
+
+    The area is read in O(1) per tile from the integral image of the mask. Rectangles
+    include their border pixels and are clipped to the mask, as the ones drawn by
+    ``rectangle_to_mask``; tiles outside of the mask have a fraction of 0.
+    """
+    height = integral_mask.shape[0] - 1
+    width = integral_mask.shape[1] - 1
+    x_ul = np.clip(tiles_thumb_coords[:, 0], 0, width)
+    y_ul = np.clip(tiles_thumb_coords[:, 1], 0, height)
+    x_br = np.clip(tiles_thumb_coords[:, 2] + 1, 0, width)
+    y_br = np.clip(tiles_thumb_coords[:, 3] + 1, 0, height)
+
+    tile_area = np.maximum(x_br - x_ul, 0) * np.maximum(y_br - y_ul, 0)
+    x_br = np.maximum(x_br, x_ul)
+    y_br = np.maximum(y_br, y_ul)
+    tile_in_mask_area = (
+        integral_mask[y_br, x_br]
+        - integral_mask[y_ul, x_br]
+        - integral_mask[y_br, x_ul]
+        + integral_mask[y_ul, x_ul]
+    )
+
+    fraction = np.zeros(len(tiles_thumb_coords), dtype="float64")
+    nonempty = tile_area > 0
+    fraction[nonempty] = tile_in_mask_area[nonempty] / tile_area[nonempty]
+    return fraction
+
+
+def _thumbnail_tissue_mask(slide: Slide, cache: Optional[SlideCache] = None) -> np.ndarray:
+    """Return the tissue of the slide thumbnail, segmented with the grayscale and Otsu
+    threshold filters used for the tissue mask of the tiles."""
+    if cache is not None:
+        return cache.from_thumbnail(
+            "thumbnail_tissue", slide, {}, _thumbnail_tissue_mask
+        ).astype(bool)
+    thumbnail_gray = imf.RgbToGrayscale()(slide.thumbnail)
+    return np.asarray(imf.OtsuThreshold()(thumbnail_gray), dtype=bool)
+
+
+def _scale_coordinates_array(
+    reference_coords: np.ndarray,
+    reference_size: Tuple[int, int],
+    target_size: Tuple[int, int],
+) -> np.ndarray:
+    """Vectorized ``histolab.util.scale_coordinates`` for a (n, 4) coordinates array."""
+    reference_size = np.tile(reference_size, 2)
+    target_size = np.tile(target_size, 2)
+    return np.floor((reference_coords * target_size) / reference_size).astype("int64")
+
+
+# ---------------------------------------------------- #
+#                    Mask helpers                      #
+# ---------------------------------------------------- #
+def _colours_to_classes(
+    rgb: np.ndarray, mask_lut: Dict[Tuple[int, int, int], int]
+) -> np.ndarray:
+    """Map every RGB colour of ``rgb`` to its class in ``mask_lut``, 0 if missing."""
+    packed = (
+        rgb[..., 0].astype(np.uint32) << 16
+        | rgb[..., 1].astype(np.uint32) << 8
+        | rgb[..., 2].astype(np.uint32)
+    )
+    lut_keys = np.array([r << 16 | g << 8 | b for r, g, b in mask_lut], dtype=np.uint32)
+    lut_values = np.array(list(mask_lut.values()), dtype=np.uint8)
+    order = np.argsort(lut_keys)
+    lut_keys = lut_keys[order]
+    lut_values = lut_values[order]
+
+    index = np.clip(np.searchsorted(lut_keys, packed), 0, len(lut_keys) - 1)
+    return np.where(lut_keys[index] == packed, lut_values[index], 0).astype(np.uint8)
+
+
+def _mask_palette(mask_lut: Optional[Dict[Tuple[int, int, int], int]]) -> List[int]:
+    """Return a 256 colour PIL palette showing each class with its ``mask_lut`` colour
+    and the remaining values as grey levels."""
+    palette = [value for grey in range(256) for value in (grey, grey, grey)]
+    for colour, class_value in (mask_lut or {}).items():
+        palette[3 * class_value:3 * class_value + 3] = colour
+    return palette
+
+
+def _label_ratio(mask_image: Image.Image) -> float:
+    """Return the ratio of labelled (non zero, alpha ignored) pixels of a mask tile."""
+    mask = np.asarray(mask_image)
+    if mask.ndim == 3:
+        mask = mask[..., :3].any(axis=-1)
+    return np.count_nonzero(mask) / mask.size
+
+
+def _binary_mask_params(extraction_mask: BinaryMask) -> dict:
+    """Describe ``extraction_mask`` and its custom filters for the manifest."""
+    filters = getattr(extraction_mask, "custom_filters", ())
+    return {
+        "class": type(extraction_mask).__name__,
+        "filters": [
+            {"class": type(mask_filter).__name__, **vars(mask_filter)}
+            for mask_filter in filters
+        ],
+    }
+
+
+class _ScoredTile(Tile):
+    """Tile with the tissue ratio computed by the block tissue check and, with an
+    artifact detector, its ``ARTIFACT_SCORES``."""
+
+    def __init__(
+        self,
+        image: Image.Image,
+        coords: CoordinatePair,
+        level: int,
+        tissue_ratio: float,
+        artifact_scores: Optional[np.ndarray] = None,
+    ):
+        super().__init__(image, coords, level)
+        self._tissue_ratio = tissue_ratio
+        self.artifact_scores = artifact_scores
+
+    @property
+    def tissue_ratio(self) -> float:
+        return self._tissue_ratio
+
+
+def _artifact_scores(tile: Tile) -> Optional[np.ndarray]:
+    """Return the artifact scores of a tile of ``_indexed_tiles``, None if the tiles
+    are not scored."""
+    return getattr(tile, "artifact_scores", None)
+
+
+# ---------------------------------------------------- #
+#               Parallel extraction workers            #
+# ---------------------------------------------------- #
+def _slide_spec(slide: Slide) -> Tuple[str, str, bool]:
+    """Return the arguments needed to reopen ``slide`` in another process."""
+    return slide._path, slide.processed_path, slide._use_largeimage
+
+
+def _chunk_bounds(n_items: int, n_chunks: int) -> List[Tuple[int, int]]:
+    """Split ``range(n_items)`` into ``n_chunks`` contiguous (start, stop) bounds."""
+    chunk_size, remainder = divmod(n_items, n_chunks) if n_chunks else (0, 0)
+    bounds = []
+    start = 0
+    for chunk_index in range(n_chunks):
+        stop = start + chunk_size + (1 if chunk_index < remainder else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def _ordered_map(
+    executor: ProcessPoolExecutor,
+    function: Callable,
+    items: list,
+    max_submitted: int,
+) -> Iterable:
+    """Yield the results of ``function`` on ``items`` in order, as
+    ``executor.map``, with at most ``max_submitted`` items submitted and not returned
+    yet."""
+    futures: deque = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            futures.append(executor.submit(function, item))
+            if len(futures) >= max_submitted:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _extract_tiles_chunk(
+    tiler: AwesomeTiler,
+    img_spec: Tuple[str, str, bool],
+    label_spec: Optional[Tuple[str, str, bool]],
+    candidates: List[Tuple[int, CoordinatePair]],
+) -> Tuple[
+    List[
+        Tuple[
+            int,
+            CoordinatePair,
+            float,
+            Optional[float],
+            Dict[str, bytes],
+            Optional[np.ndarray],
+            Optional[np.ndarray],
+        ]
+    ],
+    TilingStats,
+]:
+    """Read, check and encode the image and mask tiles of one chunk of candidates.
+
+    Runs in a worker process, which opens its own handles on both slides. The encoded
+    tiles are returned to the parent process, which writes them once the final tile
+    numbering is known, together with the stage statistics of the chunk. Tiles the
+    ``sampler`` of the tiler drops whatever the other tiles are not encoded; quotas
+    are applied by the parent process.
+
+    Parameters
+    ----------
+    tiler : AwesomeTiler
+        Tiler configured by ``AwesomeTiler.extract``
+    img_spec : Tuple[str, str, bool]
+        Path, processed path and ``use_largeimage`` flag of the image slide
+    label_spec : Tuple[str, str, bool], optional
+        Path, processed path and ``use_largeimage`` flag of the mask slide
+    candidates : List[Tuple[int, CoordinatePair]]
+        Index in the grid and coordinates at level 0 of the candidate tiles
+
+    Returns
+    -------
+    List[Tuple[int, CoordinatePair, float, Optional[float], Dict[str, bytes], Optional[np.ndarray], ...]]
+        Grid index, coordinates, tissue ratio, label ratio, encoded tiles, label
+        counts and artifact scores of each accepted tile, in grid order.
+    TilingStats
+        Stage timers and counters of the chunk
+    """
+    wsi_img = Slide(*img_spec)
+    wsi_label = Slide(*label_spec) if label_spec is not None else None
+    tiler.stats = TilingStats()
+    if tiler._limits is not None:
+        limit_slide_cache([wsi_img, wsi_label], tiler._limits.slide_cache_bytes)
+
+    chunk_tiles = []
+    mask_reader = tiler._mask_reader(wsi_label, candidates)
+    linked_readers = tiler._linked_readers(wsi_img, wsi_label, candidates)
+    for candidate, tile, tile_wsi_coords in tiler._indexed_tiles(wsi_img, candidates):
+        mask_image, mask_options, label_counts = tiler._read_mask_tile(
+            wsi_label, tile_wsi_coords, mask_reader
+        )
+        if tiler.sampler is not None and tiler.sampler.rejects(label_counts):
+            tiler.stats.count("unsampled")
+            continue
+        encoded_tiles, label_ratio = tiler._encode_tiles(
+            tile.image,
+            mask_image,
+            mask_options,
+            tiler._read_linked_tiles(tile_wsi_coords, linked_readers),
+        )
+        chunk_tiles.append(
+            (
+                candidate,
+                tile_wsi_coords,
+                tile.tissue_ratio,
+                label_ratio,
+                encoded_tiles,
+                label_counts,
+                _artifact_scores(tile),
+            )
         )
-        return tile
+    return chunk_tiles, tiler.stats
@@ -0,0 +1,107 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import json
+import os
+from typing import List, Tuple
+
+# Third Party
+import numpy as np
+
+# patho_pix
+from patho_pix.utils.manifest import params_hash
+
+GRID_VERSION = 1
+
+
+# ---------------------------------------------------- #
+#              Persisted Grid of Candidates            #
+# ---------------------------------------------------- #
+class TileGrid:
+    """Candidate tiles of a slide, computed once by ``AwesomeTiler.grid`` and split
+    into shards extracted on separate nodes.
+
+    The grid holds the candidates accepted by the extraction mask (and by the
+    thumbnail prefilter if enabled) with their index in the grid of candidate
+    coordinates, in grid order, and the parameters they depend on. Shard ``i`` of
+    ``n`` is the ``i``-th of ``n`` contiguous, equally sized ranges of the grid:
+    neighbouring tiles, which share superblock reads, stay in the same shard, and
+    every node computes the same split from the same file.
+
+    Arguments
+    ---------
+    candidates : np.ndarray
+        (n,) index of every candidate in the grid of candidate coordinates.
+    coords : np.ndarray
+        (n, 4) level 0 coordinates (x_ul, y_ul, x_br, y_br) of every candidate.
+    params : dict
+        JSON serializable parameters the candidates depend on (slide, tile size,
+        level, overlap, tissue settings, extraction mask). A grid is only used by a
+        tiler with the same parameters.
+    """
+
+    def __init__(self, candidates: np.ndarray, coords: np.ndarray, params: dict):
+        self.candidates = np.asarray(candidates, dtype=np.int64).reshape(-1)
+        self.coords = np.asarray(coords, dtype=np.int64).reshape(-1, 4)
+        if len(self.candidates) != len(self.coords):
+            raise ValueError(
+                f"{len(self.candidates)} candidates for {len(self.coords)} coordinates"
+            )
+        self.params = params
+        self.params_hash = params_hash(params)
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def __repr__(self) -> str:
+        return f"TileGrid({len(self)} candidates, params_hash={self.params_hash[:12]})"
+
+    def shard_bounds(self, shard_index: int, num_shards: int) -> Tuple[int, int]:
+        """Return the (start, stop) rows of the grid of shard ``shard_index``."""
+        if num_shards < 1:
+            raise ValueError(f"num_shards must be greater than 0 ({num_shards})")
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"shard_index must be in [0, {num_shards}) ({shard_index})")
+        return (
+            len(self) * shard_index // num_shards,
+            len(self) * (shard_index + 1) // num_shards,
+        )
+
+    def shard(self, shard_index: int, num_shards: int) -> List[Tuple[int, Tuple[int, int, int, int]]]:
+        """Return the index in the grid and the level 0 coordinates of the candidates
+        of shard ``shard_index`` out of ``num_shards``, in grid order."""
+        start, stop = self.shard_bounds(shard_index, num_shards)
+        return [
+            (int(candidate), tuple(int(c) for c in coords))
+            for candidate, coords in zip(self.candidates[start:stop], self.coords[start:stop])
+        ]
+
+    def save(self, path: str) -> None:
+        """Write the grid as a NumPy ``.npz`` file, atomically."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # np.savez adds the .npz extension to names without it
+        path_tmp = path + ".tmp.npz"
+        np.savez(
+            path_tmp,
+            candidates=self.candidates,
+            coords=self.coords,
+            header=np.array(json.dumps(
+                {"version": GRID_VERSION, "params": self.params}, default=str
+            )),
+        )
+        os.replace(path_tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TileGrid":
+        """Read a grid written by ``save``."""
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            if header.get("version") != GRID_VERSION:
+                raise ValueError(f"Unsupported grid version in {path}: {header.get('version')}")
+            return cls(data["candidates"], data["coords"], header["params"])
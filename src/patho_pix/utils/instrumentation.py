@@ -0,0 +1,119 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+# Third Party
+from PIL import Image
+
+
+# ---------------------------------------------------- #
+#                Tiling Stage Statistics               #
+# ---------------------------------------------------- #
+class TilingStats:
+    """Cumulative timers and counters of the stages of a tile extraction.
+
+    Stages (e.g. "read", "tissue_check", "encode", "write") accumulate their wall time
+    and number of calls; counters (e.g. "candidates", "rejected", "read_bytes",
+    "written_bytes") accumulate integers. Encoder threads can update the same instance
+    concurrently. Worker processes fill their own instance, which is merged into the
+    one of the parent process.
+
+    Arguments
+    ---------
+    hook : Callable[[str, float], None], optional
+        Profiling callback called with the stage name and its duration in seconds
+        after every timed stage of this process, and once per stage with the total
+        duration of every merged worker chunk. The hook is not sent to worker
+        processes. Default is None.
+    """
+
+    def __init__(self, hook: Optional[Callable[[str, float], None]] = None):
+        self.hook = hook
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["hook"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block as one call of ``stage``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1) -> None:
+        """Add ``calls`` calls of ``stage`` lasting ``seconds`` in total."""
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+        if self.hook is not None:
+            self.hook(stage, seconds)
+
+    def count(self, counter: str, value: int = 1) -> None:
+        """Add ``value`` to ``counter``."""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + int(value)
+
+    def merge(self, other: "TilingStats") -> None:
+        """Add the timers and counters of ``other``, e.g. of a worker process."""
+        for stage, seconds in other.seconds.items():
+            self.add_time(stage, seconds, other.calls[stage])
+        for counter, value in other.counters.items():
+            self.count(counter, value)
+
+    def summary(self) -> dict:
+        """Return the timers and counters as a JSON serializable dictionary.
+
+        Returns
+        -------
+        dict
+            ``{"stages": {stage: {"seconds", "calls"}}, "counters": {counter: value}}``.
+            Stage times of worker processes and encoder threads add up, so that their
+            sum can exceed the wall time. Once the "total" stage (wall time of the
+            extraction) is timed, ``"throughput"`` holds ``tiles_per_s``,
+            ``written_mb_per_s`` (MiB written per second of extraction) and
+            ``write_mb_per_s`` (MiB written per second spent in the writer).
+        """
+        summary = {
+            "stages": {
+                stage: {"seconds": round(seconds, 6), "calls": self.calls[stage]}
+                for stage, seconds in self.seconds.items()
+            },
+            "counters": dict(self.counters),
+        }
+        total = self.seconds.get("total", 0.0)
+        if total > 0:
+            written_mb = self.counters.get("written_bytes", 0) / (1 << 20)
+            write = self.seconds.get("write", 0.0)
+            summary["throughput"] = {
+                "tiles_per_s": round(self.counters.get("tiles", 0) / total, 3),
+                "written_mb_per_s": round(written_mb / total, 3),
+                "write_mb_per_s": round(written_mb / write, 3) if write > 0 else None,
+            }
+        return summary
+
+
+def image_nbytes(image: Image.Image) -> int:
+    """Return the size in bytes of the decoded pixels of ``image``."""
+    return image.width * image.height * len(image.getbands())
@@ -1,7 +1,284 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import (BinaryIO, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple)
+
 # Third Party
+import numpy as np
 from PIL import Image
 
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+RESAMPLINGS = ("average", "nearest")
+# Uncompressed level 0 size above which BigTIFF is written when ``bigtiff`` is None
+BIGTIFF_THRESHOLD = 2 << 30
+# Bytes of compressed TIFF segments read from the source at once
+READ_BUFFER = 8 << 20
+
+
+# ---------------------------------------------------- #
+#             Streaming Pyramidal TIFF Writer          #
+# ---------------------------------------------------- #
+def convert_to_pyramidal_tiff(
+    image_path: str,
+    output_path: str,
+    tile_size: int = 256,
+    compression: str = "zlib",
+    resampling: str = "average",
+    min_level_size: int = 512,
+    bigtiff: Optional[bool] = None,
+) -> str:
+    """Convert an image (JPEG, PNG, flat or tiled TIFF, ...) into a tiled pyramidal
+    TIFF that openslide reads level by level.
+
+    Level 0 is written one band of ``tile_size`` rows at a time. Each band is
+    downsampled by 2 and appended to a scratch file in the directory of
+    ``output_path``, which is read back band by band to write the next level, until
+    the largest side of a level is at most ``min_level_size``. Memory stays bounded by
+    a few bands, whatever the image size. 8-bit TIFF sources are decoded one strip or
+    one row of tiles at a time; other formats (e.g. JPEG, which cannot be decoded by
+    region) are decoded once by Pillow. The output is written to a temporary file and
+    moved to ``output_path`` once complete.
+
+    Parameters
+    ----------
+    image_path : str
+        Path of the image to convert.
+    output_path : str
+        Path of the pyramidal TIFF to write.
+    tile_size : int, optional
+        Side of the TIFF tiles, a multiple of 16. Default is 256.
+    compression : str, optional
+        TIFF compression of the tiles, e.g. "zlib", "none", or "jpeg" with the
+        imagecodecs package installed. Default is "zlib".
+    resampling : str, {"average", "nearest"}
+        How lower levels are computed: mean of every 2x2 pixel block, or top left
+        pixel of the block, which keeps the colours of masks exact. Default is
+        "average".
+    min_level_size : int, optional
+        Largest side of a level below which no further level is added. Default is
+        512.
+    bigtiff : bool, optional
+        Whether to write a BigTIFF. Default is None, BigTIFF if the uncompressed
+        level 0 exceeds 2 GiB.
+
+    Returns
+    -------
+    str
+        ``output_path``
+    """
+    if resampling not in RESAMPLINGS:
+        raise ValueError(f"resampling must be one of {RESAMPLINGS} ({resampling})")
+    if tile_size < 16 or tile_size % 16:
+        raise ValueError(f"tile_size must be a multiple of 16 ({tile_size})")
+    # Third Party
+    import tifffile
+
+    width, height, bands = _open_source(image_path)
+    if bigtiff is None:
+        bigtiff = width * height * 3 > BIGTIFF_THRESHOLD
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    path_tmp = output_path + ".tmp"
+
+    with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.", dir=output_dir) as scratch:
+        with tifffile.TiffWriter(path_tmp, bigtiff=bigtiff) as tif:
+            level = 0
+            while True:
+                path_next = None
+                if max(width, height) > min_level_size:
+                    path_next = os.path.join(scratch, f"level-{level + 1}.raw")
+                with open(path_next or os.devnull, "wb") as fd_next:
+                    tif.write(
+                        _level_tiles(
+                            _rebanded(bands, tile_size),
+                            width,
+                            tile_size,
+                            fd_next if path_next else None,
+                            resampling,
+                        ),
+                        shape=(height, width, 3),
+                        dtype=np.uint8,
+                        tile=(tile_size, tile_size),
+                        photometric="rgb",
+                        compression=compression,
+                        subfiletype=0 if level == 0 else 1,
+                    )
+                if path_next is None:
+                    break
+                width, height = -(-width // 2), -(-height // 2)
+                bands = _raw_bands(path_next, width, height, tile_size)
+                level += 1
+    os.replace(path_tmp, output_path)
+    return output_path
+
+
+def convert_many_to_pyramidal_tiff(
+    jobs: Sequence[Tuple[str, str]], workers: int = 1, **kwargs
+) -> List[str]:
+    """Convert several images with ``convert_to_pyramidal_tiff``, ``workers`` files at
+    a time in worker processes.
+
+    Parameters
+    ----------
+    jobs : Sequence[Tuple[str, str]]
+        (image path, output path) of every file to convert.
+    workers : int, optional
+        Number of worker processes. Default is 1, which converts the files one after
+        the other in the calling process.
+    **kwargs
+        Options of ``convert_to_pyramidal_tiff``, the same for every file.
+
+    Returns
+    -------
+    List[str]
+        Output paths, in the order of ``jobs``.
+    """
+    convert = partial(_convert_job, kwargs)
+    if workers <= 1:
+        return [convert(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(convert, jobs))
+
 
 def convert_jpeg_to_tiff(image_path, output_path):
-    im = Image.open(image_path)
-    im.save(output_path, 'TIFF')
+    """Convert a JPEG image into a tiled pyramidal TIFF, see
+    ``convert_to_pyramidal_tiff``."""
+    return convert_to_pyramidal_tiff(image_path, output_path)
+
+
+# ---------------------------------------------------- #
+#                 Implementation Helpers               #
+# ---------------------------------------------------- #
+def _convert_job(kwargs: dict, job: Tuple[str, str]) -> str:
+    return convert_to_pyramidal_tiff(*job, **kwargs)
+
+
+def _open_source(path: str) -> Tuple[int, int, Iterator[np.ndarray]]:
+    """Return the width, height and bands of the image at ``path``.
+
+    Bands are (rows, width, 3) uint8 RGB arrays covering the image from top to
+    bottom. 8-bit RGB or grayscale TIFF images that tifffile can decompress are
+    decoded one strip or one row of tiles at a time; other images are decoded at once
+    by Pillow.
+    """
+    # Third Party
+    import tifffile
+
+    try:
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[0]
+            if (
+                page.dtype == np.uint8
+                and page.planarconfig == 1
+                and page.photometric in (tifffile.PHOTOMETRIC.RGB, tifffile.PHOTOMETRIC.MINISBLACK)
+                and page.shape[2:] in [(), (1,), (3,), (4,)]
+                and page.compression in tifffile.TIFF.DECOMPRESSORS
+            ):
+                return page.imagewidth, page.imagelength, _tiff_bands(path)
+    except (tifffile.TiffFileError, ValueError, NotImplementedError):
+        pass
+    image = Image.open(path)
+    return image.width, image.height, _image_bands(image)
+
+
+def _tiff_bands(path: str) -> Iterator[np.ndarray]:
+    """Yield the first page of a TIFF file, one strip or one row of tiles at a time."""
+    # Third Party
+    import tifffile
+
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        width, height = page.imagewidth, page.imagelength
+        band, band_y = None, None
+        # Segments are decoded in file index order, i.e. row by row
+        for segment, (_, _, y, x, _), _ in page.segments(buffersize=READ_BUFFER):
+            segment = _to_rgb(segment[0])
+            if y != band_y:
+                if band is not None:
+                    yield band
+                band_y = y
+                band = np.empty((min(len(segment), height - y), width, 3), dtype=np.uint8)
+            columns = min(segment.shape[1], width - x)
+            band[:, x:x + columns] = segment[: len(band), :columns]
+        if band is not None:
+            yield band
+
+
+def _image_bands(image: Image.Image, rows: int = 256) -> Iterator[np.ndarray]:
+    for y_start in range(0, image.height, rows):
+        band = image.crop((0, y_start, image.width, min(y_start + rows, image.height)))
+        yield np.asarray(band.convert("RGB"))
+
+
+def _raw_bands(path: str, width: int, height: int, rows: int) -> Iterator[np.ndarray]:
+    """Yield the bands of a raw (height, width, 3) uint8 file written band by band."""
+    with open(path, "rb") as fd:
+        for y_start in range(0, height, rows):
+            band_rows = min(rows, height - y_start)
+            data = fd.read(band_rows * width * 3)
+            yield np.frombuffer(data, dtype=np.uint8).reshape(band_rows, width, 3)
+
+
+def _to_rgb(pixels: np.ndarray) -> np.ndarray:
+    if pixels.ndim == 2:
+        return np.repeat(pixels[..., None], 3, axis=2)
+    if pixels.shape[2] == 1:
+        return np.repeat(pixels, 3, axis=2)
+    return pixels[..., :3]
+
+
+def _rebanded(bands: Iterable[np.ndarray], rows: int) -> Iterator[np.ndarray]:
+    """Regroup ``bands`` into bands of exactly ``rows`` rows, except the last one."""
+    pending, n_pending = [], 0
+    for band in bands:
+        pending.append(band)
+        n_pending += len(band)
+        while n_pending >= rows:
+            merged = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield merged[:rows]
+            pending, n_pending = [merged[rows:]], n_pending - rows
+    if n_pending:
+        yield np.concatenate(pending)
+
+
+def _level_tiles(
+    bands: Iterable[np.ndarray],
+    width: int,
+    tile_size: int,
+    fd_next: Optional[BinaryIO],
+    resampling: str,
+) -> Iterator[np.ndarray]:
+    """Yield the tiles of one level in row-major order from its bands of
+    ``tile_size`` rows, and append the downsampled bands to ``fd_next``."""
+    for band in bands:
+        if fd_next is not None:
+            fd_next.write(_downsample(band, resampling).tobytes())
+        # Edge tiles are padded to the full tile size
+        padded = np.zeros((tile_size, -(-width // tile_size) * tile_size, 3), dtype=np.uint8)
+        padded[: len(band), :width] = band
+        for x_start in range(0, width, tile_size):
+            yield padded[:, x_start:x_start + tile_size]
+
+
+def _downsample(band: np.ndarray, resampling: str) -> np.ndarray:
+    """Halve the size of ``band``, rounding odd sizes up by repeating the last
+    row or column."""
+    if resampling == "nearest":
+        return band[::2, ::2]
+    pad = ((0, band.shape[0] % 2), (0, band.shape[1] % 2), (0, 0))
+    if any(pad_before_after[1] for pad_before_after in pad):
+        band = np.pad(band, pad, mode="edge")
+    blocks = band.reshape(band.shape[0] // 2, 2, band.shape[1] // 2, 2, 3)
+    return ((blocks.sum(axis=(1, 3), dtype=np.uint16) + 2) // 4).astype(np.uint8)
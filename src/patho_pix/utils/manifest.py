@@ -0,0 +1,175 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger("tiler")
+
+MANIFEST_VERSION = 1
+
+
+def params_hash(params: dict) -> str:
+    """Return a stable hash of the JSON serializable extraction ``params``."""
+    serialized = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+# ---------------------------------------------------- #
+#                   Tiling Manifest                    #
+# ---------------------------------------------------- #
+class TilingManifest:
+    """On-disk record of the tiles written by an extraction, used to resume it.
+
+    The manifest is a JSON lines file. The first line holds the extraction parameters
+    and their hash; every following line describes one written tile: its index in the
+    grid of candidate coordinates, filename, level 0 coordinates, tissue ratio and the
+    size of each encoded stream. A line is appended and flushed as soon as a tile is
+    written, so the manifest survives an interrupted run.
+
+    Arguments
+    ---------
+    path : str
+        Path of the manifest file.
+    params : dict
+        Parameters the tiles depend on (tile size, level, overlap, mask settings,
+        slides, ...). A manifest written with different parameters is discarded.
+    """
+
+    def __init__(self, path: str, params: dict):
+        self.path = path
+        self.params = params
+        self.params_hash = params_hash(params)
+        self.entries = []
+        self.processed = -1
+        self._fd = None
+
+    def resume(self, verify: Callable[[str, str, int], bool]) -> List[dict]:
+        """Load the tiles already recorded and open the manifest for appending.
+
+        Recorded tiles are checked in extraction order with ``verify(filename,
+        stream, size)``; the tiles from the first one failing verification onwards are
+        dropped, so that they are extracted again with the same numbering.
+
+        Parameters
+        ----------
+        verify : Callable[[str, str, int], bool]
+            Returns whether the ``stream`` tile ``filename`` is completely written with
+            the recorded size, e.g. ``TileWriter.verify``.
+
+        Returns
+        -------
+        List[dict]
+            Verified tile entries, in extraction order.
+        """
+        entries, processed = self._read()
+        verified = []
+        for entry in entries:
+            if not all(verify(entry["filename"], stream, size)
+                       for stream, size in entry["sizes"].items()):
+                logger.info(f"Tile {entry['filename']} could not be verified, resuming from it")
+                processed = -1
+                break
+            verified.append(entry)
+        self.entries = verified
+        self.processed = max([processed] + [entry["candidate"] for entry in verified])
+
+        # Rewrite the manifest with the verified entries only, then keep appending
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w") as fd:
+            fd.write(json.dumps(self._header(), default=str) + "\n")
+            for entry in verified:
+                fd.write(json.dumps(entry) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+        self._fd = open(self.path, "a")
+        return verified
+
+    def record(
+        self,
+        candidate: int,
+        filename: str,
+        coords: Sequence[int],
+        tissue_ratio: float,
+        sizes: Dict[str, int],
+        label_ratio: Optional[float] = None,
+        label_counts: Optional[Sequence[int]] = None,
+        artifact_scores: Optional[Dict[str, float]] = None,
+    ) -> None:
+        """Append the entry of a written tile and flush it to disk. Label counts are
+        recorded as a {class: count} mapping of the classes present, artifact scores
+        as a {score: value} mapping."""
+        entry = {
+            "candidate": int(candidate),
+            "filename": filename,
+            "coords": [int(c) for c in coords],
+            "tissue_ratio": float(tissue_ratio),
+            "sizes": sizes,
+        }
+        if label_ratio is not None:
+            entry["label_ratio"] = float(label_ratio)
+        if label_counts is not None:
+            entry["label_counts"] = {
+                str(label): int(count) for label, count in enumerate(label_counts) if count
+            }
+        if artifact_scores is not None:
+            entry["artifacts"] = {name: float(value) for name, value in artifact_scores.items()}
+        self.entries.append(entry)
+        self._fd.write(json.dumps(entry) + "\n")
+        self._fd.flush()
+
+    def close(self, processed: Optional[int] = None) -> None:
+        """Close the manifest, recording that all candidates up to ``processed`` (grid
+        index) have been handled when the extraction completed."""
+        if self._fd is None:
+            return
+        if processed is not None:
+            self._fd.write(json.dumps({"processed": int(processed)}) + "\n")
+        self._fd.close()
+        self._fd = None
+
+    # ------- implementation helpers -------
+
+    def _header(self) -> dict:
+        return {
+            "version": MANIFEST_VERSION,
+            "params_hash": self.params_hash,
+            "params": self.params,
+        }
+
+    def _read(self):
+        """Return the recorded entries and last processed candidate of a manifest
+        written with the same parameters, nothing otherwise."""
+        if not os.path.exists(self.path):
+            return [], -1
+        entries = []
+        processed = -1
+        with open(self.path) as fd:
+            lines = fd.read().splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except json.JSONDecodeError:
+            header = {}
+        if (header.get("version") != MANIFEST_VERSION
+                or header.get("params_hash") != self.params_hash):
+            logger.info(f"Discarding manifest {self.path}: extraction parameters changed")
+            return [], -1
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line truncated by an interrupted run
+                break
+            if "processed" in record:
+                processed = record["processed"]
+            else:
+                entries.append(record)
+        return entries, processed
@@ -0,0 +1,154 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+from __future__ import annotations
+
+# Standard Library
+import resource
+import sys
+from typing import TYPE_CHECKING, NamedTuple, Optional, Sequence
+
+if TYPE_CHECKING:
+    # Third Party
+    from histolab.masks import BinaryMask
+    from histolab.slide import Slide
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+# Smallest budget, in tiles (all streams) held at once by the read, tissue check and
+# encoding of one tile
+MIN_BUDGET_TILES = 8
+# Copies of a superblock alive while it is read: openslide buffer, array and
+# transformed array or cached linked tiles
+SUPERBLOCK_COPIES = 4
+# Copies of a tile in flight: pixels and encoded bytes
+PENDING_COPIES = 2
+
+
+class BufferLimits(NamedTuple):
+    """Sizes of the buffers of an extraction, derived from its memory budget."""
+
+    # Tiles read but not written yet, in a serial extraction
+    max_pending: int
+    # Size of the RGBA pixels of one superblock of each reader
+    superblock_bytes: int
+    # Metadata rows kept in memory before they are spilled to disk
+    spill_rows: int
+    # Tiles of the chunks of a parallel extraction
+    chunk_tiles: int
+    # Decoded slide tiles cached by openslide, shared by the slides of a process
+    slide_cache_bytes: int
+
+
+# ---------------------------------------------------- #
+#                     Memory Budget                    #
+# ---------------------------------------------------- #
+def buffer_limits(
+    memory_budget: int,
+    tile_bytes: int,
+    n_streams: int,
+    row_bytes: int,
+    workers: int = 1,
+) -> BufferLimits:
+    """Split the memory budget of an extraction between its buffers.
+
+    Half of the budget goes to the tiles in flight (the queue of a serial extraction,
+    the encoded chunks waiting to be written by a parallel one), a quarter to the
+    superblocks, shared by the readers of the streams, a sixteenth to the metadata
+    rows kept in memory and a sixteenth to the openslide tile cache (32 MiB per slide
+    by default). The rest is left to the thumbnails, tissue masks and candidate
+    coordinates of the slide.
+
+    Parameters
+    ----------
+    memory_budget : int
+        Memory in bytes the extraction may add to its process.
+    tile_bytes : int
+        Size of the RGBA pixels of one tile of every stream (image, mask, linked).
+    n_streams : int
+        Number of slide readers, one per stream.
+    row_bytes : int
+        Size of one metadata row.
+    workers : int, optional
+        Number of worker processes, each with the budget. Default is 1.
+
+    Returns
+    -------
+    BufferLimits
+        Limits of the buffers of the extraction.
+
+    Raises
+    ------
+    ValueError
+        If the budget is smaller than ``MIN_BUDGET_TILES`` tiles.
+    """
+    if memory_budget < MIN_BUDGET_TILES * tile_bytes:
+        raise ValueError(
+            f"memory_budget of {memory_budget} bytes is too small for tiles of "
+            f"{tile_bytes} bytes, at least {MIN_BUDGET_TILES * tile_bytes} are needed"
+        )
+    tiles_bytes = memory_budget // 2
+    return BufferLimits(
+        max_pending=max(tiles_bytes // (PENDING_COPIES * tile_bytes), 1),
+        superblock_bytes=memory_budget // (4 * SUPERBLOCK_COPIES * n_streams),
+        # Growing the columns copies them
+        spill_rows=max(memory_budget // (16 * 2 * row_bytes), 1),
+        chunk_tiles=max(tiles_bytes // ((workers + 1) * tile_bytes), 1),
+        slide_cache_bytes=memory_budget // 16,
+    )
+
+
+def limit_slide_cache(slides: Sequence[Slide], capacity: int) -> None:
+    """Make the openslide handles of ``slides`` share one tile cache of ``capacity``
+    bytes, instead of a cache of 32 MiB each. Slides read by other backends are left
+    as they are."""
+    # Third Party
+    import openslide
+
+    cache = openslide.OpenSlideCache(capacity)
+    for slide in slides:
+        if slide is not None and isinstance(slide._wsi, openslide.OpenSlide):
+            slide._wsi.set_cache(cache)
+
+
+def release_slide_caches(extraction_mask: Optional[BinaryMask] = None) -> None:
+    """Drop the thumbnails and tissue masks that histolab caches for its last 100
+    slides, and with them the slides and their openslide handles.
+
+    The caches are shared by all the slides of the process: thumbnails and masks
+    needed again are recomputed.
+    """
+    # Third Party
+    from histolab.slide import Slide
+
+    Slide.thumbnail.fget.cache_clear()
+    if extraction_mask is None:
+        return
+    for cls in type(extraction_mask).__mro__:
+        method = cls.__dict__.get("_mask")
+        method = method.fget if isinstance(method, property) else method
+        if hasattr(method, "cache_clear"):
+            method.cache_clear()
+
+
+def release_tile_caches() -> None:
+    """Drop the images, tissue masks and ratios that histolab caches for its last 100
+    tiles (lazy properties are cached per class, not per tile)."""
+    # Third Party
+    from histolab.tile import Tile
+
+    for attribute in vars(Tile).values():
+        if isinstance(attribute, property) and hasattr(attribute.fget, "cache_clear"):
+            attribute.fget.cache_clear()
+
+
+def peak_rss() -> int:
+    """Peak resident memory of this process, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in KiB elsewhere
+    return peak if sys.platform == "darwin" else peak << 10
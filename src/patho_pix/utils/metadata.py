@@ -0,0 +1,558 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import json
+import os
+import tempfile
+from collections.abc import Mapping
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+# Third Party
+import numpy as np
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+# Rows added to the columns every time they are full
+CHUNK_ROWS = 4096
+COLUMNS = {
+    "candidate": "int64",
+    "x_ul": "int64",
+    "y_ul": "int64",
+    "x_br": "int64",
+    "y_br": "int64",
+    "tissue_ratio": "float64",
+    "label_ratio": "float32",
+}
+COORDINATES = ("x_ul", "y_ul", "x_br", "y_br")
+# Entry of the attributes in NumPy metadata files
+NPZ_HEADER = "patho_pix"
+
+
+# ---------------------------------------------------- #
+#                Columnar Tile Metadata                #
+# ---------------------------------------------------- #
+class TileMetadata(Mapping):
+    """Metadata of the tiles saved by ``AwesomeTiler.extract``, stored in NumPy columns.
+
+    Every saved tile is a row: its index in the grid of candidates, its level 0
+    coordinates, its tissue ratio and, for image + mask extraction, the ratio of
+    labelled (non zero) mask pixels (NaN otherwise). The row number is the tile
+    counter of the filename; tile size, level, prefix and suffix are stored once.
+    With ``n_classes`` set, the number of mask pixels of every class value of the
+    tile is stored too, see ``label_counts``; with ``linked`` scales, the level 0
+    coordinates of the linked tiles of a multi-scale extraction, see
+    ``linked_coordinates``; with ``artifacts`` scores, the artifact scores of every
+    tile, see ``artifact_scores``. The columns are preallocated and grow by chunks of
+    ``CHUNK_ROWS`` rows.
+
+    With ``spill_rows`` set, at most ``spill_rows`` rows are kept in memory: the
+    rows before them are appended to files of a temporary directory and read back
+    memory mapped, so that the metadata of large slides does not grow the memory of
+    the extraction.
+
+    The object is also a read-only mapping from tile filename to
+    ``[tissue_ratio, tile_size, (x_ul_wsi, y_ul_wsi)]``, as the dictionary previously
+    returned by ``extract``. The filenames are built on demand.
+
+    Arguments
+    ---------
+    prefix : str
+        Prefix of the tile filenames.
+    suffix : str
+        Suffix of the tile filenames.
+    level : int
+        Level of the tiles.
+    tile_size : Tuple[int, int]
+        (width, height) of the tiles at ``level``.
+    slide : str, optional
+        Path of the image slide. Default is None.
+    n_classes : int, optional
+        Number of class values ``0..n_classes - 1`` of the label histograms. Default
+        is 0, no label histograms.
+    linked : Sequence[str], optional
+        Names of the scales of the linked tiles, e.g. ``["level1", "level2"]``.
+        Default is no linked tiles.
+    artifacts : Sequence[str], optional
+        Names of the artifact scores of every tile, e.g. ``ARTIFACT_SCORES``. Default
+        is no artifact scores.
+    spill_rows : int, optional
+        Number of rows kept in memory before they are spilled to disk. Default is
+        None, all rows stay in memory.
+    spill_dir : str, optional
+        Directory in which the temporary directory of the spilled rows is created.
+        Default is the directory of ``tempfile``.
+    """
+
+    def __init__(
+        self,
+        prefix: str = "",
+        suffix: str = ".png",
+        level: int = 0,
+        tile_size: Tuple[int, int] = (0, 0),
+        slide: Optional[str] = None,
+        n_classes: int = 0,
+        linked: Sequence[str] = (),
+        artifacts: Sequence[str] = (),
+        spill_rows: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+    ):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.level = level
+        self.tile_size = tuple(tile_size)
+        self.slide = slide
+        self.n_classes = n_classes
+        self.linked = list(linked)
+        self.artifacts = list(artifacts)
+        self.spill_rows = spill_rows
+        self.spill_dir = spill_dir
+        self._n_rows = 0
+        # Rows before _n_spilled are in the spill files, the others in the columns
+        self._n_spilled = 0
+        self._spill_tmp = None
+        self._spilled = {}
+        self._columns = {
+            name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()
+        }
+        self._label_counts = np.zeros((0, n_classes), dtype=np.uint32)
+        self._linked_coords = np.zeros((0, len(self.linked), 4), dtype=np.int64)
+        self._artifact_scores = np.zeros((0, len(self.artifacts)), dtype=np.float32)
+
+    # ------- mapping interface -------
+
+    def __len__(self) -> int:
+        return self._n_rows
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.filename(row) for row in range(self._n_rows))
+
+    def __getitem__(self, filename: str) -> list:
+        row = self._row(filename)
+        if row is None:
+            raise KeyError(filename)
+        return [
+            float(self._value("tissue_ratio", row)),
+            self.tile_size,
+            (int(self._value("x_ul", row)), int(self._value("y_ul", row))),
+        ]
+
+    def __contains__(self, filename: object) -> bool:
+        return isinstance(filename, str) and self._row(filename) is not None
+
+    def __getstate__(self):
+        # Pickle the filled rows only, in memory
+        state = self.__dict__.copy()
+        state["_columns"] = {name: np.array(column) for name, column in self.columns.items()}
+        state["_label_counts"] = np.array(self.label_counts)
+        state["_linked_coords"] = np.array(self.linked_coordinates)
+        state["_artifact_scores"] = np.array(self.artifact_scores)
+        state.update(_n_spilled=0, _spill_tmp=None, _spilled={})
+        return state
+
+    # ------- columns -------
+
+    @property
+    def columns(self) -> dict:
+        """Views of the filled rows of every column, keyed by column name. Read-only
+        memory maps once rows are spilled."""
+        return {name: self._filled(name) for name in self._columns}
+
+    @property
+    def label_counts(self) -> np.ndarray:
+        """(n_tiles, n_classes) number of mask pixels of every class value of every
+        tile, e.g. ``label_counts.argmax(axis=1)`` is the majority class of each tile.
+        Zeros for tiles appended without histogram."""
+        return self._filled("label_counts")
+
+    def label_columns(self) -> dict:
+        """Return the pixel counts of the class values present in at least one tile,
+        as ``label_{class}`` columns."""
+        label_counts = self.label_counts
+        return {
+            f"label_{label}": label_counts[:, label]
+            for label in np.flatnonzero(label_counts.any(axis=0))
+        }
+
+    @property
+    def linked_coordinates(self) -> np.ndarray:
+        """(n_tiles, n_linked, 4) level 0 coordinates (x_ul, y_ul, x_br, y_br) of the
+        linked tiles of every tile, in the order of ``linked``."""
+        return self._filled("linked_coords")
+
+    def linked_columns(self) -> dict:
+        """Return the coordinates of the linked tiles as ``{scale}_{x_ul, ...}``
+        columns."""
+        linked_coords = self.linked_coordinates
+        return {
+            f"{scale}_{coordinate}": linked_coords[:, position, axis]
+            for position, scale in enumerate(self.linked)
+            for axis, coordinate in enumerate(COORDINATES)
+        }
+
+    @property
+    def artifact_scores(self) -> np.ndarray:
+        """(n_tiles, n_artifacts) artifact scores of every tile, in the order of
+        ``artifacts``. NaN for tiles appended without scores."""
+        return self._filled("artifact_scores")
+
+    def artifact_columns(self) -> dict:
+        """Return the artifact scores as one column per score name."""
+        artifact_scores = self.artifact_scores
+        return {name: artifact_scores[:, position] for position, name in enumerate(self.artifacts)}
+
+    def append(
+        self,
+        candidate: int,
+        coords: Sequence[int],
+        tissue_ratio: float,
+        label_ratio: float = np.nan,
+        label_counts: Optional[np.ndarray] = None,
+        linked_coords: Optional[np.ndarray] = None,
+        artifact_scores: Optional[np.ndarray] = None,
+    ) -> None:
+        """Add the row of the next saved tile."""
+        row = self._n_rows - self._n_spilled
+        if self.spill_rows is not None and row >= self.spill_rows:
+            self._spill()
+            row = 0
+        if row == len(self._columns["candidate"]):
+            n_rows = row + CHUNK_ROWS
+            self._reserve(n_rows if self.spill_rows is None else min(n_rows, self.spill_rows))
+        columns = self._columns
+        columns["candidate"][row] = candidate
+        (columns["x_ul"][row], columns["y_ul"][row],
+         columns["x_br"][row], columns["y_br"][row]) = coords
+        columns["tissue_ratio"][row] = tissue_ratio
+        columns["label_ratio"][row] = np.nan if label_ratio is None else label_ratio
+        if self.n_classes:
+            self._label_counts[row] = 0 if label_counts is None else label_counts[: self.n_classes]
+        if self.linked:
+            self._linked_coords[row] = -1 if linked_coords is None else linked_coords
+        if self.artifacts:
+            self._artifact_scores[row] = np.nan if artifact_scores is None else artifact_scores
+        self._n_rows += 1
+
+    def row_bytes(self) -> int:
+        """Return the size in memory of one row."""
+        return sum(
+            buffer.itemsize * int(np.prod(buffer.shape[1:]))
+            for buffer in self._buffers().values()
+        )
+
+    def filename(self, row: int) -> str:
+        """Return the filename of the tile of ``row``, as ``AwesomeTiler`` names it."""
+        x_ul, y_ul, x_br, y_br = (self._value(name, row) for name in COORDINATES)
+        return f"{self.prefix}tile_{row}_level{self.level}_{x_ul}-{y_ul}-{x_br}-{y_br}{self.suffix}"
+
+    def filenames(self) -> List[str]:
+        """Return the filenames of all tiles, in extraction order."""
+        return list(self)
+
+    # ------- export -------
+
+    def to_pandas(self, filenames: bool = True):
+        """Return the metadata as a pandas DataFrame, one row per tile.
+
+        The numeric columns share the memory of the metadata columns (no copy).
+
+        Parameters
+        ----------
+        filenames : bool, optional
+            Whether to add the ``filename`` column, built for every tile. Default is
+            True.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns ``candidate``, ``x_ul``, ``y_ul``, ``x_br``, ``y_br``,
+            ``tissue_ratio``, ``label_ratio``, the ``label_columns``, the
+            ``linked_columns``, the ``artifact_columns`` and optionally ``filename``; the tile counter is the
+            index. ``attrs`` holds the prefix, suffix, level, tile size
+            and slide.
+        """
+        # Third Party
+        import pandas as pd
+
+        data = self._all_columns()
+        if filenames:
+            data["filename"] = self.filenames()
+        frame = pd.DataFrame(data, copy=False)
+        frame.index.name = "tile"
+        frame.attrs.update(self._attributes())
+        return frame
+
+    def save(self, path: str) -> None:
+        """Write the metadata as a NumPy (``.npz``), Parquet (``.parquet``) or Feather
+        (``.feather``) file, with the prefix, suffix, level, tile size and slide in its
+        header (schema metadata for Parquet and Feather). Parquet and Feather require
+        the pyarrow package."""
+        attributes = json.dumps(self._attributes())
+        if os.path.splitext(path)[1].lower() == ".npz":
+            # A file object keeps np.savez from adding the .npz extension
+            with open(path, "wb") as fd:
+                np.savez(fd, **self._all_columns(), **{NPZ_HEADER: np.array(attributes)})
+            return
+        pa = _import_pyarrow()
+        table = pa.Table.from_pydict(self._all_columns())
+        table = table.replace_schema_metadata({"patho_pix": attributes})
+        _table_io(path)[0](table, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TileMetadata":
+        """Read metadata written by ``save``."""
+        if os.path.splitext(path)[1].lower() == ".npz":
+            with np.load(path, allow_pickle=False) as data:
+                attributes = json.loads(str(data[NPZ_HEADER]))
+                columns = {name: data[name] for name in data.files if name != NPZ_HEADER}
+        else:
+            table = _table_io(path)[1](path)
+            attributes = json.loads(table.schema.metadata[b"patho_pix"])
+            columns = {name: table.column(name).to_numpy() for name in table.column_names}
+
+        metadata = cls(**attributes)
+        n_rows = len(columns["candidate"])
+        metadata._columns = {
+            name: columns[name].astype(dtype, copy=False)
+            for name, dtype in COLUMNS.items()
+        }
+        metadata._n_rows = n_rows
+        metadata._label_counts = np.zeros((n_rows, metadata.n_classes), dtype=np.uint32)
+        for name, column in columns.items():
+            if name.startswith("label_") and name[len("label_"):].isdigit():
+                metadata._label_counts[:, int(name[len("label_"):])] = column
+        metadata._linked_coords = np.zeros((n_rows, len(metadata.linked), 4), dtype=np.int64)
+        for position, scale in enumerate(metadata.linked):
+            for axis, coordinate in enumerate(COORDINATES):
+                metadata._linked_coords[:, position, axis] = columns[f"{scale}_{coordinate}"]
+        metadata._artifact_scores = np.zeros((n_rows, len(metadata.artifacts)), dtype=np.float32)
+        for position, name in enumerate(metadata.artifacts):
+            metadata._artifact_scores[:, position] = columns[name]
+        return metadata
+
+    @classmethod
+    def merge(cls, parts: Sequence["TileMetadata"]) -> "TileMetadata":
+        """Merge the metadata of the shards of one extraction, given in shard order,
+        into the metadata of a single extraction: rows follow each other and are
+        renumbered, so that the tile counters are the ones of a single-node run.
+
+        Raises
+        ------
+        ValueError
+            If there is no part, if the parts have different attributes (slide path
+            aside) or if their tiles are not in grid order, e.g. shards out of order.
+        """
+        if not parts:
+            raise ValueError("No metadata to merge")
+        attributes = parts[0]._attributes()
+        for part in parts[1:]:
+            if {**part._attributes(), "slide": attributes["slide"]} != attributes:
+                raise ValueError("Metadata of different extractions cannot be merged")
+        merged = cls(**attributes)
+        merged._columns = {
+            name: np.concatenate([part.columns[name] for part in parts]).astype(dtype, copy=False)
+            for name, dtype in COLUMNS.items()
+        }
+        if np.any(np.diff(merged._columns["candidate"]) <= 0):
+            raise ValueError("Merged tiles are not in grid order, give the shards in order")
+        merged._label_counts = np.concatenate([part.label_counts for part in parts])
+        merged._linked_coords = np.concatenate([part.linked_coordinates for part in parts])
+        merged._artifact_scores = np.concatenate([part.artifact_scores for part in parts])
+        merged._n_rows = len(merged._columns["candidate"])
+        return merged
+
+    @staticmethod
+    def concat(metadatas: Sequence["TileMetadata"], filenames: bool = False):
+        """Concatenate the metadata of several slides into one pandas DataFrame.
+
+        Parameters
+        ----------
+        metadatas : Sequence[TileMetadata]
+            Metadata of every slide.
+        filenames : bool, optional
+            Whether to add the ``filename`` column. Default is False.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns of every slide one after the other, including the
+            ``label_columns`` (0 for the slides without), ``linked_columns`` (-1) and
+            ``artifact_columns`` (NaN) of any slide, with the categorical ``slide`` column (slide path, or
+            position in ``metadatas`` if unknown) and the ``tile`` counter within the
+            slide.
+        """
+        # Third Party
+        import pandas as pd
+
+        lengths = [len(metadata) for metadata in metadatas]
+        data = {
+            name: np.concatenate([metadata.columns[name] for metadata in metadatas])
+            for name in COLUMNS
+        }
+        label_columns = [metadata.label_columns() for metadata in metadatas]
+        for name in sorted({name for columns in label_columns for name in columns},
+                           key=lambda name: int(name[len("label_"):])):
+            data[name] = np.concatenate([
+                columns.get(name, np.zeros(length, dtype=np.uint32))
+                for columns, length in zip(label_columns, lengths)
+            ] + [np.empty(0, np.uint32)])
+        linked_columns = [metadata.linked_columns() for metadata in metadatas]
+        for name in dict.fromkeys(name for columns in linked_columns for name in columns):
+            data[name] = np.concatenate([
+                columns.get(name, np.full(length, -1, dtype=np.int64))
+                for columns, length in zip(linked_columns, lengths)
+            ])
+        artifact_columns = [metadata.artifact_columns() for metadata in metadatas]
+        for name in dict.fromkeys(name for columns in artifact_columns for name in columns):
+            data[name] = np.concatenate([
+                columns.get(name, np.full(length, np.nan, dtype=np.float32))
+                for columns, length in zip(artifact_columns, lengths)
+            ])
+        data["tile"] = np.concatenate([np.arange(n) for n in lengths] + [np.empty(0, int)])
+        slides, slide_codes = np.unique(
+            [
+                str(metadata.slide if metadata.slide is not None else position)
+                for position, metadata in enumerate(metadatas)
+            ],
+            return_inverse=True,
+        )
+        data["slide"] = pd.Categorical.from_codes(
+            np.repeat(slide_codes, lengths), categories=slides
+        )
+        if filenames:
+            data["filename"] = [name for metadata in metadatas for name in metadata]
+        return pd.DataFrame(data, copy=False)
+
+    # ------- implementation helpers -------
+
+    def _attributes(self) -> dict:
+        return {
+            "prefix": self.prefix,
+            "suffix": self.suffix,
+            "level": self.level,
+            "tile_size": list(self.tile_size),
+            "slide": self.slide,
+            "n_classes": self.n_classes,
+            "linked": self.linked,
+            "artifacts": self.artifacts,
+        }
+
+    def _all_columns(self) -> dict:
+        return {
+            **self.columns,
+            **self.label_columns(),
+            **self.linked_columns(),
+            **self.artifact_columns(),
+        }
+
+    def _reserve(self, n_rows: int) -> None:
+        """Grow the columns in memory to ``n_rows`` rows."""
+        n_filled = self._n_rows - self._n_spilled
+        for name, column in self._columns.items():
+            grown = np.empty(n_rows, dtype=column.dtype)
+            grown[:n_filled] = column[:n_filled]
+            self._columns[name] = grown
+        grown = np.zeros((n_rows, self.n_classes), dtype=np.uint32)
+        grown[:n_filled] = self._label_counts[:n_filled]
+        self._label_counts = grown
+        grown = np.full((n_rows, len(self.linked), 4), -1, dtype=np.int64)
+        grown[:n_filled] = self._linked_coords[:n_filled]
+        self._linked_coords = grown
+        grown = np.full((n_rows, len(self.artifacts)), np.nan, dtype=np.float32)
+        grown[:n_filled] = self._artifact_scores[:n_filled]
+        self._artifact_scores = grown
+
+    def _buffers(self) -> dict:
+        """Return the arrays in memory, keyed by name."""
+        return {
+            **self._columns,
+            "label_counts": self._label_counts,
+            "linked_coords": self._linked_coords,
+            "artifact_scores": self._artifact_scores,
+        }
+
+    def _spill(self) -> None:
+        """Append the rows in memory to the spill files, which frees their rows."""
+        if self._spill_tmp is None:
+            self._spill_tmp = tempfile.TemporaryDirectory(
+                prefix="tmp.patho-pix.metadata.", dir=self.spill_dir
+            )
+        n_filled = self._n_rows - self._n_spilled
+        for name, buffer in self._buffers().items():
+            with open(os.path.join(self._spill_tmp.name, f"{name}.bin"), "ab") as fd:
+                buffer[:n_filled].tofile(fd)
+        self._n_spilled = self._n_rows
+        self._spilled = {}
+
+    def _filled(self, name: str) -> np.ndarray:
+        """Return the filled rows of the array ``name``: a view of the array in memory
+        if nothing is spilled, else a memory map of its spill file, once the rows in
+        memory are spilled too."""
+        if not self._n_spilled:
+            return self._buffers()[name][: self._n_rows]
+        if self._n_rows > self._n_spilled:
+            self._spill()
+        return self._spilled_array(name)
+
+    def _spilled_array(self, name: str) -> np.ndarray:
+        if name not in self._spilled:
+            buffer = self._buffers()[name]
+            shape = (self._n_spilled, *buffer.shape[1:])
+            if buffer.itemsize * np.prod(shape, dtype=np.int64) == 0:
+                # Empty files cannot be memory mapped
+                self._spilled[name] = np.empty(shape, dtype=buffer.dtype)
+            else:
+                self._spilled[name] = np.memmap(
+                    os.path.join(self._spill_tmp.name, f"{name}.bin"),
+                    dtype=buffer.dtype,
+                    mode="r",
+                    shape=shape,
+                )
+        return self._spilled[name]
+
+    def _value(self, name: str, row: int):
+        """Return the value of column ``name`` at ``row``, in memory or spilled."""
+        if row >= self._n_spilled:
+            return self._columns[name][row - self._n_spilled]
+        return self._spilled_array(name)[row]
+
+    def _row(self, filename: str) -> Optional[int]:
+        """Return the row of ``filename``, parsing the tile counter it contains."""
+        start = len(self.prefix) + len("tile_")
+        if not filename.startswith(f"{self.prefix}tile_"):
+            return None
+        counter = filename[start:].split("_", 1)[0]
+        if not counter.isdigit() or int(counter) >= self._n_rows:
+            return None
+        row = int(counter)
+        return row if self.filename(row) == filename else None
+
+
+def _import_pyarrow():
+    try:
+        # Third Party
+        import pyarrow
+    except ImportError:  # pragma: no cover
+        raise ModuleNotFoundError("Parquet and Feather export require the pyarrow package to be installed.")
+    return pyarrow
+
+
+def _table_io(path: str):
+    """Return the functions writing and reading a pyarrow table at ``path``, in the
+    format given by its extension."""
+    _import_pyarrow()
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        # Third Party
+        import pyarrow.parquet as pq
+        return pq.write_table, pq.read_table
+    if extension == ".feather":
+        # Third Party
+        import pyarrow.feather as feather
+        return feather.write_feather, feather.read_table
+    raise ValueError(f"Unknown metadata file format {extension!r}, use .npz, .parquet or .feather")
@@ -0,0 +1,294 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import os
+from collections import Counter, OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# Third Party
+import numpy as np
+from histolab.slide import IMG_DOWNSAMPLE_MODE, IMG_UPSAMPLE_MODE, Slide
+from histolab.types import CoordinatePair
+from PIL import Image
+
+# patho_pix
+from patho_pix.utils.custom_tiler import AwesomeTiler
+from patho_pix.utils.superblocks import SuperblockReader
+from patho_pix.utils.writers import DirectoryWriter
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+GRID_POLICIES = ("concentric", "aligned")
+
+
+class _Scale(NamedTuple):
+    """Linked scale prepared for a slide."""
+
+    name: str
+    # Level 0 pixels per tile pixel, level read and size of the region read there
+    factor: float
+    level: int
+    read_size: Tuple[int, int]
+    # Level 0 (width, height) covered by a tile
+    footprint: Tuple[int, int]
+
+
+# ---------------------------------------------------- #
+#                 Multi-Scale GridTiler                #
+# ---------------------------------------------------- #
+class MultiScaleTiler(AwesomeTiler):
+    """Extractor of linked tiles at several levels or mpp, from a single grid.
+
+    The grid, the tissue check, the mask and the sampling of ``AwesomeTiler`` are
+    computed once, at the first scale of ``levels`` or ``mpps``. Every saved tile
+    gets one linked tile of ``tile_size`` pixels at each other scale, read right
+    after it, and all of them are written under the same filename and metadata row:
+    the "image" and "mask" streams hold the tiles of the first scale and the
+    "image@{scale}" and "mask@{scale}" streams (e.g. "image@level2") the linked
+    tiles, which the default writer saves in a ``{scale}`` subdirectory of the
+    ``processed_path`` of the slides. The level 0 coordinates of the linked tiles
+    are the ``linked_coordinates`` of the returned metadata.
+
+    Linked tiles at a level are read by superblocks, and with the "aligned" policy a
+    tile shared by consecutive tiles is read once. Parts of linked tiles outside of
+    the slide are transparent, as openslide returns them.
+
+    Arguments
+    ---------
+    tile_size : Tuple[int, int]
+        (width, height) of the tiles at every scale.
+    levels : Sequence[int], optional
+        Levels of the tiles, the grid is computed at the first one.
+    mpps : Sequence[float], optional
+        Micron per pixel resolutions of the tiles, instead of ``levels``. The grid
+        is computed at the first one, as an ``AwesomeTiler`` with ``mpp``; linked
+        tiles are read at the closest finer level and resized.
+    grid : str, {"concentric", "aligned"}
+        Placement of the linked tiles: centred on the tile ("concentric", i.e. the
+        context of the tile), or the tile of a grid of the linked scale anchored at
+        the slide origin which contains the centre of the tile ("aligned"). Default
+        is "concentric".
+    **kwargs
+        Other arguments of ``AwesomeTiler``, e.g. ``tissue_percent``, ``mask_mode``
+        or ``sampler``.
+    """
+
+    def __init__(
+        self,
+        tile_size: Tuple[int, int],
+        levels: Optional[Sequence[int]] = None,
+        mpps: Optional[Sequence[float]] = None,
+        grid: str = "concentric",
+        **kwargs,
+    ):
+        if (levels is None) == (mpps is None):
+            raise ValueError("Give the scales of the tiles as either levels or mpps")
+        scales = list(levels if levels is not None else mpps)
+        if not scales:
+            raise ValueError("At least one level or mpp is needed")
+        if grid not in GRID_POLICIES:
+            raise ValueError(f"grid must be one of {GRID_POLICIES} ({grid})")
+        if levels is not None:
+            super().__init__(tile_size, level=levels[0], **kwargs)
+        else:
+            super().__init__(tile_size, mpp=mpps[0], **kwargs)
+        self.levels = None if levels is None else list(levels)
+        self.mpps = None if mpps is None else list(mpps)
+        self.grid_policy = grid
+        self._scales: List[_Scale] = []
+
+    # ------- implementation helpers -------
+
+    def _prepare(self, wsi_img: Slide) -> None:
+        super()._prepare(wsi_img)
+        self._scales = [
+            self._scale(wsi_img, name, scale)
+            for name, scale in zip(self._linked_names(), self._linked_scales())
+        ]
+
+    def _linked_scales(self) -> list:
+        return (self.levels if self.levels is not None else self.mpps)[1:]
+
+    def _linked_names(self) -> List[str]:
+        if self.levels is not None:
+            return [f"level{level}" for level in self._linked_scales()]
+        return [f"mpp{mpp:g}" for mpp in self._linked_scales()]
+
+    def _scale(
+        self, slide: Slide, name: str, scale, factor: Optional[float] = None
+    ) -> _Scale:
+        """Prepare a linked level or mpp of ``slide``. The mask slide reuses the
+        ``factor`` of the image slide for mpp scales."""
+        tile_size = self.final_tile_size
+        downsamples = slide._wsi.level_downsamples
+        if self.levels is not None:
+            level = scale if scale >= 0 else slide._remap_level(scale)
+            factor = downsamples[level]
+            read_size = tuple(tile_size)
+        else:
+            if factor is None:
+                factor = scale / slide.base_mpp
+            level = slide._wsi.get_best_level_for_downsample(factor)
+            read_size = tuple(
+                max(int(round(side * factor / downsamples[level])), 1) for side in tile_size
+            )
+        footprint = tuple(int(round(side * factor)) for side in tile_size)
+        return _Scale(name, factor, level, read_size, footprint)
+
+    def _linked_coordinates(self, coords: CoordinatePair) -> np.ndarray:
+        """Level 0 coordinates of the linked tiles of the tile at ``coords``."""
+        center = np.array(
+            [(coords.x_ul + coords.x_br) // 2, (coords.y_ul + coords.y_br) // 2]
+        )
+        linked_coords = np.empty((len(self._scales), 4), dtype=np.int64)
+        for position, scale in enumerate(self._scales):
+            footprint = np.array(scale.footprint)
+            if self.grid_policy == "concentric":
+                upper_left = center - footprint // 2
+            else:
+                upper_left = center // footprint * footprint
+            linked_coords[position] = [*upper_left, *(upper_left + footprint)]
+        return linked_coords
+
+    def _linked_readers(
+        self,
+        wsi_img: Slide,
+        wsi_label: Optional[Slide],
+        candidates: List[Tuple[int, CoordinatePair]],
+    ) -> list:
+        """Readers of the image and mask tiles of every linked scale."""
+        linked_coords = [self._linked_coordinates(coords) for _, coords in candidates]
+        readers = []
+        for position, (scale, value) in enumerate(
+            zip(self._scales, self._linked_scales())
+        ):
+            coordinates = [
+                CoordinatePair(*map(int, tile_coords[position]))
+                for tile_coords in linked_coords
+            ]
+            streams = {"image": _LinkedReader(self, wsi_img, scale, coordinates)}
+            if wsi_label is not None:
+                transform = None if self.mask_mode == "rgb" else self._mask_classes
+                mask_scale = self._scale(wsi_label, scale.name, value, scale.factor)
+                streams["mask"] = _LinkedReader(
+                    self, wsi_label, mask_scale, coordinates, transform, mask=True
+                )
+            readers.append(streams)
+        return readers
+
+    def _read_linked_tiles(
+        self, coords: CoordinatePair, readers: Optional[list]
+    ) -> Dict[str, Tuple[Image.Image, dict]]:
+        linked = {}
+        with self.stats.time("read_linked"):
+            for scale, tile_coords, streams in zip(
+                self._scales, self._linked_coordinates(coords), readers
+            ):
+                tile_coords = CoordinatePair(*map(int, tile_coords))
+                for stream, reader in streams.items():
+                    pixels = reader.read(tile_coords)
+                    if stream == "mask" and self.mask_mode != "rgb":
+                        image, options = self._mask_image_from_classes(pixels)
+                    else:
+                        image, options = Image.fromarray(pixels), {}
+                    linked[f"{stream}@{scale.name}"] = (image, options)
+                    self.stats.count("read_bytes", pixels.nbytes)
+        return linked
+
+    def _default_writer(
+        self, wsi_img: Slide, wsi_label: Optional[Slide]
+    ) -> DirectoryWriter:
+        """Return a writer saving each tile in the ``processed_path`` of its slide and
+        each linked tile in a subdirectory named after its scale."""
+        writer = super()._default_writer(wsi_img, wsi_label)
+        slides = {"image": wsi_img, "mask": wsi_label}
+        streams = list(writer.directories)
+        for name in self._linked_names():
+            for stream in streams:
+                linked_stream = f"{stream}@{name}"
+                writer.directories[linked_stream] = os.path.join(
+                    slides[stream].processed_path, name
+                )
+                if stream in writer.extensions:
+                    writer.extensions[linked_stream] = writer.extensions[stream]
+        return writer
+
+    def _manifest_params(self, wsi_img, wsi_label, extraction_mask) -> dict:
+        params = super()._manifest_params(wsi_img, wsi_label, extraction_mask)
+        params["scales"] = [self.levels, self.mpps, self.grid_policy]
+        return params
+
+
+class _LinkedReader:
+    """Read the tiles of one slide at one linked scale, in grid order.
+
+    Tiles at a level are sliced from superblocks; tiles at an mpp are read at the
+    closest finer level and resized, with the nearest neighbour for masks. Tiles
+    linked to several tiles of ``coordinates`` (one per candidate tile, in grid
+    order) are kept until their last use, within ``superblock_bytes``, so that they
+    are read once.
+    """
+
+    def __init__(self, tiler, slide, scale, coordinates, transform=None, mask=False):
+        self.slide = slide
+        self.scale = scale
+        self.tile_size = tuple(tiler.final_tile_size)
+        self.transform = transform
+        self.mask = mask
+        self.stats = tiler.stats
+        self._superblocks = None
+        superblock_bytes = tiler._superblock_bytes()
+        if scale.read_size == self.tile_size and superblock_bytes > 0:
+            self._superblocks = SuperblockReader(
+                slide,
+                scale.level,
+                self.tile_size,
+                list(dict.fromkeys(coordinates)),
+                superblock_bytes,
+                transform,
+            )
+        self._uses = Counter(coordinates)
+        self._cache = OrderedDict()
+        tile_bytes = 4 * self.tile_size[0] * self.tile_size[1]
+        self._max_cached = max(superblock_bytes // tile_bytes, 1)
+
+    def read(self, coords: CoordinatePair) -> np.ndarray:
+        pixels = self._cache.pop(coords, None)
+        if pixels is None:
+            pixels = self._read(coords)
+        self._uses[coords] -= 1
+        if self._uses[coords] > 0:
+            # Copied out of its superblock, which is not kept alive by the cache
+            self._cache[coords] = pixels if pixels.base is None else pixels.copy()
+            if len(self._cache) > self._max_cached:
+                self._cache.popitem(last=False)
+        return pixels
+
+    def _read(self, coords: CoordinatePair) -> np.ndarray:
+        if self._superblocks is not None:
+            n_reads = self._superblocks.n_reads
+            pixels = self._superblocks.read_array(coords)
+            self.stats.count("linked_reads", self._superblocks.n_reads - n_reads)
+        else:
+            self.stats.count("linked_reads")
+            region = self.slide._wsi.read_region(
+                (coords.x_ul, coords.y_ul), self.scale.level, self.scale.read_size
+            )
+            if region.size != self.tile_size:
+                if self.mask:
+                    resample = Image.NEAREST
+                elif region.size[0] < self.tile_size[0]:
+                    resample = IMG_UPSAMPLE_MODE
+                else:
+                    resample = IMG_DOWNSAMPLE_MODE
+                region = region.resize(self.tile_size, resample)
+            pixels = np.asarray(region)
+            if self.transform is not None:
+                pixels = self.transform(pixels)
+        return pixels
@@ -0,0 +1,124 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+from typing import Dict, Optional
+
+# Third Party
+import numpy as np
+
+
+# ---------------------------------------------------- #
+#              Class-Balanced Tile Sampling            #
+# ---------------------------------------------------- #
+class LabelSampler:
+    """Sampling policy deciding which tiles to write from the label histogram of their
+    mask tile, before they are encoded.
+
+    Every tile is assigned to a class: the most frequent foreground (non
+    ``background``) class of its mask tile if at least ``min_foreground`` of its
+    pixels are foreground, ``background`` otherwise. A tile is written while fewer
+    tiles of its class than the limit of the class have been written: its quota in
+    ``quotas`` if set, else ``max_per_class``. Tiles below ``min_foreground`` are
+    dropped unless ``quotas`` sets a number of background tiles to keep.
+
+    Decisions follow the grid order of the extraction, so the tiles kept for a class
+    whose quota is reached are the first ones of the grid. They do not depend on the
+    number of workers.
+
+    Arguments
+    ---------
+    quotas : Dict[int, int], optional
+        Maximum number of tiles written per class. Default is None.
+    max_per_class : int, optional
+        Maximum number of tiles of the classes missing from ``quotas``. Default is
+        None, no limit.
+    min_foreground : float, optional
+        Minimum fraction (0.0 to 1.0) of foreground pixels of a tile assigned to a
+        foreground class. Default is 0.0.
+    background : int, optional
+        Class value of the background. Default is 0.
+    """
+
+    def __init__(
+        self,
+        quotas: Optional[Dict[int, int]] = None,
+        max_per_class: Optional[int] = None,
+        min_foreground: float = 0.0,
+        background: int = 0,
+    ):
+        if not 0.0 <= min_foreground <= 1.0:
+            raise ValueError(f"min_foreground must be between 0 and 1 ({min_foreground})")
+        self.quotas = {int(label): int(quota) for label, quota in (quotas or {}).items()}
+        self.max_per_class = max_per_class
+        self.min_foreground = min_foreground
+        self.background = background
+        self.counts: Dict[int, int] = {}
+
+    def tile_class(self, label_counts: np.ndarray) -> int:
+        """Return the class of a tile from the pixel count of every class value."""
+        label_counts = np.asarray(label_counts)
+        total = label_counts.sum()
+        foreground = label_counts.copy()
+        if self.background < len(foreground):
+            foreground[self.background] = 0
+        n_foreground = foreground.sum()
+        if n_foreground == 0 or n_foreground < self.min_foreground * total:
+            return self.background
+        return int(np.argmax(foreground))
+
+    def limit(self, tile_class: int) -> Optional[int]:
+        """Return the maximum number of tiles of ``tile_class``, None if unlimited."""
+        if tile_class in self.quotas:
+            return self.quotas[tile_class]
+        if tile_class == self.background and self.min_foreground > 0:
+            return 0
+        return self.max_per_class
+
+    def rejects(self, label_counts: np.ndarray) -> bool:
+        """Whether the tile is dropped whatever the tiles written before, i.e. the
+        limit of its class is 0. Does not update the counts."""
+        return self.limit(self.tile_class(label_counts)) == 0
+
+    def accept(self, label_counts: np.ndarray) -> bool:
+        """Decide whether the tile is written, and count it if so."""
+        tile_class = self.tile_class(label_counts)
+        limit = self.limit(tile_class)
+        if limit is not None and self.counts.get(tile_class, 0) >= limit:
+            return False
+        self.counts[tile_class] = self.counts.get(tile_class, 0) + 1
+        return True
+
+    def add(self, label_counts: np.ndarray) -> None:
+        """Count a tile written before, e.g. recorded in a manifest."""
+        tile_class = self.tile_class(label_counts)
+        self.counts[tile_class] = self.counts.get(tile_class, 0) + 1
+
+    def reset(self) -> None:
+        """Forget the tiles counted so far."""
+        self.counts = {}
+
+    def params(self) -> dict:
+        """Return the settings of the policy, e.g. for a manifest."""
+        return {
+            "quotas": sorted(self.quotas.items()),
+            "max_per_class": self.max_per_class,
+            "min_foreground": self.min_foreground,
+            "background": self.background,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"LabelSampler(quotas={self.quotas}, max_per_class={self.max_per_class}, "
+            f"min_foreground={self.min_foreground}, background={self.background})"
+        )
+
+
+def label_histogram(classes: np.ndarray, n_classes: int) -> np.ndarray:
+    """Return the number of pixels of every class value ``0..n_classes - 1`` of a
+    class array. Values from ``n_classes`` on are not counted."""
+    return np.bincount(classes.ravel(), minlength=n_classes)[:n_classes].astype(np.uint32)
@@ -0,0 +1,203 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+from __future__ import annotations
+
+# Standard Library
+from typing import (TYPE_CHECKING, Callable, Dict, List, Optional, Sequence,
+                    Tuple)
+
+# Third Party
+import numpy as np
+from PIL import Image
+
+if TYPE_CHECKING:
+    # Third Party
+    from histolab.slide import Slide
+    from histolab.types import CoordinatePair
+
+# patho_pix
+from patho_pix.utils.sampling import label_histogram
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+# Default size of the RGBA pixels of one superblock
+SUPERBLOCK_BYTES = 32 << 20
+
+
+# ---------------------------------------------------- #
+#                 Superblock Tile Reader               #
+# ---------------------------------------------------- #
+class SuperblockReader:
+    """Read the tiles of a slide from larger regions, each read with a single call.
+
+    Consecutive tiles of ``coordinates`` in the same grid column (same x, y increasing
+    by at most one tile height, overlapping tiles included) are grouped into a
+    superblock: the region spanning them is read once from the slide, and every tile
+    is a slice of it. A superblock holds at most ``max_bytes`` of RGBA pixels, the
+    number of tiles per superblock adapts to the tile size and overlap. Only the last
+    superblock read is kept in memory.
+
+    At levels above 0, tiles are only grouped when their offset in the superblock is
+    a multiple of the integer level downsample, so that every tile has exactly the
+    pixels of its own ``read_region`` call. Tiles not grouped are read on their own.
+
+    Arguments
+    ---------
+    slide : Slide
+        Slide from which to read the tiles.
+    level : int
+        Level (non negative) from which to read the tiles.
+    tile_size : Tuple[int, int]
+        (width, height) of the tiles at ``level``.
+    coordinates : Sequence[CoordinatePair]
+        Coordinates at level 0 of the tiles, in reading order.
+    max_bytes : int, optional
+        Maximum size of the RGBA pixels of a superblock. Default is 32 MiB.
+    transform : Callable[[np.ndarray], np.ndarray], optional
+        Applied once to the (height, width, 4) RGBA array of every superblock, e.g.
+        to map mask colours to classes. Default is None.
+    """
+
+    def __init__(
+        self,
+        slide: Slide,
+        level: int,
+        tile_size: Tuple[int, int],
+        coordinates: Sequence[CoordinatePair],
+        max_bytes: int = SUPERBLOCK_BYTES,
+        transform: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    ):
+        self.slide = slide
+        self.level = level
+        self.tile_size = tuple(tile_size)
+        self.transform = transform
+        self.n_reads = 0
+        downsample = slide._wsi.level_downsamples[level]
+        self._downsample = int(downsample) if float(downsample).is_integer() else None
+        self._blocks, self._block_of = self._plan(coordinates, max_bytes)
+        self._current_index = None
+        self._current = None
+        self._row_counts = None
+
+    def read_array(self, coords: CoordinatePair) -> np.ndarray:
+        """Return the (height, width, ...) array of the tile at ``coords``: a view of
+        its (transformed) superblock, or of its own region if it is not grouped."""
+        index = self._block_of.get((coords.x_ul, coords.y_ul))
+        if index is None:
+            return self._read((coords.x_ul, coords.y_ul), self.tile_size)
+        if index != self._current_index:
+            x_ul, y_ul, height = self._blocks[index]
+            self._current = self._read((x_ul, y_ul), (self.tile_size[0], height))
+            self._current_index = index
+        row = (coords.y_ul - self._blocks[index][1]) // self._downsample
+        return self._current[row:row + self.tile_size[1]]
+
+    def read_image(self, coords: CoordinatePair) -> Image.Image:
+        """Return the tile at ``coords`` as the RGBA image ``read_region`` returns.
+        Requires no ``transform``."""
+        return Image.fromarray(self.read_array(coords))
+
+    def label_counts(
+        self,
+        coords: CoordinatePair,
+        n_classes: int,
+        classes: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    ) -> np.ndarray:
+        """Return the number of pixels of every class value ``0..n_classes - 1`` of
+        the tile at ``coords``.
+
+        The class values are those of the (transformed) superblock, or the ones
+        ``classes`` returns for it. Pixels are counted once per superblock, row by
+        row, and the counts of every tile are the difference of two cumulated rows.
+        """
+        index = self._block_of.get((coords.x_ul, coords.y_ul))
+        if index is None:
+            tile = self.read_array(coords)
+            return label_histogram(tile if classes is None else classes(tile), n_classes)
+        self.read_array(coords)
+        if self._row_counts is None or self._row_counts[0] != index:
+            block = self._current if classes is None else classes(self._current)
+            self._row_counts = (index, *_cumulated_row_counts(block))
+        _, present, cumulated = self._row_counts
+        row = (coords.y_ul - self._blocks[index][1]) // self._downsample
+        counts = np.zeros(n_classes, dtype=np.uint32)
+        in_range = present < n_classes
+        counts[present[in_range]] = (
+            cumulated[row + self.tile_size[1]] - cumulated[row]
+        )[in_range]
+        return counts
+
+    # ------- implementation helpers -------
+
+    def _read(self, location: Tuple[int, int], size: Tuple[int, int]) -> np.ndarray:
+        self.n_reads += 1
+        region = np.asarray(self.slide._wsi.read_region(location, self.level, size))
+        return region if self.transform is None else self.transform(region)
+
+    def _plan(
+        self, coordinates: Sequence[CoordinatePair], max_bytes: int
+    ) -> Tuple[List[Tuple[int, int, int]], Dict[Tuple[int, int], int]]:
+        """Group the coordinates into superblocks.
+
+        Returns the (x_ul, y_ul, height at ``level``) of every superblock and the
+        superblock index of the (x_ul, y_ul) of every grouped tile.
+        """
+        blocks, block_of = [], {}
+        if self._downsample is None:
+            return blocks, block_of
+        tile_width, tile_height = self.tile_size
+        # Rows of a superblock at level, and level 0 gap between two grouped tiles
+        max_rows = max_bytes // (4 * tile_width)
+        max_step = tile_height * self._downsample
+        block, members = None, []
+
+        def close():
+            if len(members) > 1:
+                for member in members:
+                    block_of[member] = len(blocks)
+                blocks.append(tuple(block))
+
+        for coords in coordinates:
+            if not self.slide._has_valid_coords(coords):
+                continue
+            x_ul, y_ul = int(coords.x_ul), int(coords.y_ul)
+            if block is not None:
+                offset = y_ul - block[1]
+                rows = offset // self._downsample + tile_height
+                if (
+                    x_ul == block[0]
+                    and 0 < y_ul - members[-1][1] <= max_step
+                    and offset % self._downsample == 0
+                    and rows <= max_rows
+                ):
+                    block[2] = rows
+                    members.append((x_ul, y_ul))
+                    continue
+                close()
+            block, members = [x_ul, y_ul, tile_height], [(x_ul, y_ul)]
+        if block is not None:
+            close()
+        return blocks, block_of
+
+
+def _cumulated_row_counts(classes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the class values present in a (height, width) uint8 class array and the
+    (height + 1, n_present) number of pixels of each of them in the rows above every
+    row."""
+    present = np.flatnonzero(np.bincount(classes.ravel(), minlength=256))
+    compact = np.zeros(256, dtype=np.int32)
+    compact[present] = np.arange(len(present))
+    height = classes.shape[0]
+    row_offsets = np.arange(height, dtype=np.int32)[:, np.newaxis] * len(present)
+    row_counts = np.bincount(
+        (compact[classes] + row_offsets).ravel(), minlength=height * len(present)
+    ).reshape(height, len(present))
+    cumulated = np.zeros((height + 1, len(present)), dtype=np.int64)
+    np.cumsum(row_counts, axis=0, out=cumulated[1:])
+    return present, cumulated
@@ -0,0 +1,214 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+from typing import Optional, Tuple, Union
+
+# Third Party
+import numpy as np
+from PIL import Image
+
+# ---------------------------------------------------- #
+#                    Configuration                     #
+# ---------------------------------------------------- #
+BACKENDS = ("numpy", "torch")
+# Fixed point weights of the ITU-R 601-2 luma transform of Pillow's "L" conversion
+LUMA_WEIGHTS = (19595, 38470, 7471)
+
+
+# ---------------------------------------------------- #
+#                Batched Tissue Scoring                #
+# ---------------------------------------------------- #
+class TissueScorer:
+    """Tissue check of stacks of tiles, in one vectorized pass per stack.
+
+    A faster approximation of histolab's ``Tile.has_enough_tissue``, which filters
+    every tile on its own (grayscale, Otsu threshold of the tile, dilation, hole
+    filling). The scorer compares the grayscale of all the pixels of a stack with a
+    single threshold, fixed or fitted by ``fit`` on the thumbnail of the slide (Otsu),
+    dilates the tissue with a disk of radius ``dilation`` and returns the fraction of
+    tissue pixels of every tile. Transparent pixels, outside of the slide, are not
+    tissue. Tiles almost white or with a grayscale variance of at most
+    ``min_variance`` are rejected as by histolab.
+
+    Arguments
+    ---------
+    threshold : float, optional
+        Grayscale value (0-255) below which pixels are tissue. Default is None, the
+        threshold is fitted on the slide thumbnail by ``fit``.
+    dilation : int, optional
+        Radius in pixels of the disk dilating the tissue, 0 disables the dilation.
+        Default is 2, as histolab.
+    min_variance : float, optional
+        Minimum grayscale variance of a tile with enough tissue. Default is 0.1, as
+        histolab.
+    batch_size : int, optional
+        Number of tiles scored at once by ``AwesomeTiler``. Default is 64.
+    backend : str, {"numpy", "torch"}
+        "numpy" dilates with SciPy; "torch" runs every step on the CPU with torch's
+        thread pool. Default is "numpy".
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        dilation: int = 2,
+        min_variance: float = 0.1,
+        batch_size: int = 64,
+        backend: str = "numpy",
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, use one of {BACKENDS}")
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be greater than 0 ({batch_size})")
+        self.threshold = threshold
+        self.dilation = dilation
+        self.min_variance = min_variance
+        self.batch_size = batch_size
+        self.backend = backend
+        self.slide_threshold: Optional[float] = None
+
+    def fit(self, thumbnail: Union[Image.Image, np.ndarray]) -> "TissueScorer":
+        """Fit the slide-level threshold (Otsu) to the thumbnail of a slide and return
+        the scorer. Without effect if ``threshold`` is set."""
+        if self.threshold is None:
+            # Third Party
+            from skimage.filters import threshold_otsu
+
+            pixels = np.asarray(thumbnail)
+            gray = _grayscale(pixels)
+            if pixels.ndim == 3 and pixels.shape[-1] == 4:
+                gray = gray[pixels[..., 3] > 0]
+            self.slide_threshold = float(threshold_otsu(gray))
+        return self
+
+    def tissue_ratio(self, tiles: np.ndarray) -> np.ndarray:
+        """Return the fraction of tissue pixels of every tile of a (n, height, width,
+        channels) uint8 RGB or RGBA stack."""
+        return self.score(tiles, 0.0)[1]
+
+    def score(
+        self, tiles: np.ndarray, tissue_percent: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Check the tissue of a stack of tiles.
+
+        Parameters
+        ----------
+        tiles : np.ndarray
+            (n, height, width, channels) uint8 RGB or RGBA tiles.
+        tissue_percent : float
+            Number between 0.0 and 100.0, the minimum percentage of tissue of the
+            tiles with enough tissue.
+
+        Returns
+        -------
+        np.ndarray
+            (n,) whether every tile has enough tissue.
+        np.ndarray
+            (n,) fraction of tissue pixels of every tile.
+        """
+        tiles = np.asarray(tiles)
+        threshold = self._threshold()
+        if self.backend == "torch":
+            gray_stats, ratios = self._score_torch(tiles, threshold)
+        else:
+            # Third Party
+            from scipy import ndimage
+            from skimage.morphology import disk
+
+            gray = _grayscale(tiles)
+            tissue = gray < threshold
+            if tiles.shape[-1] == 4:
+                tissue &= tiles[..., 3] > 0
+            if self.dilation > 0:
+                tissue = ndimage.binary_dilation(
+                    tissue, structure=disk(self.dilation)[np.newaxis].astype(bool)
+                )
+            ratios = tissue.mean(axis=(1, 2))
+            # Moments without float copies of the stack
+            n_pixels = gray[0].size
+            mean = gray.sum(axis=(1, 2), dtype=np.float64) / n_pixels
+            squares = np.einsum("nhw,nhw->n", gray, gray, dtype=np.float64, casting="unsafe")
+            gray_stats = mean, np.sqrt(np.maximum(squares / n_pixels - mean ** 2, 0))
+        mean, std = gray_stats
+        almost_white = (mean / 255 > 0.9) & (std / 255 < 0.09)
+        enough = (
+            ~almost_white
+            & (std ** 2 > self.min_variance)
+            & (ratios * 100 > tissue_percent)
+        )
+        return enough, ratios
+
+    def params(self) -> dict:
+        """Return the settings of the scorer, e.g. for a manifest."""
+        return {
+            "threshold": self.threshold,
+            "dilation": self.dilation,
+            "min_variance": self.min_variance,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"TissueScorer(threshold={self.threshold}, dilation={self.dilation}, "
+            f"min_variance={self.min_variance}, batch_size={self.batch_size}, "
+            f"backend={self.backend!r})"
+        )
+
+    # ------- implementation helpers -------
+
+    def _threshold(self) -> float:
+        if self.threshold is not None:
+            return self.threshold
+        if self.slide_threshold is None:
+            raise ValueError("Set the threshold of the TissueScorer or fit it to a slide")
+        return self.slide_threshold
+
+    def _score_torch(
+        self, tiles: np.ndarray, threshold: float
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]:
+        # Third Party
+        from skimage.morphology import disk
+
+        torch = _import_torch()
+        pixels = torch.from_numpy(np.ascontiguousarray(tiles))
+        weights = torch.tensor(LUMA_WEIGHTS, dtype=torch.int32)
+        gray = ((pixels[..., :3].to(torch.int32) * weights).sum(-1) + 0x8000) >> 16
+        tissue = gray < threshold
+        if tiles.shape[-1] == 4:
+            tissue &= pixels[..., 3] > 0
+        tissue = tissue.to(torch.float32)
+        if self.dilation > 0:
+            kernel = torch.from_numpy(disk(self.dilation).astype(np.float32))
+            tissue = torch.nn.functional.conv2d(
+                tissue[:, None], kernel[None, None], padding=self.dilation
+            )[:, 0].clamp(max=1)
+        gray = gray.to(torch.float64)
+        gray_stats = (
+            gray.mean(dim=(1, 2)).numpy(),
+            gray.std(dim=(1, 2), unbiased=False).numpy(),
+        )
+        return gray_stats, tissue.mean(dim=(1, 2)).to(torch.float64).numpy()
+
+
+def _grayscale(pixels: np.ndarray) -> np.ndarray:
+    """Return the uint8 grayscale of (..., 3 or 4) RGB(A) pixels, as Pillow's "L"
+    conversion. 2D arrays are returned as grayscale."""
+    if pixels.ndim == 2:
+        return pixels.astype(np.uint8, copy=False)
+    r, g, b = (pixels[..., channel].astype(np.uint32) for channel in range(3))
+    return (
+        (r * LUMA_WEIGHTS[0] + g * LUMA_WEIGHTS[1] + b * LUMA_WEIGHTS[2] + 0x8000) >> 16
+    ).astype(np.uint8)
+
+
+def _import_torch():
+    try:
+        # Third Party
+        import torch
+    except ImportError:  # pragma: no cover
+        raise ModuleNotFoundError("The torch backend requires the torch package to be installed.")
+    return torch
@@ -0,0 +1,341 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# ---------------------------------------------------- #
+#                   Library imports                    #
+# ---------------------------------------------------- #
+# Standard Library
+import io
+import json
+import os
+import tarfile
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, Optional, Tuple
+
+# Third Party
+from PIL import Image
+
+INDEX_FILENAME = "index.json"
+
+
+# ---------------------------------------------------- #
+#                  Tile Writer Interface               #
+# ---------------------------------------------------- #
+class TileWriter(ABC):
+    """Destination of the encoded tiles produced by ``AwesomeTiler.extract``.
+
+    Every tile is written once per stream ("image" and, for image + mask extraction,
+    "mask") under its key, the tile filename. Writers are context managers; the caller
+    closes the writers it creates. Writers implementing ``rename`` set ``can_rename``.
+    """
+
+    # Whether ``rename`` is implemented, checked before merging sharded extractions
+    can_rename = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @abstractmethod
+    def write(self, key: str, stream: str, data: bytes) -> None:
+        """Write the encoded tile ``data`` of ``stream`` under ``key``."""
+        pass  # pragma: no cover
+
+    def verify(self, key: str, stream: str, size: int) -> bool:
+        """Return whether the ``stream`` tile ``key`` is completely written with
+        ``size`` bytes. Used to resume an interrupted extraction; writers that cannot
+        tell return False and the tile is written again."""
+        return False
+
+    def rename(self, key: str, new_key: str) -> None:
+        """Store every stream of the tile ``key`` under ``new_key`` instead, e.g. to
+        renumber the tiles of a sharded extraction. Tiles already renamed are left
+        as they are. Writers implementing it set ``can_rename`` to True."""
+        raise NotImplementedError(f"{type(self).__name__} cannot rename tiles")
+
+    def close(self) -> None:
+        """Flush and release the resources held by the writer."""
+
+
+# ---------------------------------------------------- #
+#             One File per Tile (default)              #
+# ---------------------------------------------------- #
+class DirectoryWriter(TileWriter):
+    """Write every tile as its own file, one directory per stream.
+
+    Arguments
+    ---------
+    directories : Dict[str, str]
+        Output directory of each stream, e.g. the ``processed_path`` of the image and
+        mask slides.
+    extensions : Dict[str, str], optional
+        File extension replacing the extension of the key for the given streams, e.g.
+        ``{"mask": ".png"}`` when masks are encoded in another format than images.
+        Default is None, every file is named after its key.
+    """
+
+    can_rename = True
+
+    def __init__(
+        self, directories: Dict[str, str], extensions: Optional[Dict[str, str]] = None
+    ):
+        self.directories = directories
+        self.extensions = extensions or {}
+
+    def write(self, key: str, stream: str, data: bytes) -> None:
+        os.makedirs(self.directories[stream], exist_ok=True)
+        with open(self.path(key, stream), "wb") as fd:
+            fd.write(data)
+
+    def verify(self, key: str, stream: str, size: int) -> bool:
+        path = self.path(key, stream)
+        return os.path.isfile(path) and os.path.getsize(path) == size
+
+    def rename(self, key: str, new_key: str) -> None:
+        for stream in self.directories:
+            path = self.path(key, stream)
+            if os.path.exists(path):
+                os.replace(path, self.path(new_key, stream))
+
+    def path(self, key: str, stream: str) -> str:
+        """Return the path of the file of the ``stream`` tile ``key``."""
+        if stream in self.extensions:
+            key = os.path.splitext(key)[0] + self.extensions[stream]
+        return os.path.join(self.directories[stream], key)
+
+
+# ---------------------------------------------------- #
+#                   Tar Shard Writer                   #
+# ---------------------------------------------------- #
+class TarShardWriter(TileWriter):
+    """Pack the tiles into sequential tar shards of a bounded size.
+
+    Tiles are stored as ``{stream}/{key}`` members of ``shard-00000.tar``,
+    ``shard-00001.tar``, ... A new shard is started once the current one exceeds
+    ``shard_size`` bytes; all streams of a tile are kept in the same shard. The
+    position of every member is recorded in ``index.json``, so that
+    ``TarShardReader`` can read any tile by key with a single seek.
+
+    Arguments
+    ---------
+    directory : str
+        Output directory of the shards and of the index.
+    shard_size : int, optional
+        Size in bytes after which a new shard is started. Default is 1 GiB.
+    append : bool, optional
+        Whether to keep the shards and index already in ``directory`` and add new
+        shards after them, e.g. to resume an extraction. Default is False, which
+        overwrites them.
+    """
+
+    can_rename = True
+
+    def __init__(self, directory: str, shard_size: int = 1 << 30, append: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shards = []
+        self.index = {}
+        self._tar = None
+        self._last_key = None
+        path_index = os.path.join(directory, INDEX_FILENAME)
+        if append and os.path.exists(path_index):
+            with open(path_index) as fd:
+                index = json.load(fd)
+            self.shards = index["shards"]
+            self.index = index["tiles"]
+
+    def write(self, key: str, stream: str, data: bytes) -> None:
+        if key != self._last_key and (
+            self._tar is None or self._tar.offset >= self.shard_size
+        ):
+            self._next_shard()
+        self._last_key = key
+
+        info = tarfile.TarInfo(f"{stream}/{key}")
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+        # Member data is padded to the tar block size and ends at the current offset
+        padded_size = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        data_offset = self._tar.offset - padded_size
+        self.index.setdefault(key, {})[stream] = [self.shards[-1], data_offset, len(data)]
+
+    def verify(self, key: str, stream: str, size: int) -> bool:
+        location = self.index.get(key, {}).get(stream)
+        if location is None or location[2] != size:
+            return False
+        shard, offset, _ = location
+        if self._tar is not None and shard == self.shards[-1]:
+            self._tar.fileobj.flush()
+        path_shard = os.path.join(self.directory, shard)
+        return os.path.isfile(path_shard) and os.path.getsize(path_shard) >= offset + size
+
+    def rename(self, key: str, new_key: str) -> None:
+        # Only the index is updated, the tar members keep their original name
+        if key in self.index:
+            self.index[new_key] = self.index.pop(key)
+
+    def close(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+        self._write_index()
+
+    def _next_shard(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+            self._write_index()
+        shard_name = f"shard-{len(self.shards):05d}.tar"
+        self.shards.append(shard_name)
+        self._tar = tarfile.open(os.path.join(self.directory, shard_name), "w")
+
+    def _write_index(self) -> None:
+        path_index = os.path.join(self.directory, INDEX_FILENAME)
+        with open(path_index + ".tmp", "w") as fd:
+            json.dump({"shards": self.shards, "tiles": self.index}, fd)
+        os.replace(path_index + ".tmp", path_index)
+
+
+class TarShardReader:
+    """Random access by key to the tiles written by ``TarShardWriter``.
+
+    Arguments
+    ---------
+    directory : str
+        Directory holding the shards and ``index.json``.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILENAME)) as fd:
+            index = json.load(fd)
+        self.shards = index["shards"]
+        self.index = index["tiles"]
+        self._files = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def keys(self):
+        return self.index.keys()
+
+    def location(self, key: str, stream: str = "image") -> Tuple[str, int, int]:
+        """Return the shard, byte offset and size of the ``stream`` tile ``key``."""
+        shard, offset, size = self.index[key][stream]
+        return shard, offset, size
+
+    def read(self, key: str, stream: str = "image") -> bytes:
+        """Return the encoded ``stream`` tile stored under ``key``."""
+        shard, offset, size = self.location(key, stream)
+        if shard not in self._files:
+            self._files[shard] = open(os.path.join(self.directory, shard), "rb")
+        fd = self._files[shard]
+        fd.seek(offset)
+        return fd.read(size)
+
+    def read_image(self, key: str, stream: str = "image") -> Image.Image:
+        """Return the decoded ``stream`` tile stored under ``key``."""
+        image = Image.open(io.BytesIO(self.read(key, stream)))
+        image.load()
+        return image
+
+    def close(self) -> None:
+        for fd in self._files.values():
+            fd.close()
+        self._files = {}
+
+
+# ---------------------------------------------------- #
+#                     Tile Codecs                      #
+# ---------------------------------------------------- #
+class TileCodec:
+    """Image format and encoder options of one stream of tiles.
+
+    Arguments
+    ---------
+    codec : str, {"png", "webp", "jpeg", "tiff"}
+        Image format of the encoded tiles. Default is "png".
+    **options
+        Encoder options passed to ``PIL.Image.Image.save``, e.g. ``compress_level``
+        (0-9) for PNG, ``lossless``, ``quality`` and ``method`` for WebP, ``quality``
+        for JPEG. JPEG, and WebP without ``lossless=True``, are lossy: they are only
+        accepted for image tiles, never for mask tiles.
+    """
+
+    FORMATS = {
+        "png": ("PNG", ".png"),
+        "webp": ("WEBP", ".webp"),
+        "jpeg": ("JPEG", ".jpg"),
+        "tiff": ("TIFF", ".tiff"),
+    }
+
+    def __init__(self, codec: str = "png", **options):
+        codec = codec.lower()
+        codec = {"jpg": "jpeg", "tif": "tiff"}.get(codec, codec)
+        if codec not in self.FORMATS:
+            raise ValueError(f"codec must be one of {tuple(self.FORMATS)} ({codec})")
+        self.codec = codec
+        self.options = options
+
+    @classmethod
+    def from_suffix(cls, suffix: str, **options) -> "TileCodec":
+        """Return the codec of the filename ``suffix``, PNG if the suffix is unknown."""
+        extension = os.path.splitext(suffix)[1] or suffix
+        image_format = Image.registered_extensions().get(extension.lower(), "PNG")
+        for codec, (codec_format, _) in cls.FORMATS.items():
+            if codec_format == image_format:
+                return cls(codec, **options)
+        return cls("png", **options)
+
+    def __repr__(self) -> str:
+        options = "".join(f", {name}={value!r}" for name, value in sorted(self.options.items()))
+        return f"TileCodec({self.codec!r}{options})"
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, TileCodec)
+            and (self.codec, self.options) == (other.codec, other.options)
+        )
+
+    @property
+    def extension(self) -> str:
+        """File extension of the encoded tiles."""
+        return self.FORMATS[self.codec][1]
+
+    @property
+    def lossless(self) -> bool:
+        """Whether decoding gives back the encoded pixels exactly."""
+        if self.codec == "jpeg":
+            return False
+        if self.codec == "webp":
+            return bool(self.options.get("lossless", False))
+        return True
+
+    def matches(self, suffix: str) -> bool:
+        """Return whether the filename ``suffix`` has an extension of this format."""
+        extension = (os.path.splitext(suffix)[1] or suffix).lower()
+        return Image.registered_extensions().get(extension) == self.FORMATS[self.codec][0]
+
+    def encode(self, image: Image.Image, options: Optional[dict] = None) -> bytes:
+        """Encode ``image``. ``options`` are default encoder options, overridden by the
+        options of the codec."""
+        if self.codec == "jpeg" and image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.FORMATS[self.codec][0], **{**(options or {}), **self.options})
+        return buffer.getvalue()
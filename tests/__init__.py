@@ -0,0 +1,10 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# Standard Library
+import os
+
+# The tests neither read nor fill the slide cache of the user, cached masks of an
+# earlier run would hide regressions; tests/test_cache.py uses caches of its own
+os.environ["PATHO_PIX_CACHE_DIR"] = "off"
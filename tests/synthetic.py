@@ -0,0 +1,62 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import os
+
+# Third Party
+import numpy as np
+from PIL import Image
+
+
+# ---------------------------------------------------- #
+#              Synthetic Slide + Mask Pair             #
+# ---------------------------------------------------- #
+def create_synthetic_pair(directory, width=2500, height=3000, seed=0):
+    """Write an H&E-like slide with an elliptic tissue blob and its label mask.
+
+    The slide can be tiled offline, without downloading any data. The left half of the
+    tissue is labelled white in the mask, everything else is black.
+
+    Returns the paths of the image and the mask TIFF files.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width]
+    blob = ((yy - height / 2) / (height / 3)) ** 2 + ((xx - width / 2) / (width / 3)) ** 2 < 1
+
+    img = np.full((height, width, 3), 235, dtype=np.uint8)
+    stain = rng.integers(0, 60, (int(blob.sum()), 3)) + np.array([150, 60, 140])
+    img[blob] = stain.astype(np.uint8)
+    mask = np.zeros((height, width, 3), dtype=np.uint8)
+    mask[blob & (xx < width // 2)] = 255
+
+    path_img = os.path.join(directory, "image.tiff")
+    path_mask = os.path.join(directory, "mask.tiff")
+    Image.fromarray(img).save(path_img)
+    Image.fromarray(mask).save(path_mask)
+    return path_img, path_mask
+
+
+# ---------------------------------------------------- #
+#                  Synthetic H&E Tile                  #
+# ---------------------------------------------------- #
+def create_synthetic_tile(size=256, seed=0, shift=(0, 0, 0)):
+    """Return an H&E-like RGB PIL tile with hematoxylin nuclei on eosin stroma.
+
+    ``shift`` is added to every tissue pixel to simulate a different staining.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    tissue = ((yy - size / 2) ** 2 + (xx - size / 2) ** 2) < (0.4 * size) ** 2
+
+    img = np.full((size, size, 3), 240.0)
+    img[tissue] = np.array([230, 150, 200]) + rng.normal(0, 12, (int(tissue.sum()), 3))
+    for cy, cx in rng.integers(int(0.2 * size), int(0.8 * size), (size // 8, 2)):
+        nucleus = ((yy - cy) ** 2 + (xx - cx) ** 2) < (size / 40) ** 2
+        img[nucleus & tissue] = np.array([90, 60, 150]) + rng.normal(0, 10, (int((nucleus & tissue).sum()), 3))
+    img[tissue] += np.array(shift)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
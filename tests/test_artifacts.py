@@ -0,0 +1,131 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import os
+import tempfile
+import unittest
+
+# Third Party
+import numpy as np
+from histolab.masks import TissueMask
+from PIL import Image, ImageFilter
+
+# patho_pix
+from patho_pix.dataset import TileDataset
+from patho_pix.io import load_wsi
+from patho_pix.utils import ArtifactDetector, AwesomeTiler, TileMetadata
+from patho_pix.utils.artifacts import ARTIFACT_SCORES
+from tests.synthetic import create_synthetic_pair, create_synthetic_tile
+
+
+# ---------------------------------------------------- #
+#              Unittest: Artifact Detection            #
+# ---------------------------------------------------- #
+class ArtifactDetectorTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        path_img, _ = create_synthetic_pair(self.tmp_data.name, width=2000, height=2000)
+        # Blue pen stroke across the tissue and an out of focus band below it
+        with Image.open(path_img) as image:
+            pixels = np.array(image)
+        pixels[900:940, 600:1400] = (40, 80, 170)
+        band = Image.fromarray(pixels[1200:1700]).filter(ImageFilter.GaussianBlur(6))
+        pixels[1200:1700] = np.asarray(band)
+        self.path_img = os.path.join(self.tmp_data.name, "artifacts.tiff")
+        Image.fromarray(pixels).save(self.path_img)
+
+    def _extract(self, tile_dir=None, **kwargs):
+        if tile_dir is None:
+            tmp_tiles = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+            self.addCleanup(tmp_tiles.cleanup)
+            tile_dir = tmp_tiles.name
+        wsi = load_wsi(self.path_img, tile_dir)
+        workers = kwargs.pop("workers", 1)
+        manifest = kwargs.pop("manifest", None)
+        tiler = AwesomeTiler(tile_size=(256, 256), tissue_percent=50.0, **kwargs)
+        metadata = tiler.extract(wsi, extraction_mask=TissueMask(), workers=workers, manifest=manifest)
+        return metadata, tiler
+
+    def test_scores(self):
+        detector = ArtifactDetector()
+        sharp = np.asarray(create_synthetic_tile(128))
+        blurry = np.asarray(create_synthetic_tile(128).filter(ImageFilter.GaussianBlur(4)))
+        pen, fold = sharp.copy(), sharp.copy()
+        pen[40:60] = (50, 140, 90)
+        fold[20:100, 20:100] = (70, 30, 80)
+        scores = detector.score(np.stack([sharp, blurry, pen, fold]))
+        self.assertEqual(scores.shape, (4, len(ARTIFACT_SCORES)))
+        self.assertTrue(np.array_equal(detector.rejections(scores), [
+            [False, False, False], [True, False, False], [False, True, False], [False, False, True],
+        ]))
+        self.assertTrue(np.array_equal(detector.rejects(scores), [False, True, True, True]))
+        # Limits set to None only record the scores
+        self.assertFalse(ArtifactDetector(None, None, None).rejects(scores).any())
+
+        # Transparent pixels are neither pen nor dark, tiles are scored independently
+        rgba = np.zeros((2, 128, 128, 4), dtype=np.uint8)
+        rgba[0, ..., :3], rgba[0, ..., 3] = fold, 255
+        rgba_scores = detector.score(rgba)
+        self.assertTrue(np.allclose(rgba_scores[0], scores[3]))
+        self.assertTrue(np.array_equal(rgba_scores[1], [0.0, 0.0, 0.0]))
+        self.assertTrue(np.allclose(detector.score(rgba[:1]), rgba_scores[:1]))
+        with self.assertRaises(ValueError):
+            ArtifactDetector(max_pen_ratio=5)
+
+    def test_tiler_drops_artifacts(self):
+        reference, _ = self._extract()
+        metadata, tiler = self._extract(artifact_detector=ArtifactDetector(batch_size=8))
+        dropped = set(reference.columns["candidate"]) - set(metadata.columns["candidate"])
+        self.assertTrue(set(metadata.columns["candidate"]) <= set(reference.columns["candidate"]))
+        self.assertEqual(len(dropped), tiler.stats.counters["artifacts"])
+        self.assertGreater(tiler.stats.counters["artifact_focus"], 0)
+        self.assertGreater(tiler.stats.counters["artifact_pen_ratio"], 0)
+        # The dropped tiles are the ones over the pen stroke or in the blurred band
+        coords = reference.columns
+        for row in np.flatnonzero(np.isin(coords["candidate"], list(dropped))):
+            pen = coords["y_ul"][row] < 940 and coords["y_br"][row] > 900
+            blurred = coords["y_ul"][row] < 1700 and coords["y_br"][row] > 1200
+            self.assertTrue(pen or blurred)
+
+        self.assertEqual(metadata.artifacts, list(ARTIFACT_SCORES))
+        self.assertFalse(np.isnan(metadata.artifact_scores).any())
+        self.assertFalse(ArtifactDetector().rejects(metadata.artifact_scores).any())
+        self.assertTrue(np.array_equal(metadata.to_pandas()["focus"], metadata.artifact_scores[:, 0]))
+        self.assertNotIn("focus", reference.to_pandas())
+
+        parallel, _ = self._extract(artifact_detector=ArtifactDetector(batch_size=8), workers=2)
+        self.assertEqual(parallel, metadata)
+        self.assertTrue(np.array_equal(parallel.artifact_scores, metadata.artifact_scores))
+
+        # Scores kept by save / load and in a resumed manifest
+        path_metadata = os.path.join(self.tmp_data.name, "metadata.parquet")
+        metadata.save(path_metadata)
+        loaded = TileMetadata.load(path_metadata)
+        self.assertTrue(np.array_equal(loaded.artifact_scores, metadata.artifact_scores))
+        path_manifest = os.path.join(self.tmp_data.name, "manifest.jsonl")
+        tile_dir = os.path.join(self.tmp_data.name, "tiles")
+        kwargs = dict(tile_dir=tile_dir, manifest=path_manifest)
+        self._extract(artifact_detector=ArtifactDetector(), **kwargs)
+        resumed, tiler = self._extract(artifact_detector=ArtifactDetector(), **kwargs)
+        self.assertEqual(tiler.stats.counters["candidates"], 0)
+        self.assertTrue(np.allclose(resumed.artifact_scores, metadata.artifact_scores))
+        concatenated = TileMetadata.concat([reference, metadata])
+        self.assertEqual(int(np.isnan(concatenated["pen_ratio"]).sum()), len(reference))
+
+    def test_dataset_drops_artifacts(self):
+        tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir.cleanup)
+        wsi = load_wsi(self.path_img, tile_dir.name)
+        kwargs = dict(tile_size=(256, 256), tissue_percent=50.0)
+        reference = [coords.tolist() for _, coords in TileDataset(wsi, **kwargs)]
+        dataset = TileDataset(wsi, artifact_detector=ArtifactDetector(), **kwargs)
+        kept = [coords.tolist() for _, coords in dataset]
+        self.assertGreater(len(kept), 0)
+        self.assertLess(len(kept), len(reference))
+        self.assertTrue(all(coords in reference for coords in kept))
@@ -0,0 +1,37 @@
+# Standard Library
+import tempfile
+import unittest
+
+# Third Party
+import numpy as np
+import openslide
+
+# patho_pix
+from benchmarks.run_benchmarks import compare_results, run_case
+from benchmarks.synthetic_slides import write_synthetic_slide
+
+
+class BenchmarkTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.path_img, self.path_mask = write_synthetic_slide(self.tmp_data.name, size=2048, density=0.3)
+
+    def test_synthetic_pyramidal_slide(self):
+        with openslide.OpenSlide(self.path_img) as slide:
+            self.assertEqual(slide.level_dimensions, ((2048, 2048), (512, 512)))
+            thumbnail = np.asarray(slide.read_region((0, 0), 1, (512, 512)).convert("RGB"))
+        self.assertAlmostEqual((thumbnail[..., 1] < 200).mean(), 0.3, delta=0.05)
+        with openslide.OpenSlide(self.path_mask) as mask:
+            labels = np.asarray(mask.read_region((0, 0), 1, (512, 512)).convert("RGB"))
+        self.assertTrue((labels[:, 256:] == 0).all())
+        self.assertTrue(np.array_equal(labels[:, :256, 0] == 255, thumbnail[:, :256, 1] < 200))
+
+    def test_run_and_compare(self):
+        record = run_case("coordinates", "2048px", dict(path_img=self.path_img, tile_size=(256, 256)))
+        self.assertGreater(record["items"], 0)
+        self.assertGreater(record["peak_rss_mb"], 0)
+        results = {"results": [record]}
+        faster = {"results": [dict(record, throughput=record["throughput"] * 2)]}
+        self.assertEqual(compare_results(results, results), [])
+        self.assertEqual(compare_results(results, faster), [("coordinates", "2048px")])
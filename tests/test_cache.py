@@ -0,0 +1,147 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# Third Party
+import numpy as np
+from histolab.filters import image_filters as imf
+from histolab.masks import TissueMask
+from histolab.slide import Slide
+from histolab.util import (region_coordinates, regions_from_binary_mask,
+                           regions_to_binary_mask, scale_coordinates)
+
+# patho_pix
+from patho_pix.io import load_wsi
+from patho_pix.utils import AwesomeTiler, SlideCache
+from tests.synthetic import create_synthetic_pair
+
+
+class CountingTissueMask(TissueMask):
+    # Class attribute, so that it is not part of the cache key
+    calls = []
+
+    def _mask(self, slide):
+        CountingTissueMask.calls.append(slide._path)
+        return super()._mask(slide)
+
+
+# ---------------------------------------------------- #
+#                 Unittest: Slide Cache                #
+# ---------------------------------------------------- #
+class SlideCacheTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.path_img, _ = create_synthetic_pair(self.tmp_data.name, width=2000, height=1600)
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(self.cache_dir.cleanup)
+        self.cache = SlideCache(self.cache_dir.name)
+        CountingTissueMask.calls.clear()
+
+    def _slide(self, path=None):
+        tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir.cleanup)
+        return load_wsi(path or self.path_img, tile_dir.name)
+
+    def _coordinates(self, slide, cache, extraction_mask=None):
+        tiler = AwesomeTiler(tile_size=(128, 128), cache=cache)
+        tiler._prepare(slide)
+        return list(tiler._grid_coordinates_generator(slide, extraction_mask or CountingTissueMask()))
+
+    def test_grid_matches_histolab_regions(self):
+        slide = self._slide()
+        tiler = AwesomeTiler(tile_size=(128, 128), cache=False)
+        tiler._prepare(slide)
+        binary_mask = TissueMask()(slide)
+        expected = []
+        for region in regions_from_binary_mask(binary_mask):
+            bbox_lvl = scale_coordinates(region_coordinates(region), binary_mask.shape[::-1],
+                                         slide.level_dimensions(0))
+            expected.extend(tiler._grid_coordinates_from_bbox_coordinates(
+                bbox_lvl, slide, regions_to_binary_mask([region], binary_mask.shape)
+            ))
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(self._coordinates(self._slide(), False, TissueMask()), expected)
+        self.assertEqual(self._coordinates(self._slide(), self.cache, TissueMask()), expected)
+        self.assertEqual(self._coordinates(self._slide(), self.cache, TissueMask()), expected)
+
+    def test_hits_across_slides_and_copies(self):
+        reference = self._coordinates(self._slide(), False)
+        self.assertEqual(len(CountingTissueMask.calls), 1)
+        self.assertEqual(self._coordinates(self._slide(), self.cache), reference)
+        self.assertEqual(len(CountingTissueMask.calls), 2)
+        # Same content and date under another name: cache hit, the mask is not computed again
+        path_copy = os.path.join(self.cache_dir.name, "copy", "slide.tiff")
+        os.makedirs(os.path.dirname(path_copy))
+        shutil.copy2(self.path_img, path_copy)
+        self.assertEqual(self._coordinates(self._slide(path_copy), self.cache), reference)
+        self.assertEqual(len(CountingTissueMask.calls), 2)
+        # Rewritten in place with the same size: computed again
+        stat = os.stat(path_copy)
+        os.utime(path_copy, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self._coordinates(self._slide(path_copy), self.cache), reference)
+        self.assertEqual(len(CountingTissueMask.calls), 3)
+
+        thumbnail = self.cache.thumbnail(self._slide())
+        self.assertTrue(np.array_equal(np.asarray(thumbnail), np.asarray(self._slide().thumbnail)))
+
+    def test_masks_use_cached_thumbnail(self):
+        thumbnail = self.cache.thumbnail(self._slide())
+        with mock.patch.object(Slide, "thumbnail", new_callable=mock.PropertyMock) as slide_thumbnail:
+            mask = self.cache.binary_mask(self._slide(), TissueMask())
+        slide_thumbnail.assert_not_called()
+        self.assertTrue(np.array_equal(mask, TissueMask()(self._slide())))
+        self.assertTrue(np.array_equal(np.asarray(self.cache.thumbnail(self._slide())), np.asarray(thumbnail)))
+
+    def test_unwritable_cache(self):
+        reference = self._coordinates(self._slide(), False)
+        # Cache directory below a file: it cannot be created
+        path_file = os.path.join(self.cache_dir.name, "file")
+        open(path_file, "w").close()
+        cache = SlideCache(os.path.join(path_file, "cache"))
+        with self.assertLogs("tiler", "WARNING"):
+            self.assertEqual(self._coordinates(self._slide(), cache), reference)
+        self.assertEqual(cache.size(), 0)
+
+    def test_key_depends_on_mask_parameters(self):
+        slide = self._slide()
+        default_mask = self.cache.binary_mask(slide, TissueMask())
+        n_entries = len(os.listdir(self.cache_dir.name))
+        self.cache.binary_mask(slide, TissueMask())
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), n_entries)
+        otsu_mask = self.cache.binary_mask(slide, TissueMask(imf.RgbToGrayscale(), imf.OtsuThreshold()))
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), n_entries + 1)
+        self.assertEqual(otsu_mask.shape, default_mask.shape)
+
+    def test_size_eviction_and_disabled_cache(self):
+        slide = self._slide()
+        self._coordinates(slide, self.cache)
+        full_size = self.cache.size()
+        self.assertGreater(full_size, 0)
+
+        small_cache = SlideCache(os.path.join(self.cache_dir.name, "small"), max_bytes=full_size // 2)
+        self._coordinates(self._slide(), small_cache)
+        self.assertLessEqual(small_cache.size(), full_size // 2)
+        small_cache.clear()
+        self.assertEqual(small_cache.size(), 0)
+
+        default_dir = os.path.join(self.cache_dir.name, "default")
+        with mock.patch.dict(os.environ, {"PATHO_PIX_CACHE_DIR": default_dir}):
+            self._coordinates(self._slide(), False)
+            self.assertFalse(os.path.exists(default_dir))
+            self._coordinates(self._slide(), True)
+            self.assertEqual(SlideCache.default().size(), full_size)
+        with mock.patch.dict(os.environ, {"PATHO_PIX_CACHE_DIR": "off"}):
+            self.assertIsNone(SlideCache.default())
@@ -0,0 +1,62 @@
+# Standard Library
+import importlib.util
+import os
+import tempfile
+import unittest
+
+# Third Party
+import numpy as np
+from PIL import Image
+
+# patho_pix
+from patho_pix.dataset import TileDataset
+from patho_pix.io import load_mask, load_wsi
+from patho_pix.normalization import StainNormalizer
+from patho_pix.tiling import tile_wsi_mask
+from tests.synthetic import create_synthetic_pair, create_synthetic_tile
+
+
+class TileDatasetTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        path_img, path_mask = create_synthetic_pair(self.tmp_data.name)
+        self.dir_img = os.path.join(self.tmp_data.name, "image")
+        self.dir_mask = os.path.join(self.tmp_data.name, "mask")
+        self.wsi = load_wsi(path_img, self.dir_img)
+        self.mask = load_mask(path_mask, self.dir_mask)
+
+    def test_stream_matches_saved_tiles(self):
+        metadata = tile_wsi_mask(self.wsi, self.mask, tile_size=(256, 256))
+        items = list(TileDataset(self.wsi, self.mask, tile_size=(256, 256), chunk_size=5, prefetch=2))
+        self.assertEqual(len(items), len(metadata))
+        for tile_filename, (image, mask, coords) in zip(metadata, items):
+            self.assertTrue(tile_filename.endswith(f"_{'-'.join(map(str, coords))}.png"))
+            saved_image = np.asarray(Image.open(os.path.join(self.dir_img, tile_filename)).convert("RGB"))
+            saved_mask = np.asarray(Image.open(os.path.join(self.dir_mask, tile_filename)))
+            self.assertTrue(np.array_equal(image, saved_image))
+            self.assertTrue(np.array_equal(mask, saved_mask[..., 0]))
+
+    def test_on_the_fly_normalization(self):
+        normalizer = StainNormalizer().fit(create_synthetic_tile(256, seed=1))
+        plain = list(TileDataset(self.wsi, tile_size=(256, 256)))
+        normalized = list(TileDataset(self.wsi, tile_size=(256, 256), normalizer=normalizer))
+        self.assertEqual(len(plain), len(normalized))
+        images = np.stack([image for image, _ in plain])
+        expected = normalizer.transform_batch(images)
+        for (_, coords), (_, normalized_coords) in zip(plain, normalized):
+            self.assertTrue(np.array_equal(coords, normalized_coords))
+        self.assertTrue(np.array_equal(np.stack([image for image, _ in normalized]), expected))
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_dataloader_workers(self):
+        # Third Party
+        from torch.utils.data import DataLoader
+
+        dataset = TileDataset(self.wsi, self.mask, tile_size=(256, 256))
+        serial = sorted(tuple(coords) for _, _, coords in dataset)
+        loader = DataLoader(dataset, batch_size=4, num_workers=3)
+        batches = list(loader)
+        self.assertEqual(batches[0][0].shape[1:], (256, 256, 3))
+        parallel = sorted(tuple(coords.tolist()) for batch in batches for coords in batch[2])
+        self.assertEqual(parallel, serial)
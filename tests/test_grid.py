@@ -0,0 +1,209 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# Third Party
+import numpy as np
+from histolab.masks import TissueMask
+from histolab.slide import Slide
+
+# patho_pix
+from patho_pix.io import load_mask, load_wsi
+from patho_pix.tiling import merge_tile_shards, tile_grid, tile_wsi_mask
+from patho_pix.utils import (AwesomeTiler, DirectoryWriter, MultiScaleTiler,
+                             TarShardReader, TarShardWriter, TileGrid,
+                             TileMetadata, TileWriter,
+                             convert_to_pyramidal_tiff)
+from tests.synthetic import create_synthetic_pair
+
+NUM_SHARDS = 3
+
+
+class DiscardingWriter(TileWriter):
+    def write(self, key, stream, data):
+        pass
+
+
+# ---------------------------------------------------- #
+#            Unittest: Sharded Grid Extraction         #
+# ---------------------------------------------------- #
+class TileGridTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.path_img, self.path_mask = create_synthetic_pair(self.tmp_data.name, width=2000, height=2000)
+        # Single-node extraction of the whole slide
+        self.dir_img = os.path.join(self.tmp_data.name, "img")
+        self.dir_mask = os.path.join(self.tmp_data.name, "mask")
+        self.reference = tile_wsi_mask(
+            load_wsi(self.path_img, self.dir_img), load_mask(self.path_mask, self.dir_mask),
+            tile_size=(256, 256),
+        )
+        # Grid computed once and shared through a file
+        self.path_grid = os.path.join(self.tmp_data.name, "grid.npz")
+        tile_grid(load_wsi(self.path_img, self.tmp_data.name), tile_size=(256, 256)).save(self.path_grid)
+
+    def _slides(self):
+        tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir.cleanup)
+        wsi = load_wsi(self.path_img, os.path.join(tile_dir.name, "img"))
+        mask = load_mask(self.path_mask, os.path.join(tile_dir.name, "mask"))
+        return wsi, mask, tile_dir.name
+
+    def test_grid_shards(self):
+        grid = TileGrid.load(self.path_grid)
+        self.assertTrue(np.all(np.diff(grid.candidates) > 0))
+        self.assertTrue(set(self.reference.columns["candidate"]) <= set(grid.candidates))
+        # Contiguous shards of equal size covering the grid
+        bounds = [grid.shard_bounds(index, NUM_SHARDS) for index in range(NUM_SHARDS)]
+        self.assertEqual([bounds[0][0], bounds[-1][1]], [0, len(grid)])
+        self.assertTrue(all(stop == start for (_, stop), (start, _) in zip(bounds, bounds[1:])))
+        sizes = [stop - start for start, stop in bounds]
+        self.assertLessEqual(max(sizes) - min(sizes), 1)
+        shards = [grid.shard(index, NUM_SHARDS) for index in range(NUM_SHARDS)]
+        self.assertEqual([candidate for shard in shards for candidate, _ in shard], list(grid.candidates))
+        with self.assertRaises(ValueError):
+            grid.shard(NUM_SHARDS, NUM_SHARDS)
+
+        # Grid of other tiling parameters, sharding without grid
+        wsi, mask, _ = self._slides()
+        with self.assertRaises(ValueError):
+            tile_wsi_mask(wsi, mask, tile_size=(128, 128), grid=grid, num_shards=NUM_SHARDS)
+        with self.assertRaises(ValueError):
+            tile_wsi_mask(wsi, mask, tile_size=(256, 256), num_shards=NUM_SHARDS)
+
+    def test_sharded_extraction_matches_single_node(self):
+        wsi, mask, tile_dir = self._slides()
+        grid = TileGrid.load(self.path_grid)
+        # Every node extracts its shard in the shared output directories
+        parts = [
+            tile_wsi_mask(wsi, mask, tile_size=(256, 256), grid=grid, shard_index=index,
+                          num_shards=NUM_SHARDS, workers=2 if index == 1 else 1)
+            for index in range(NUM_SHARDS)
+        ]
+        self.assertEqual(sum(map(len, parts)), len(self.reference))
+        self.assertTrue(all(len(part) > 0 for part in parts))
+        with self.assertRaises(ValueError):
+            TileMetadata.merge(parts[::-1])
+
+        # A writer which cannot rename fails the merge before any tile is renamed
+        written = sorted(os.listdir(os.path.join(tile_dir, "img")))
+        writer = DirectoryWriter({"image": wsi.processed_path, "mask": mask.processed_path})
+        with self.assertRaises(ValueError):
+            merge_tile_shards(wsi, parts, mask, tile_size=(256, 256),
+                              writers=[writer] * (NUM_SHARDS - 1) + [DiscardingWriter()])
+        self.assertEqual(sorted(os.listdir(os.path.join(tile_dir, "img"))), written)
+
+        merged = merge_tile_shards(wsi, parts, mask, tile_size=(256, 256))
+        self.assertEqual(list(merged), list(self.reference))
+        self.assertEqual(merged, self.reference)
+        self.assertTrue(np.array_equal(merged.label_counts, self.reference.label_counts))
+        for directory, reference_directory in [("img", self.dir_img), ("mask", self.dir_mask)]:
+            self.assertEqual(sorted(os.listdir(os.path.join(tile_dir, directory))), sorted(self.reference))
+            for tile_filename in self.reference:
+                with open(os.path.join(tile_dir, directory, tile_filename), "rb") as fd:
+                    with open(os.path.join(reference_directory, tile_filename), "rb") as reference_fd:
+                        self.assertEqual(fd.read(), reference_fd.read())
+        # A merge run again leaves the tiles as they are
+        self.assertEqual(merge_tile_shards(wsi, parts, mask, tile_size=(256, 256)), merged)
+        self.assertEqual(len(os.listdir(os.path.join(tile_dir, "img"))), len(self.reference))
+
+    def test_sharded_tar_outputs(self):
+        wsi, mask, tile_dir = self._slides()
+        grid = TileGrid.load(self.path_grid)
+        parts, shard_dirs = [], []
+        for index in range(NUM_SHARDS):
+            shard_dirs.append(os.path.join(tile_dir, f"part-{index}"))
+            with TarShardWriter(shard_dirs[-1]) as writer:
+                parts.append(tile_wsi_mask(wsi, mask, tile_size=(256, 256), writer=writer, grid=grid,
+                                           shard_index=index, num_shards=NUM_SHARDS))
+        writers = [TarShardWriter(directory, append=True) for directory in shard_dirs]
+        merged = merge_tile_shards(wsi, parts, mask, tile_size=(256, 256), writers=writers)
+        for writer in writers:
+            writer.close()
+        self.assertEqual(merged, self.reference)
+        keys = []
+        for directory in shard_dirs:
+            with TarShardReader(directory) as reader:
+                keys.extend(reader)
+                tile_filename = next(iter(reader))
+                with open(os.path.join(self.dir_mask, tile_filename), "rb") as fd:
+                    self.assertEqual(reader.read(tile_filename, "mask"), fd.read())
+        self.assertEqual(keys, list(self.reference))
+
+    def test_sharded_multiscale_extraction(self):
+        tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir.cleanup)
+        path_img = convert_to_pyramidal_tiff(
+            self.path_img, os.path.join(tile_dir.name, "image-pyramid.tiff"), min_level_size=256
+        )
+        path_mask = convert_to_pyramidal_tiff(
+            self.path_mask, os.path.join(tile_dir.name, "mask-pyramid.tiff"), min_level_size=256,
+            resampling="nearest",
+        )
+
+        def slides(name):
+            os.makedirs(os.path.join(tile_dir.name, name))
+            return (load_wsi(path_img, os.path.join(tile_dir.name, name, "img")),
+                    load_mask(path_mask, os.path.join(tile_dir.name, name, "mask")))
+
+        def tiler():
+            return MultiScaleTiler(tile_size=(256, 256), levels=[0, 1], tissue_percent=10.0)
+
+        wsi, mask = slides("reference")
+        reference = tiler().extract(wsi, mask, extraction_mask=TissueMask())
+        wsi, mask = slides("sharded")
+        grid = tiler().grid(wsi, TissueMask())
+        parts = [
+            tiler().extract(wsi, mask, extraction_mask=TissueMask(), grid=grid, shard_index=index,
+                            num_shards=NUM_SHARDS)
+            for index in range(NUM_SHARDS)
+        ]
+        merged = tiler().merge_shards(wsi, parts, mask)
+        self.assertEqual(merged, reference)
+        self.assertTrue(np.array_equal(merged.linked_coordinates, reference.linked_coordinates))
+        for directory in ["img", "mask", os.path.join("img", "level1"), os.path.join("mask", "level1")]:
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(tile_dir.name, "sharded", directory))),
+                sorted(os.listdir(os.path.join(tile_dir.name, "reference", directory))),
+            )
+
+    # ------------------------------------------------ #
+    #              Test: Grid at an MPP                #
+    # ------------------------------------------------ #
+    def _mpp_tiler(self):
+        return AwesomeTiler(tile_size=(128, 128), mpp=0.5, pixel_overlap=8, cache=False)
+
+    @mock.patch.object(Slide, "base_mpp", new_callable=mock.PropertyMock, return_value=0.25)
+    def test_grid_at_mpp_scaled_once(self, _):
+        wsi, _, _ = self._slides()
+        tiler = self._mpp_tiler()
+        grid = tiler.grid(wsi)
+        self.assertEqual((tiler.tile_size, tiler.pixel_overlap), ((256, 256), 16))
+        # Preparing the slide again keeps the level 0 tile size and overlap
+        self.assertEqual(tiler.grid(wsi).params_hash, grid.params_hash)
+        self.assertEqual((tiler.tile_size, tiler.pixel_overlap), ((256, 256), 16))
+
+    @unittest.skipUnless(importlib.util.find_spec("large_image"), "large_image is not installed")
+    @mock.patch.object(Slide, "base_mpp", new_callable=mock.PropertyMock, return_value=0.25)
+    def test_extract_grid_at_mpp(self, _):
+        tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir.cleanup)
+        reference = self._mpp_tiler().extract(
+            load_wsi(self.path_img, os.path.join(tile_dir.name, "reference"), use_largeimage=True)
+        )
+        wsi = load_wsi(self.path_img, os.path.join(tile_dir.name, "grid"), use_largeimage=True)
+        tiler = self._mpp_tiler()
+        metadata = tiler.extract(wsi, grid=tiler.grid(wsi))
+        self.assertEqual(metadata, reference)
+        self.assertEqual(metadata.tile_size, (128, 128))
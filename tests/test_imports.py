@@ -0,0 +1,109 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+# patho_pix
+import patho_pix.utils
+
+# Import of one module in a fresh process without network, reporting the modules it
+# loaded
+IMPORT_SCRIPT = textwrap.dedent("""
+    import importlib, json, socket, sys
+
+    def offline(*args, **kwargs):
+        raise OSError("network access at import time")
+
+    socket.socket.connect = offline
+    socket.create_connection = offline
+    before = set(sys.modules)
+    importlib.import_module(sys.argv[1])
+    print(json.dumps({"modules": sorted(set(sys.modules) - before)}))
+""")
+
+# Dependencies loaded on first use only
+HEAVY = (
+    "histolab", "torch", "cv2", "large_image", "requests", "scipy", "skimage",
+    "pandas", "pyarrow", "openslide", "tifffile",
+)
+# Modules built on histolab classes load histolab (and its SciPy, scikit-image and
+# openslide) but nothing else
+HISTOLAB = ("torch", "cv2", "large_image", "requests", "pandas", "pyarrow", "tifffile")
+LIGHT_BUDGET = (250, HEAVY)
+HISTOLAB_BUDGET = (900, HISTOLAB)
+
+# Budget of every module: number of loaded modules, forbidden dependencies. Import
+# times are not checked, they depend on the load of the machine
+IMPORT_BUDGETS = {
+    "patho_pix": LIGHT_BUDGET,
+    "patho_pix.io": LIGHT_BUDGET,
+    "patho_pix.main": LIGHT_BUDGET,
+    "patho_pix.normalization": LIGHT_BUDGET,
+    "patho_pix.pipeline": LIGHT_BUDGET,
+    "patho_pix.tiling": LIGHT_BUDGET,
+    "patho_pix.utils": LIGHT_BUDGET,
+    "patho_pix.utils.artifacts": LIGHT_BUDGET,
+    "patho_pix.utils.cache": LIGHT_BUDGET,
+    "patho_pix.utils.grid": LIGHT_BUDGET,
+    "patho_pix.utils.instrumentation": LIGHT_BUDGET,
+    "patho_pix.utils.jpeg_to_tiff": LIGHT_BUDGET,
+    "patho_pix.utils.manifest": LIGHT_BUDGET,
+    "patho_pix.utils.memory": LIGHT_BUDGET,
+    "patho_pix.utils.metadata": LIGHT_BUDGET,
+    "patho_pix.utils.sampling": LIGHT_BUDGET,
+    "patho_pix.utils.superblocks": LIGHT_BUDGET,
+    "patho_pix.utils.tissue": LIGHT_BUDGET,
+    "patho_pix.utils.writers": LIGHT_BUDGET,
+    "patho_pix.utils.custom_tiler": HISTOLAB_BUDGET,
+    "patho_pix.utils.multiscale": HISTOLAB_BUDGET,
+    # The torch dataset subclasses torch's IterableDataset when torch is installed
+    "patho_pix.dataset": (None, tuple(set(HISTOLAB) - {"torch"})),
+}
+
+
+# ---------------------------------------------------- #
+#                 Unittest: Import Budget              #
+# ---------------------------------------------------- #
+class ImportTEST(unittest.TestCase):
+    def _import(self, module):
+        workdir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(workdir.cleanup)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT, module],
+            capture_output=True, text=True, env=env, cwd=workdir.name,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # No file written in the working directory
+        self.assertEqual(os.listdir(workdir.name), [])
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_import_budgets(self):
+        for module, (max_modules, forbidden) in IMPORT_BUDGETS.items():
+            with self.subTest(module=module):
+                report = self._import(module)
+                top_level = {name.split(".")[0] for name in report["modules"]}
+                self.assertEqual(sorted(top_level & set(forbidden)), [])
+                if max_modules is not None:
+                    self.assertLessEqual(len(report["modules"]), max_modules)
+
+    def test_lazy_utils_exports(self):
+        for name in patho_pix.utils.__all__:
+            self.assertTrue(hasattr(patho_pix.utils, name), name)
+        self.assertIn("AwesomeTiler", dir(patho_pix.utils))
+        with self.assertRaises(AttributeError):
+            patho_pix.utils.missing_name
+        self.assertEqual(
+            sorted(patho_pix.utils.__all__), sorted(patho_pix.utils._EXPORTS)
+        )
@@ -14,11 +14,15 @@ import unittest
 # Third Party
 import numpy as np
 import requests
+from PIL import Image
 
 # patho_pix
 # Internal libraries
 from patho_pix.io import load_mask, load_wsi
-from patho_pix.utils import convert_jpeg_to_tiff
+from patho_pix.utils import (convert_jpeg_to_tiff,
+                             convert_many_to_pyramidal_tiff,
+                             convert_to_pyramidal_tiff)
+from tests.synthetic import create_synthetic_pair
 
 # ---------------------------------------------------- #
 #                    Configuration                     #
@@ -85,3 +89,56 @@ class IOTEST(unittest.TestCase):
         mask = load_mask(self.path_mask, tile_dir.name)
         self.assertTrue(np.array_equal(mask.level_dimensions(level=0),
                                       (15040, 18048)))
+
+
+# ---------------------------------------------------- #
+#           Unittest: Pyramidal TIFF Conversion        #
+# ---------------------------------------------------- #
+class PyramidalTiffTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.path_img, self.path_mask = create_synthetic_pair(self.tmp_data.name, width=1500, height=1100)
+        self.path_jpeg = os.path.join(self.tmp_data.name, "image.jpg")
+        Image.open(self.path_img).save(self.path_jpeg, quality=95)
+
+    def test_pyramid_levels(self):
+        path_out = os.path.join(self.tmp_data.name, "pyramid.tiff")
+        convert_to_pyramidal_tiff(self.path_img, path_out, tile_size=256, min_level_size=300)
+        wsi = load_wsi(path_out, os.path.join(self.tmp_data.name, "tiles"))
+        self.assertEqual(wsi.dimensions, (1500, 1100))
+        self.assertEqual(wsi.levels, [0, 1, 2, 3])
+        self.assertEqual(wsi.level_dimensions(level=1), (750, 550))
+        self.assertEqual(wsi.level_dimensions(level=3), (188, 138))
+
+        source = np.asarray(Image.open(self.path_img))
+        region = wsi._wsi.read_region((1000, 900), 0, (500, 200)).convert("RGB")
+        self.assertTrue(np.array_equal(np.asarray(region), source[900:, 1000:]))
+        level_1 = np.asarray(wsi._wsi.read_region((0, 0), 1, (750, 550)).convert("RGB")).astype(int)
+        mean = source.reshape(550, 2, 750, 2, 3).mean(axis=(1, 3))
+        self.assertLessEqual(np.abs(level_1 - mean).max(), 1)
+
+    def test_mask_nearest_and_jpeg_source(self):
+        path_out = os.path.join(self.tmp_data.name, "mask-pyramid.tiff")
+        convert_to_pyramidal_tiff(self.path_mask, path_out, resampling="nearest", min_level_size=600)
+        mask = load_mask(path_out, os.path.join(self.tmp_data.name, "mask-tiles"))
+        level_1 = np.asarray(mask._wsi.read_region((0, 0), 1, mask.level_dimensions(level=1)).convert("RGB"))
+        self.assertEqual(set(np.unique(level_1)), {0, 255})
+
+        path_out = os.path.join(self.tmp_data.name, "jpeg-pyramid.tiff")
+        convert_jpeg_to_tiff(self.path_jpeg, path_out)
+        wsi = load_wsi(path_out, os.path.join(self.tmp_data.name, "jpeg-tiles"))
+        region = np.asarray(wsi._wsi.read_region((0, 0), 0, (1500, 1100)).convert("RGB"))
+        self.assertTrue(np.array_equal(region, np.asarray(Image.open(self.path_jpeg).convert("RGB"))))
+
+    def test_parallel_conversion(self):
+        jobs = [
+            (path, os.path.join(self.tmp_data.name, f"{n_workers}-{i}.tiff"))
+            for n_workers in [1, 2]
+            for i, path in enumerate([self.path_img, self.path_jpeg])
+        ]
+        self.assertEqual(convert_many_to_pyramidal_tiff(jobs[:2]), [output for _, output in jobs[:2]])
+        self.assertEqual(convert_many_to_pyramidal_tiff(jobs[2:], workers=2), [output for _, output in jobs[2:]])
+        for (_, serial), (_, parallel) in zip(jobs[:2], jobs[2:]):
+            with open(serial, "rb") as fd_serial, open(parallel, "rb") as fd_parallel:
+                self.assertEqual(fd_serial.read(), fd_parallel.read())
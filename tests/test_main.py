@@ -0,0 +1,80 @@
+# Standard Library
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# patho_pix
+from patho_pix.main import PEAK_RSS_FIELD, discover_slides, main, parse_memory
+from patho_pix.utils import TileMetadata
+from tests.synthetic import create_synthetic_pair
+
+
+class BatchRunnerTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.input_dir = os.path.join(self.tmp_data.name, "slides")
+        os.makedirs(self.input_dir)
+        for name, width in [("small", 1200), ("large", 2500)]:
+            path_img, path_mask = create_synthetic_pair(self.tmp_data.name, width=width, height=1500)
+            os.rename(path_img, os.path.join(self.input_dir, f"{name}.image.tiff"))
+            os.rename(path_mask, os.path.join(self.input_dir, f"{name}.mask.tiff"))
+        with open(os.path.join(self.input_dir, "broken.tiff"), "wb") as fd:
+            fd.write(b"not a slide")
+
+    def test_discover_slides(self):
+        jobs = discover_slides(self.input_dir)
+        self.assertEqual([job.name for job in jobs], ["large", "small", "broken"])
+        self.assertTrue(jobs[0].mask.endswith("large.mask.tiff"))
+        self.assertIsNone(jobs[2].mask)
+
+        path_csv = os.path.join(self.tmp_data.name, "cohort.csv")
+        with open(path_csv, "w") as fd:
+            fd.write("slide,mask\nslides/small.image.tiff,slides/small.mask.tiff\nslides/large.image.tiff,\n")
+        jobs = discover_slides(path_csv)
+        self.assertEqual([(job.name, job.mask is None) for job in jobs], [("large", True), ("small", False)])
+
+    def test_batch_run_report(self):
+        output = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(output.cleanup)
+        argv = [self.input_dir, "--output", output.name, "--tile-size", "256", "256", "--concurrency", "2",
+                "--memory-budget", "8G", "--mask-mode", "label"]
+        self.assertEqual(main(argv), 1)
+
+        with open(os.path.join(output.name, "run_report.jsonl")) as fd:
+            records = [json.loads(line) for line in fd]
+        summary = records.pop()["summary"]
+        self.assertEqual((summary["ok"], summary["failed"]), (2, 1))
+        by_name = {record["name"]: record for record in records}
+        self.assertEqual(by_name["broken"]["status"], "failed")
+        for name in ["small", "large"]:
+            record = by_name[name]
+            self.assertEqual(record["status"], "ok")
+            metadata = TileMetadata.load(record["metadata"])
+            self.assertEqual(len(metadata), record["tiles"])
+            self.assertEqual(sorted(os.listdir(os.path.join(output.name, name, "mask"))), sorted(metadata))
+            self.assertEqual(record["stats"]["counters"]["tiles"], record["tiles"])
+            self.assertGreater(record[PEAK_RSS_FIELD], 0)
+
+        # Slides already tiled are skipped when the run is repeated
+        self.assertEqual(main(argv), 1)
+        with open(os.path.join(output.name, "run_report.jsonl")) as fd:
+            summary = json.loads(fd.read().splitlines()[-1])["summary"]
+        self.assertEqual((summary["skipped"], summary["failed"]), (2, 1))
+
+    def test_metadata_format_without_pyarrow(self):
+        output = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(output.cleanup)
+        argv = [self.input_dir, "--output", output.name, "--metadata-format", "parquet"]
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            with self.assertRaises(SystemExit):
+                main(argv)
+        # No slide was scheduled
+        self.assertEqual(os.listdir(output.name), [])
+
+    def test_parse_memory(self):
+        self.assertEqual(parse_memory("64G"), 64 << 30)
+        self.assertEqual(parse_memory("512MiB"), 512 << 20)
+        self.assertEqual(parse_memory("1000"), 1000)
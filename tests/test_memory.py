@@ -0,0 +1,127 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+# Third Party
+import numpy as np
+from PIL import Image
+
+# patho_pix
+from patho_pix.io import load_mask, load_wsi
+from patho_pix.tiling import tile_wsi_mask
+from patho_pix.utils import (AwesomeTiler, TileMetadata,
+                             convert_to_pyramidal_tiff)
+from tests.synthetic import create_synthetic_pair
+
+# Extraction of the slide in a fresh process, reporting the growth of its peak RSS
+EXTRACT_SCRIPT = textwrap.dedent("""
+    import json, sys
+    from patho_pix.io import load_mask, load_wsi
+    from patho_pix.tiling import tile_wsi_mask
+    from patho_pix.utils.memory import peak_rss
+
+    path_img, path_mask, output, budget = sys.argv[1:]
+    wsi = load_wsi(path_img, output + "/image")
+    mask = load_mask(path_mask, output + "/mask")
+    wsi.dimensions, mask.dimensions
+    before = peak_rss()
+    metadata = tile_wsi_mask(wsi, mask, tile_size=(512, 512), mask_mode="label",
+                             memory_budget=int(budget))
+    print(json.dumps({"growth": peak_rss() - before, "tiles": list(metadata)}))
+""")
+
+
+# ---------------------------------------------------- #
+#                Unittest: Memory Budget               #
+# ---------------------------------------------------- #
+class MemoryBudgetTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        path_img, path_mask = create_synthetic_pair(self.tmp_data.name, width=1500, height=1500)
+        # Large slide: the synthetic pair repeated on a 2 x 6 grid, as pyramids read tile by tile
+        paths = []
+        for path, resampling in [(path_img, "average"), (path_mask, "nearest")]:
+            with Image.open(path) as image:
+                large = np.tile(np.asarray(image), (6, 2, 1))
+            path_large = path.replace(".tiff", "-large.tiff")
+            Image.fromarray(large).save(path_large)
+            paths.append(convert_to_pyramidal_tiff(
+                path_large, path.replace(".tiff", "-pyramid.tiff"), resampling=resampling
+            ))
+        self.path_img, self.path_mask = paths
+
+    def test_peak_rss_within_budget(self):
+        budget = 48 << 20
+        output = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(output.cleanup)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        result = subprocess.run(
+            [sys.executable, "-c", EXTRACT_SCRIPT, self.path_img, self.path_mask, output.name, str(budget)],
+            capture_output=True, text=True, env=env, check=True,
+        )
+        report = json.loads(result.stdout.splitlines()[-1])
+        self.assertLess(report["growth"], budget)
+
+        # Same tiles as without budget
+        wsi = load_wsi(self.path_img, os.path.join(output.name, "image-reference"))
+        mask = load_mask(self.path_mask, os.path.join(output.name, "mask-reference"))
+        metadata = tile_wsi_mask(wsi, mask, tile_size=(512, 512), mask_mode="label")
+        self.assertGreater(len(metadata), 0)
+        self.assertEqual(report["tiles"], list(metadata))
+
+        with self.assertRaises(ValueError):
+            tile_wsi_mask(wsi, mask, tile_size=(512, 512), memory_budget=1 << 20)
+
+    def test_budget_limits(self):
+        tiler = AwesomeTiler(tile_size=(256, 256), memory_budget=32 << 20)
+        wsi = load_wsi(self.path_img, self.tmp_data.name)
+        tiler._prepare(wsi)
+        limits = tiler._buffer_limits(wsi, 1, TileMetadata(n_classes=2))
+        self.assertLessEqual(limits.max_pending * 2 * (2 * 4 * 256 * 256), 16 << 20)
+        self.assertEqual(tiler.superblock_bytes, 32 << 20)
+        tiler._limits = limits
+        self.assertLess(tiler._superblock_bytes(), 32 << 20)
+        self.assertGreater(limits.chunk_tiles, 0)
+
+    def test_metadata_spill(self):
+        reference = TileMetadata(n_classes=3, linked=["level1"])
+        spill_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(spill_dir.cleanup)
+        metadata = TileMetadata(n_classes=3, linked=["level1"], spill_rows=7, spill_dir=spill_dir.name)
+        for row in range(50):
+            for tile_metadata in (reference, metadata):
+                tile_metadata.append(
+                    row, (row, row, row + 8, row + 8), row / 50, 0.5, np.array([row, 1, 0]),
+                    np.full((1, 4), row),
+                )
+            # At most spill_rows rows in memory
+            self.assertLessEqual(metadata._n_rows - metadata._n_spilled, 7)
+        self.assertEqual(len(os.listdir(spill_dir.name)), 1)
+        self.assertEqual(metadata, reference)
+        self.assertEqual(list(metadata), list(reference))
+        for name, column in reference.columns.items():
+            self.assertTrue(np.array_equal(metadata.columns[name], column, equal_nan=True))
+        self.assertTrue(np.array_equal(metadata.label_counts, reference.label_counts))
+        self.assertTrue(np.array_equal(metadata.linked_coordinates, reference.linked_coordinates))
+        self.assertEqual(metadata[reference.filename(3)], reference[reference.filename(3)])
+
+        # Appending after a read, and a copy in memory
+        metadata.append(50, (1, 2, 9, 10), 1.0)
+        self.assertEqual(metadata.filename(50), "tile_50_level0_1-2-9-10.png")
+        unpickled = pickle.loads(pickle.dumps(metadata))
+        self.assertEqual(unpickled._n_spilled, 0)
+        self.assertEqual(unpickled, metadata)
@@ -0,0 +1,100 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import os
+import tempfile
+import unittest
+
+# Third Party
+import numpy as np
+from histolab.masks import TissueMask
+from PIL import Image
+
+# patho_pix
+from patho_pix.io import load_mask, load_wsi
+from patho_pix.utils import (AwesomeTiler, MultiScaleTiler,
+                             convert_to_pyramidal_tiff)
+from tests.synthetic import create_synthetic_pair
+
+
+# ---------------------------------------------------- #
+#             Unittest: Multi-Scale Tiling             #
+# ---------------------------------------------------- #
+class MultiScaleTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        path_img, path_mask = create_synthetic_pair(self.tmp_data.name)
+        self.path_img = convert_to_pyramidal_tiff(
+            path_img, os.path.join(self.tmp_data.name, "image-pyramid.tiff"), min_level_size=256
+        )
+        self.path_mask = convert_to_pyramidal_tiff(
+            path_mask, os.path.join(self.tmp_data.name, "mask-pyramid.tiff"), min_level_size=256,
+            resampling="nearest",
+        )
+
+    def _extract(self, tiler, **kwargs):
+        tile_dir_img = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        tile_dir_mask = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir_img.cleanup)
+        self.addCleanup(tile_dir_mask.cleanup)
+        wsi = load_wsi(self.path_img, tile_dir_img.name)
+        mask = load_mask(self.path_mask, tile_dir_mask.name)
+        metadata = tiler.extract(wsi, mask, extraction_mask=TissueMask(), **kwargs)
+        return metadata, wsi, mask
+
+    def test_concentric_linked_tiles(self):
+        kwargs = dict(tile_size=(256, 256), tissue_percent=10.0, mask_mode="label", mask_lut={(255, 255, 255): 1})
+        reference, _, _ = self._extract(AwesomeTiler(**kwargs))
+        metadata, wsi, mask = self._extract(MultiScaleTiler(levels=[0, 1, 2], **kwargs))
+        self.assertGreater(len(metadata), 0)
+        self.assertEqual(metadata, reference)
+        self.assertEqual(metadata.linked, ["level1", "level2"])
+        self.assertEqual(metadata.to_pandas().columns[-2], "level2_y_br")
+
+        for tile_filename, tile_coords, linked_coords in zip(
+            metadata, np.stack([metadata.columns[name] for name in ["x_ul", "y_ul", "x_br", "y_br"]], 1),
+            metadata.linked_coordinates,
+        ):
+            for (x_ul, y_ul, x_br, y_br), level in zip(linked_coords, [1, 2]):
+                # Concentric: same centre, footprint of the tile at the level
+                self.assertEqual((x_ul + x_br) // 2, (tile_coords[0] + tile_coords[2]) // 2)
+                self.assertEqual(x_br - x_ul, 256 * 2 ** level)
+                expected = wsi._wsi.read_region((int(x_ul), int(y_ul)), level, (256, 256))
+                with Image.open(os.path.join(wsi.processed_path, f"level{level}", tile_filename)) as image:
+                    self.assertTrue(np.array_equal(np.asarray(image), np.asarray(expected)))
+                expected = np.asarray(mask._wsi.read_region((int(x_ul), int(y_ul)), level, (256, 256)))
+                with Image.open(os.path.join(mask.processed_path, f"level{level}", tile_filename)) as labels:
+                    self.assertTrue(np.array_equal(np.asarray(labels), (expected[..., 0] == 255)))
+
+    def test_aligned_grid_and_workers(self):
+        tiler = MultiScaleTiler(tile_size=(128, 128), levels=[0, 2], grid="aligned", tissue_percent=10.0)
+        metadata, wsi, _ = self._extract(tiler)
+        linked_coords = metadata.linked_coordinates[:, 0]
+        self.assertTrue(np.all(linked_coords[:, :2] % 512 == 0))
+        self.assertTrue(np.all(linked_coords[:, 2:] - linked_coords[:, :2] == 512))
+        # Linked tiles shared by consecutive tiles are read once
+        n_linked = len(np.unique(linked_coords, axis=0))
+        self.assertLess(n_linked, len(metadata))
+        self.assertLessEqual(tiler.stats.counters["linked_reads"], n_linked)
+
+        metadata_parallel, wsi_parallel, _ = self._extract(
+            MultiScaleTiler(tile_size=(128, 128), levels=[0, 2], grid="aligned", tissue_percent=10.0), workers=2
+        )
+        self.assertEqual(metadata_parallel, metadata)
+        self.assertTrue(np.array_equal(metadata_parallel.linked_coordinates, metadata.linked_coordinates))
+        for directory in ["", "level2"]:
+            for tile_filename in metadata:
+                with open(os.path.join(wsi.processed_path, directory, tile_filename), "rb") as fd:
+                    with open(os.path.join(wsi_parallel.processed_path, directory, tile_filename), "rb") as fd_parallel:
+                        self.assertEqual(fd.read(), fd_parallel.read())
+
+        with self.assertRaises(ValueError):
+            MultiScaleTiler(tile_size=(128, 128), levels=[0], mpps=[0.5])
+        with self.assertRaises(ValueError):
+            MultiScaleTiler(tile_size=(128, 128), levels=[0, 1], grid="random")
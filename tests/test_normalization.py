@@ -1,15 +1,18 @@
 # Standard Library
+import importlib.util
 import os
 import tempfile
 import unittest
 
 # Third Party
+import numpy as np
 import requests
 from PIL import Image
 
 # patho_pix
-from patho_pix.normalization import (normalize_tile_macenko,
+from patho_pix.normalization import (StainNormalizer, normalize_tile_macenko,
                                      normalize_tile_reinhard)
+from tests.synthetic import create_synthetic_tile
 
 test_img_url = 'https://user-images.githubusercontent.com/31658006/212924179-a85573b6-1bb3-4f9b-a8ab-00a26b1d652e.png'
 
@@ -43,3 +46,46 @@ class NormalizationTests(unittest.TestCase):
         self.assertIsInstance(self.normalized_tile, Image.Image)
         # Save image in output/test_out for inspection
         self.normalized_tile.save("./output/test_out/normalized_tile_macenko.tiff")
+
+
+class StainNormalizerTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.target_img = create_synthetic_tile(seed=0)
+        self.test_img = create_synthetic_tile(seed=1, shift=(-30, 10, -20))
+
+    def test_saved_parameters_reproduce_fitted_normalizer(self):
+        for method in ("macenko", "reinhard"):
+            normalizer = StainNormalizer.from_target(self.target_img, method=method)
+            with tempfile.TemporaryDirectory(prefix="tmp.patho-pix.") as tmp_dir:
+                path_params = os.path.join(tmp_dir, "stain.json")
+                normalizer.save(path_params)
+                loaded = StainNormalizer.load(path_params)
+            self.assertEqual(loaded.method, method)
+            self.assertTrue(np.array_equal(np.asarray(normalizer(self.test_img)),
+                                           np.asarray(loaded(self.test_img))))
+
+    def test_batch_matches_per_tile_macenko(self):
+        normalizer = StainNormalizer.from_target(self.target_img)
+        tiles = [create_synthetic_tile(seed=seed, shift=(-seed, 5, -10)) for seed in range(2, 7)]
+        expected = np.stack([np.asarray(normalizer(tile)) for tile in tiles])
+        stack = np.stack([np.asarray(tile) for tile in tiles])
+        normalized = normalizer.transform_batch(stack, chunk_size=2)
+        self.assertEqual(normalized.dtype, np.uint8)
+        self.assertLessEqual(np.abs(normalized.astype(int) - expected).max(), 2)
+        # Iterator input yields the same tiles one by one
+        streamed = np.stack(list(normalizer.transform_batch(iter(tiles), chunk_size=3)))
+        self.assertTrue(np.array_equal(streamed, normalized))
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_batch_torch_backend(self):
+        normalizer = StainNormalizer.from_target(self.target_img)
+        stack = np.stack([np.asarray(self.test_img)] * 3)
+        normalized = normalizer.transform_batch(stack, backend="torch")
+        self.assertLessEqual(np.abs(normalized.astype(int) - normalizer.transform_batch(stack)).max(), 1)
+
+    def test_unfitted_normalizer_raises(self):
+        with self.assertRaises(RuntimeError):
+            StainNormalizer().transform(self.test_img)
+        with self.assertRaises(ValueError):
+            StainNormalizer(method="vahadane")
@@ -0,0 +1,121 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import os
+import tempfile
+import unittest
+
+# Third Party
+import numpy as np
+from histolab.masks import TissueMask
+from PIL import Image
+
+# patho_pix
+from patho_pix.io import load_mask, load_wsi
+from patho_pix.normalization import StainNormalizer
+from patho_pix.pipeline import Pipeline, Stage, slide_pipeline
+from patho_pix.utils import ArtifactDetector, AwesomeTiler
+from tests.synthetic import create_synthetic_pair, create_synthetic_tile
+
+
+def _tiler():
+    return AwesomeTiler(tile_size=(256, 256), tissue_percent=10.0, prefix="patho-fix.", mask_mode="label")
+
+
+# ---------------------------------------------------- #
+#                Unittest: Pipeline Stages             #
+# ---------------------------------------------------- #
+class PipelineTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.path_img, self.path_mask = create_synthetic_pair(self.tmp_data.name, width=2000, height=2000)
+
+    def _slides(self):
+        tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir.cleanup)
+        wsi = load_wsi(self.path_img, os.path.join(tile_dir.name, "img"))
+        mask = load_mask(self.path_mask, os.path.join(tile_dir.name, "mask"))
+        return wsi, mask
+
+    def test_ordered_stages(self):
+        def keep_even(batch):
+            return [item if item % 2 == 0 else None for item in batch]
+
+        pipeline = Pipeline(range(100), prefetch=4)
+        pipeline.then(Stage("square", lambda item: item * item, workers=3, queue_size=2))
+        pipeline.then(Stage("even", keep_even, workers=2, batch_size=7))
+        self.assertEqual(list(pipeline), [item * item for item in range(0, 100, 2)])
+        summary = pipeline.summary()["pipeline"]
+        self.assertEqual(list(summary), ["read", "square", "even"])
+        self.assertEqual([summary["square"]["items_in"], summary["square"]["items_out"]], [100, 100])
+        self.assertEqual([summary["even"]["items_in"], summary["even"]["items_out"]], [100, 50])
+        self.assertEqual(summary["square"]["workers"], 3)
+        self.assertGreater(summary["even"]["capacity_per_s"], 0)
+
+        # Errors of a stage reach the consumer
+        def fail(item):
+            if item == 42:
+                raise RuntimeError("stage failure")
+            return item
+
+        with self.assertRaises(RuntimeError):
+            Pipeline(range(100), [Stage("fail", fail, workers=2)]).run()
+        with self.assertRaises(ValueError):
+            pipeline.then(Stage("even", keep_even))
+        with self.assertRaises(ValueError):
+            Stage("empty", keep_even, workers=0)
+
+    def test_slide_pipeline_matches_extraction(self):
+        wsi, mask = self._slides()
+        reference = _tiler().extract(wsi, mask, extraction_mask=TissueMask())
+        reference_files = {}
+        for directory in (wsi.processed_path, mask.processed_path):
+            for tile_filename in reference:
+                with open(os.path.join(directory, tile_filename), "rb") as fd:
+                    reference_files[directory, tile_filename] = fd.read()
+
+        wsi, mask = self._slides()
+        pipeline, exporter = slide_pipeline(_tiler(), wsi, mask, workers={"encode": 3})
+        summary = pipeline.run()
+        self.assertEqual(exporter.metadata, reference)
+        self.assertTrue(np.array_equal(exporter.metadata.label_counts, reference.label_counts))
+        for (directory, tile_filename), data in reference_files.items():
+            directory = wsi.processed_path if directory.endswith("img") else mask.processed_path
+            with open(os.path.join(directory, tile_filename), "rb") as fd:
+                self.assertEqual(fd.read(), data)
+        self.assertEqual(list(summary["pipeline"]), ["read", "encode", "export"])
+        self.assertEqual(summary["pipeline"]["export"]["items_out"], len(reference))
+
+    def test_filter_and_normalize(self):
+        wsi, mask = self._slides()
+        normalizer = StainNormalizer().fit(create_synthetic_tile(256, seed=1))
+        detector = ArtifactDetector(min_focus=None, batch_size=5)
+        pipeline, exporter = slide_pipeline(
+            _tiler(), wsi, mask, artifact_detector=detector, normalizer=normalizer,
+            workers={"normalize": 2},
+        )
+        tiles = list(pipeline)
+        metadata = exporter.metadata
+        self.assertEqual([tile.candidate for tile in tiles], list(metadata.columns["candidate"]))
+        self.assertFalse(np.isnan(metadata.artifact_scores).any())
+        stages = pipeline.summary()["pipeline"]
+        self.assertEqual(stages["artifacts"]["items_out"], len(metadata))
+        self.assertEqual(stages["normalize"]["items_in"], len(metadata))
+
+        # The written tiles are the normalized tiles, encoded once
+        wsi_plain, _ = self._slides()
+        plain = {
+            tuple(tile.coords): tile.image
+            for tile in slide_pipeline(_tiler(), wsi_plain, artifact_detector=detector)[0]
+        }
+        expected = normalizer.transform_batch(np.stack([plain[tile.coords] for tile in tiles]))
+        for position, tile_filename in enumerate(metadata):
+            saved = np.asarray(Image.open(os.path.join(wsi.processed_path, tile_filename)))
+            self.assertEqual(saved.shape, (256, 256, 3))
+            self.assertTrue(np.array_equal(saved, expected[position]))
@@ -10,15 +10,26 @@
 import os
 import tempfile
 import unittest
+from unittest import mock
 
 # Third Party
+import numpy as np
 import requests
+from histolab.masks import BiggestTissueBoxMask, TissueMask
+from histolab.types import CoordinatePair
+from histolab.util import scale_coordinates
+from PIL import Image
 
 # patho_pix
 # Internal libraries
 from patho_pix.io import load_mask, load_wsi
 from patho_pix.tiling import tile_wsi, tile_wsi_mask
-from patho_pix.utils import convert_jpeg_to_tiff
+from patho_pix.utils import (AwesomeTiler, LabelSampler, SuperblockReader,
+                             TarShardReader, TarShardWriter, TileCodec,
+                             TileMetadata, convert_jpeg_to_tiff,
+                             convert_to_pyramidal_tiff)
+from patho_pix.utils.custom_tiler import _ordered_map
+from tests.synthetic import create_synthetic_pair
 
 # ---------------------------------------------------- #
 #                    Configuration                     #
@@ -90,3 +101,346 @@ class TileTEST(unittest.TestCase):
         mask = load_mask(self.path_mask, tile_dir_mask.name)
         tile_wsi_mask(wsi, mask)
         self.assertEqual(len(os.listdir(tile_dir_img.name)), 37)
+
+
+# ---------------------------------------------------- #
+#          Unittest: Tiling on a synthetic slide       #
+# ---------------------------------------------------- #
+class SyntheticTileTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.path_img, self.path_mask = create_synthetic_pair(self.tmp_data.name)
+
+    def _tile(self, **kwargs):
+        tile_dir_img = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        tile_dir_mask = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir_img.cleanup)
+        self.addCleanup(tile_dir_mask.cleanup)
+        wsi = load_wsi(self.path_img, tile_dir_img.name)
+        mask = load_mask(self.path_mask, tile_dir_mask.name)
+        metadata = tile_wsi_mask(wsi, mask, tile_size=(256, 256), **kwargs)
+        if kwargs.get("return_stats"):
+            return metadata
+        return metadata, tile_dir_img.name, tile_dir_mask.name
+
+    # ------------------------------------------------ #
+    #          Test: Parallel Image and Mask Tiling    #
+    # ------------------------------------------------ #
+    def test_parallel_matches_serial(self):
+        metadata, dir_img, dir_mask = self._tile()
+        metadata_parallel, dir_img_parallel, dir_mask_parallel = self._tile(workers=3)
+        self.assertGreater(len(metadata), 0)
+        self.assertEqual(list(metadata), list(metadata_parallel))
+        self.assertEqual(metadata, metadata_parallel)
+        self.assertEqual(sorted(os.listdir(dir_img)), sorted(os.listdir(dir_img_parallel)))
+        self.assertEqual(sorted(os.listdir(dir_mask)), sorted(os.listdir(dir_mask_parallel)))
+
+        # Encoded chunks waiting to be written are bounded, with or without budget
+        with mock.patch("patho_pix.utils.custom_tiler._ordered_map", wraps=_ordered_map) as ordered_map:
+            self.assertEqual(self._tile(workers=3)[0], metadata)
+        self.assertEqual(ordered_map.call_args.args[3], 4)
+
+    # ------------------------------------------------ #
+    #              Test: Label Mask Export             #
+    # ------------------------------------------------ #
+    def test_label_mask_export(self):
+        metadata, _, dir_mask_rgb = self._tile()
+        for mask_mode, image_mode in [("label", "L"), ("palette", "P")]:
+            metadata_label, _, dir_mask = self._tile(mask_mode=mask_mode, mask_lut={(255, 255, 255): 1})
+            self.assertEqual(metadata, metadata_label)
+            for tile_filename in metadata:
+                mask_rgb = np.asarray(Image.open(os.path.join(dir_mask_rgb, tile_filename)))
+                with Image.open(os.path.join(dir_mask, tile_filename)) as mask_label:
+                    self.assertEqual(mask_label.mode, image_mode)
+                    labels = np.asarray(mask_label)
+                self.assertEqual(labels.shape, (256, 256))
+                self.assertTrue(np.array_equal(labels, (mask_rgb[..., 0] == 255).astype(np.uint8)))
+
+    # ------------------------------------------------ #
+    #              Test: Tar Shard Output              #
+    # ------------------------------------------------ #
+    def test_tar_shard_writer(self):
+        metadata, dir_img, dir_mask = self._tile()
+        shard_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(shard_dir.cleanup)
+        with TarShardWriter(shard_dir.name, shard_size=200_000) as writer:
+            metadata_sharded, dir_img_sharded, _ = self._tile(writer=writer, workers=2)
+        self.assertEqual(metadata, metadata_sharded)
+        self.assertEqual(os.listdir(dir_img_sharded), [])
+        with TarShardReader(shard_dir.name) as reader:
+            self.assertGreater(len(reader.shards), 1)
+            self.assertEqual(list(reader), list(metadata))
+            for tile_filename in metadata:
+                for stream, directory in [("image", dir_img), ("mask", dir_mask)]:
+                    with open(os.path.join(directory, tile_filename), "rb") as fd:
+                        self.assertEqual(reader.read(tile_filename, stream), fd.read())
+
+    # ------------------------------------------------ #
+    #           Test: Resume from the Manifest         #
+    # ------------------------------------------------ #
+    def test_resume_from_manifest(self):
+        metadata, dir_img, dir_mask = self._tile()
+        manifest_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(manifest_dir.cleanup)
+        path_manifest = os.path.join(manifest_dir.name, "manifest.jsonl")
+        wsi = load_wsi(self.path_img, dir_img)
+        mask = load_mask(self.path_mask, dir_mask)
+        kwargs = dict(tile_size=(256, 256), manifest=path_manifest)
+        self.assertEqual(tile_wsi_mask(wsi, mask, **kwargs), metadata)
+
+        # Interrupted run: last manifest line truncated, one tile missing on disk
+        with open(path_manifest) as fd:
+            lines = fd.read().splitlines()
+        with open(path_manifest, "w") as fd:
+            fd.write("\n".join(lines[:-3]) + "\n" + lines[-3][:10])
+        filenames = list(metadata)
+        os.remove(os.path.join(dir_mask, filenames[len(filenames) // 2]))
+        mtimes = {f: os.path.getmtime(os.path.join(dir_img, f)) for f in filenames}
+
+        metadata_resumed = tile_wsi_mask(wsi, mask, workers=2, **kwargs)
+        self.assertEqual(list(metadata_resumed), filenames)
+        self.assertEqual(metadata_resumed, metadata)
+        for position, tile_filename in enumerate(filenames):
+            rewritten = os.path.getmtime(os.path.join(dir_img, tile_filename)) != mtimes[tile_filename]
+            self.assertEqual(rewritten, position >= len(filenames) // 2)
+
+        # Extraction parameters changed: the manifest is discarded
+        metadata_other = tile_wsi_mask(wsi, mask, tile_size=(512, 512), manifest=path_manifest)
+        self.assertTrue(all(value[1] == (512, 512) for value in metadata_other.values()))
+
+    # ------------------------------------------------ #
+    #          Test: Thumbnail Tissue Prefilter        #
+    # ------------------------------------------------ #
+    def test_tissue_prefilter(self):
+        tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir.cleanup)
+        wsi = load_wsi(self.path_img, tile_dir.name)
+        metadata = {}
+        reads = {}
+        for prefilter in [False, True]:
+            tiler = AwesomeTiler(tile_size=(128, 128), tissue_percent=10.0, prefilter=prefilter)
+            metadata[prefilter] = tiler.extract(wsi, extraction_mask=BiggestTissueBoxMask())
+            reads[prefilter] = tiler.stats.calls["read"]
+        # Empty corners of the tissue box are skipped, the accepted tiles are unchanged
+        self.assertGreater(tiler.prefilter_stats["skipped_reads"], 0)
+        self.assertEqual(reads[False] - reads[True], tiler.prefilter_stats["skipped_reads"])
+        self.assertEqual(metadata[True], metadata[False])
+
+    # ------------------------------------------------ #
+    #          Test: Stage Timers and Counters         #
+    # ------------------------------------------------ #
+    def test_tiling_stats(self):
+        summaries = []
+        for workers in [1, 2]:
+            metadata, summary = self._tile(workers=workers, return_stats=True)
+            summaries.append(summary)
+            counters = summary["counters"]
+            self.assertEqual(counters["tiles"], len(metadata))
+            self.assertEqual(
+                counters["candidates"],
+                counters["tiles"] + counters.get("rejected", 0) + counters.get("invalid", 0),
+            )
+            for stage in ["coordinates", "read", "tissue_check", "read_mask", "encode", "write"]:
+                self.assertGreater(summary["stages"][stage]["seconds"], 0)
+            self.assertEqual(summary["stages"]["read"]["calls"], counters["candidates"])
+        # Superblocks do not span the chunks of the workers, only the reads may differ
+        for summary in summaries:
+            self.assertGreater(summary["counters"].pop("slide_reads"), 0)
+        self.assertEqual(summaries[0]["counters"], summaries[1]["counters"])
+        self.assertGreater(summaries[0]["throughput"]["tiles_per_s"], 0)
+
+        metadata, dir_img, dir_mask = self._tile()
+        written = sum(os.path.getsize(os.path.join(directory, tile_filename))
+                      for directory in [dir_img, dir_mask] for tile_filename in metadata)
+        self.assertEqual(summaries[0]["counters"]["written_bytes"], written)
+
+    # ------------------------------------------------ #
+    #          Test: Encoder Threads and Codecs        #
+    # ------------------------------------------------ #
+    def _extract(self, tiler, **kwargs):
+        tile_dir_img = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        tile_dir_mask = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(tile_dir_img.cleanup)
+        self.addCleanup(tile_dir_mask.cleanup)
+        wsi = load_wsi(self.path_img, tile_dir_img.name)
+        mask = load_mask(self.path_mask, tile_dir_mask.name)
+        metadata = tiler.extract(wsi, mask, extraction_mask=TissueMask(), **kwargs)
+        return metadata, tile_dir_img.name, tile_dir_mask.name
+
+    def test_encoder_threads_and_codecs(self):
+        def tiler(**kwargs):
+            return AwesomeTiler(tile_size=(256, 256), tissue_percent=10.0, mask_mode="label", **kwargs)
+
+        def read_files(directory):
+            return {name: open(os.path.join(directory, name), "rb").read() for name in os.listdir(directory)}
+
+        outputs = [self._extract(tiler(), encoders=encoders, max_pending=3) for encoders in [0, 1, 3]]
+        self.assertGreater(len(outputs[0][0]), 0)
+        for metadata, dir_img, dir_mask in outputs[1:]:
+            self.assertEqual(list(metadata), list(outputs[0][0]))
+            self.assertEqual(read_files(dir_img), read_files(outputs[0][1]))
+            self.assertEqual(read_files(dir_mask), read_files(outputs[0][2]))
+
+        metadata, dir_img, dir_mask = self._extract(tiler(
+            suffix=".jpg",
+            image_codec=TileCodec("jpeg", quality=80),
+            mask_codec=TileCodec("webp", lossless=True),
+        ))
+        self.assertEqual(len(metadata), len(outputs[0][0]))
+        for tile_filename, reference in zip(metadata, outputs[0][0]):
+            with Image.open(os.path.join(dir_img, tile_filename)) as image:
+                self.assertEqual(image.format, "JPEG")
+            mask_filename = tile_filename.replace(".jpg", ".webp")
+            with Image.open(os.path.join(dir_mask, mask_filename)) as mask:
+                self.assertEqual(mask.format, "WEBP")
+                self.assertTrue(np.array_equal(
+                    np.asarray(mask.convert("L")), np.asarray(Image.open(os.path.join(outputs[0][2], reference)))
+                ))
+
+        with self.assertRaises(ValueError):
+            tiler(suffix=".jpg", mask_codec=TileCodec("jpeg"))
+        with self.assertRaises(ValueError):
+            tiler(mask_codec=TileCodec("webp", quality=90))
+        with self.assertRaises(ValueError):
+            tiler(suffix=".png", image_codec=TileCodec("jpeg"))
+        self.assertEqual(tiler(suffix=".jpg").mask_codec, TileCodec("png"))
+
+    # ------------------------------------------------ #
+    #              Test: Superblock Reads              #
+    # ------------------------------------------------ #
+    def test_superblock_reads(self):
+        def read_files(directory):
+            return {name: open(os.path.join(directory, name), "rb").read() for name in os.listdir(directory)}
+
+        for kwargs in [dict(mask_mode="label", mask_lut={(255, 255, 255): 1}), dict(pixel_overlap=56)]:
+            outputs, reads = [], []
+            for superblock_bytes in [0, 1 << 20]:
+                tiler = AwesomeTiler(tile_size=(256, 256), tissue_percent=10.0,
+                                     superblock_bytes=superblock_bytes, **kwargs)
+                outputs.append(self._extract(tiler, encoders=0))
+                reads.append(tiler.stats.counters["slide_reads"])
+            self.assertGreater(len(outputs[0][0]), 0)
+            self.assertEqual(outputs[1][0], outputs[0][0])
+            self.assertEqual(read_files(outputs[1][1]), read_files(outputs[0][1]))
+            self.assertEqual(read_files(outputs[1][2]), read_files(outputs[0][2]))
+            self.assertLess(reads[1], reads[0] / 2)
+
+        # Level 1 of a pyramid, with a memory limit of 3 tiles per superblock
+        pyramid_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(pyramid_dir.cleanup)
+        path_pyramid = convert_to_pyramidal_tiff(
+            self.path_img, os.path.join(pyramid_dir.name, "pyramid.tiff"), min_level_size=256
+        )
+        wsi = load_wsi(path_pyramid, pyramid_dir.name)
+        coordinates = [CoordinatePair(512, y, 768, y + 256) for y in range(0, 2000, 200)]
+        reader = SuperblockReader(wsi, 1, (128, 128), coordinates, max_bytes=3 * 128 * 128 * 4)
+        for coords in coordinates:
+            expected = wsi._wsi.read_region((coords.x_ul, coords.y_ul), 1, (128, 128))
+            self.assertTrue(np.array_equal(reader.read_array(coords), np.asarray(expected)))
+        self.assertEqual(reader.n_reads, 4)
+
+    # ------------------------------------------------ #
+    #       Test: Label Histograms and Sampling        #
+    # ------------------------------------------------ #
+    def test_label_counts_and_sampling(self):
+        lut = {(255, 255, 255): 1}
+        metadata, _, dir_mask = self._tile(mask_mode="label", mask_lut=lut)
+        self.assertEqual(metadata.label_counts.shape, (len(metadata), 2))
+        for tile_filename, label_counts in zip(metadata, metadata.label_counts):
+            labels = np.asarray(Image.open(os.path.join(dir_mask, tile_filename)))
+            self.assertEqual(list(label_counts), list(np.bincount(labels.ravel(), minlength=2)))
+        self.assertEqual(list(metadata.to_pandas().columns[-3:]), ["label_0", "label_1", "filename"])
+        metadata_rgb, _, _ = self._extract(AwesomeTiler(tile_size=(256, 256), tissue_percent=10.0,
+                                                        superblock_bytes=0))
+        self.assertTrue(np.array_equal(metadata_rgb.label_counts[:, [0, 255]], metadata.label_counts))
+
+        sampler = LabelSampler(max_per_class=3, min_foreground=0.2)
+        self.assertEqual(sampler.tile_class(np.array([90, 10])), 0)
+        self.assertEqual(sampler.tile_class(np.array([70, 30])), 1)
+        foreground = metadata.label_counts[:, 1] >= 0.2 * metadata.label_counts.sum(axis=1)
+        self.assertGreater(np.count_nonzero(~foreground), 0)
+        expected = [name for name, keep in zip(metadata, foreground) if keep][:3]
+
+        for workers in [1, 2]:
+            sampled, summary = self._tile(mask_mode="label", mask_lut=lut, sampler=sampler,
+                                          workers=workers, return_stats=True)
+            self.assertEqual(sampler.counts, {1: 3})
+            self.assertEqual([sampled[name] for name in sampled], [metadata[name] for name in expected])
+            self.assertEqual(summary["counters"]["unsampled"], len(metadata) - 3)
+            # Workers encode the foreground tiles, quotas are applied when writing
+            n_encoded = 3 if workers == 1 else np.count_nonzero(foreground)
+            self.assertEqual(summary["stages"]["encode"]["calls"], 2 * n_encoded)
+
+        with self.assertRaises(ValueError):
+            AwesomeTiler(tile_size=(256, 256), sampler=sampler).extract(load_wsi(self.path_img, dir_mask))
+
+    # ------------------------------------------------ #
+    #           Test: Columnar Tile Metadata           #
+    # ------------------------------------------------ #
+    def test_columnar_metadata(self):
+        metadata, _, dir_mask = self._tile()
+        frame = metadata.to_pandas()
+        self.assertEqual(list(frame["filename"]), list(metadata))
+        self.assertTrue(np.shares_memory(frame["tissue_ratio"].to_numpy(), metadata.columns["tissue_ratio"]))
+        for tile_filename, row in zip(metadata, frame.itertuples()):
+            self.assertEqual(metadata[tile_filename], [row.tissue_ratio, (256, 256), (row.x_ul, row.y_ul)])
+            mask = np.asarray(Image.open(os.path.join(dir_mask, tile_filename)))[..., :3].any(axis=-1)
+            self.assertAlmostEqual(row.label_ratio, mask.mean(), places=6)
+
+        output_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.addCleanup(output_dir.cleanup)
+        for extension in [".npz", ".parquet", ".feather"]:
+            path = os.path.join(output_dir.name, "metadata" + extension)
+            metadata.save(path)
+            loaded = TileMetadata.load(path)
+            self.assertEqual(loaded, metadata)
+            self.assertEqual(loaded.tile_size, metadata.tile_size)
+            self.assertTrue(loaded.to_pandas().equals(frame))
+
+        both = TileMetadata.concat([metadata, loaded])
+        self.assertEqual(len(both), 2 * len(metadata))
+        self.assertEqual(both["slide"].nunique(), 1)
+        self.assertTrue(np.array_equal(both["tile"][len(metadata):], np.arange(len(metadata))))
+
+
+# ---------------------------------------------------- #
+#          Unittest: Grid Coordinate Generation        #
+# ---------------------------------------------------- #
+class _FakeSlide:
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def level_dimensions(self, level=0):
+        return self.dimensions
+
+
+def _reference_grid_coordinates(tiler, bbox_coordinates_lvl, slide, binary_mask_region):
+    # Per-tile loop the vectorized grid generation has to reproduce exactly
+    tile_w_lvl, tile_h_lvl = tiler.tile_size
+    for i in range(tiler._n_tiles_row(bbox_coordinates_lvl)):
+        for j in range(tiler._n_tiles_column(bbox_coordinates_lvl)):
+            x_ul_lvl = np.clip(bbox_coordinates_lvl.x_ul + tile_w_lvl * i - tiler.pixel_overlap * i,
+                               bbox_coordinates_lvl.x_ul, None)
+            y_ul_lvl = np.clip(bbox_coordinates_lvl.y_ul + tile_h_lvl * j - tiler.pixel_overlap * j,
+                               bbox_coordinates_lvl.y_ul, None)
+            tile_lvl_coords = CoordinatePair(x_ul_lvl, y_ul_lvl, x_ul_lvl + tile_w_lvl, y_ul_lvl + tile_h_lvl)
+            tile_thumb_coords = scale_coordinates(tile_lvl_coords, slide.level_dimensions(),
+                                                  binary_mask_region.shape[::-1])
+            if tiler._are_coordinates_within_extraction_mask(tile_thumb_coords, binary_mask_region):
+                yield scale_coordinates(tile_lvl_coords, slide.level_dimensions(), slide.level_dimensions(0))
+
+
+class GridCoordinatesTEST(unittest.TestCase):
+    def test_vectorized_grid_matches_reference(self):
+        rng = np.random.default_rng(0)
+        slide = _FakeSlide((15040, 18048))
+        for tile_size, pixel_overlap in [((1024, 1024), 0), ((256, 128), 0), ((300, 300), 40), ((97, 211), -15)]:
+            tiler = AwesomeTiler(tile_size=tile_size, pixel_overlap=pixel_overlap)
+            for _ in range(3):
+                binary_mask = rng.random((180, 150)) > rng.uniform(0.05, 0.6)
+                x_ul, y_ul = rng.integers(0, 5000, 2)
+                bbox = CoordinatePair(x_ul, y_ul, x_ul + rng.integers(0, 10000), y_ul + rng.integers(0, 13000))
+                expected = list(_reference_grid_coordinates(tiler, bbox, slide, binary_mask))
+                result = list(tiler._grid_coordinates_from_bbox_coordinates(bbox, slide, binary_mask))
+                self.assertEqual(result, expected)
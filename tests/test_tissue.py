@@ -0,0 +1,99 @@
+# =========================================================== #
+#  Author:       Hackathon UKSH Team 14 - Patho-Pix           #
+#  Copyright:    Patho-Pix Team - 2024                        #
+# =========================================================== #
+# -----------------------------------------------------#
+#                   Library imports                    #
+# -----------------------------------------------------#
+# Standard Library
+import importlib.util
+import tempfile
+import unittest
+
+# Third Party
+import numpy as np
+from histolab.masks import TissueMask
+from PIL import Image
+
+# patho_pix
+from patho_pix.io import load_wsi
+from patho_pix.utils import AwesomeTiler, TissueScorer
+from patho_pix.utils.tissue import _grayscale
+from tests.synthetic import create_synthetic_pair
+
+
+# ---------------------------------------------------- #
+#               Unittest: Tissue Scoring               #
+# ---------------------------------------------------- #
+class TissueScorerTEST(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.tmp_data = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+        self.path_img, _ = create_synthetic_pair(self.tmp_data.name)
+        self.wsi = load_wsi(self.path_img, self.tmp_data.name)
+        tiler = AwesomeTiler(tile_size=(128, 128), cache=False)
+        tiler._prepare(self.wsi)
+        # Candidate tiles of the tissue
+        self.tiles = [
+            self.wsi.extract_tile(coords, tile_size=(128, 128), level=0)
+            for coords in tiler._grid_coordinates_generator(self.wsi, TissueMask())
+        ]
+        self.stack = np.stack([np.asarray(tile.image) for tile in self.tiles])
+
+    def test_matches_histolab_check(self):
+        scorer = TissueScorer().fit(self.wsi.thumbnail)
+        self.assertGreater(scorer.slide_threshold, 0)
+        for tissue_percent in (10.0, 50.0, 90.0):
+            enough, ratios = scorer.score(self.stack, tissue_percent)
+            reference = np.array([tile.has_enough_tissue(tissue_percent) for tile in self.tiles])
+            self.assertGreaterEqual(np.mean(enough == reference), 0.95)
+        reference_ratios = np.array([tile.tissue_ratio for tile in self.tiles])
+        self.assertLess(np.abs(scorer.tissue_ratio(self.stack) - reference_ratios).mean(), 0.02)
+
+        blank = np.full((2, 64, 64, 4), 235, dtype=np.uint8)
+        blank[1, ..., 3] = 0
+        self.assertFalse(scorer.score(blank, 10.0)[0].any())
+        self.assertTrue(np.array_equal(scorer.tissue_ratio(blank), [0.0, 0.0]))
+
+    def test_threshold_and_grayscale(self):
+        pixels = np.random.default_rng(0).integers(0, 256, (32, 48, 4), dtype=np.uint8)
+        self.assertTrue(np.array_equal(_grayscale(pixels), np.asarray(Image.fromarray(pixels).convert("L"))))
+        with self.assertRaises(ValueError):
+            TissueScorer().score(self.stack, 10.0)
+        with self.assertRaises(ValueError):
+            TissueScorer(backend="cupy")
+        # A fixed threshold is kept by fit
+        scorer = TissueScorer(threshold=100.0, dilation=0).fit(self.wsi.thumbnail)
+        self.assertIsNone(scorer.slide_threshold)
+        gray = _grayscale(self.stack)
+        self.assertTrue(np.allclose(scorer.tissue_ratio(self.stack), (gray < 100).mean(axis=(1, 2))))
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_torch_backend(self):
+        scorer = TissueScorer().fit(self.wsi.thumbnail)
+        enough, ratios = scorer.score(self.stack, 50.0)
+        scorer.backend = "torch"
+        enough_torch, ratios_torch = scorer.score(self.stack, 50.0)
+        self.assertTrue(np.array_equal(enough, enough_torch))
+        self.assertTrue(np.allclose(ratios, ratios_torch))
+
+    def test_tiler_with_scorer(self):
+        def extract(workers=1, **kwargs):
+            tile_dir = tempfile.TemporaryDirectory(prefix="tmp.patho-pix.")
+            self.addCleanup(tile_dir.cleanup)
+            tiler = AwesomeTiler(tile_size=(128, 128), tissue_percent=50.0, **kwargs)
+            wsi = load_wsi(self.path_img, tile_dir.name)
+            return tiler.extract(wsi, extraction_mask=TissueMask(), workers=workers), tiler
+
+        reference, _ = extract()
+        metadata, tiler = extract(tissue_scorer=TissueScorer(batch_size=16))
+        self.assertGreater(len(metadata), 0)
+        # Same tiles, with the tissue ratios of the scorer
+        self.assertEqual(list(metadata), list(reference))
+        self.assertLess(
+            np.abs(metadata.columns["tissue_ratio"] - reference.columns["tissue_ratio"]).max(), 0.05
+        )
+        # One vectorized check per block of tiles
+        self.assertLessEqual(tiler.stats.calls["tissue_check"], -(-tiler.stats.counters["candidates"] // 16))
+        parallel, _ = extract(workers=2, tissue_scorer=TissueScorer(batch_size=16))
+        self.assertEqual(parallel, metadata)